@@ -0,0 +1,28 @@
+"""add appointments emr_id index
+
+Revision ID: 030429fb3926
+Revises: 67c3552a2705
+Create Date: 2026-10-18 16:27:53.804115
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '030429fb3926'
+down_revision: Union[str, None] = '67c3552a2705'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index('ix_appointments_emr_id', 'appointments', ['emr_id'], unique=False, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_appointments_emr_id', table_name='appointments', postgresql_concurrently=True)
@@ -0,0 +1,55 @@
+"""add doctor schedules
+
+Revision ID: 06da4c6a8322
+Revises: 58bd294c31a1
+Create Date: 2026-10-18 21:05:43.518902
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '06da4c6a8322'
+down_revision: Union[str, None] = '58bd294c31a1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('doctor_schedules',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('doctor_id', sa.Integer(), nullable=False),
+    sa.Column('weekday', sa.Integer(), nullable=False),
+    sa.Column('start_time', sa.Time(), nullable=False),
+    sa.Column('end_time', sa.Time(), nullable=False),
+    sa.Column('slot_minutes', sa.Integer(), nullable=False),
+    sa.Column('capacity', sa.Integer(), server_default=sa.text('1'), nullable=False),
+    sa.ForeignKeyConstraint(['doctor_id'], ['doctors.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_doctor_schedules_id'), 'doctor_schedules', ['id'], unique=False)
+    op.create_index(op.f('ix_doctor_schedules_doctor_id'), 'doctor_schedules', ['doctor_id'], unique=False)
+    op.add_column('appointments', sa.Column('ends_at', sa.DateTime(timezone=True), nullable=True))
+    op.add_column('appointments', sa.Column('seat', sa.Integer(), nullable=True))
+
+    if op.get_bind().dialect.name == 'postgresql':
+        # a seat of a doctor's slot can only be held once; SQLite relies on the check in book_slot
+        op.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+        op.execute(
+            "ALTER TABLE appointments ADD CONSTRAINT ex_appointments_doctor_seat_time "
+            "EXCLUDE USING gist (doctor_id WITH =, seat WITH =, tstzrange(appointment_date, ends_at) WITH &&) "
+            "WHERE (ends_at IS NOT NULL AND status <> 'CANCELLED')"
+        )
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('ALTER TABLE appointments DROP CONSTRAINT IF EXISTS ex_appointments_doctor_seat_time')
+    op.drop_column('appointments', 'seat')
+    op.drop_column('appointments', 'ends_at')
+    op.drop_index(op.f('ix_doctor_schedules_doctor_id'), table_name='doctor_schedules')
+    op.drop_index(op.f('ix_doctor_schedules_id'), table_name='doctor_schedules')
+    op.drop_table('doctor_schedules')
@@ -0,0 +1,29 @@
+"""add created_at to patients
+
+Revision ID: 4c06a075593f
+Revises: 030429fb3926
+Create Date: 2026-10-18 17:12:30.482916
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4c06a075593f'
+down_revision: Union[str, None] = '030429fb3926'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # existing patients get the migration time, there is no better registration date on record
+    op.add_column('patients', sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('CURRENT_TIMESTAMP'), nullable=False))
+    op.create_index('ix_patients_created_at', 'patients', ['created_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_patients_created_at', table_name='patients')
+    op.drop_column('patients', 'created_at')
@@ -0,0 +1,28 @@
+"""add version to patients and doctors
+
+Revision ID: 58bd294c31a1
+Revises: 4c06a075593f
+Create Date: 2026-10-18 18:40:11.207315
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '58bd294c31a1'
+down_revision: Union[str, None] = '4c06a075593f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('patients', sa.Column('version', sa.Integer(), server_default=sa.text('1'), nullable=False))
+    op.add_column('doctors', sa.Column('version', sa.Integer(), server_default=sa.text('1'), nullable=False))
+
+
+def downgrade() -> None:
+    op.drop_column('doctors', 'version')
+    op.drop_column('patients', 'version')
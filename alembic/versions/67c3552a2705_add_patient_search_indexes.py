@@ -0,0 +1,66 @@
+"""add patient search indexes
+
+Revision ID: 67c3552a2705
+Revises: 9d7984e7fe17
+Create Date: 2026-10-18 15:41:09.527183
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '67c3552a2705'
+down_revision: Union[str, None] = '9d7984e7fe17'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TRIGRAM_COLUMNS = ('first_name', 'last_name', 'hospital_card_id')
+
+SQLITE_FTS = (
+    "CREATE VIRTUAL TABLE patients_fts USING fts5("
+    "first_name, last_name, hospital_card_id, content='patients', content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER patients_fts_insert AFTER INSERT ON patients BEGIN "
+    "INSERT INTO patients_fts(rowid, first_name, last_name, hospital_card_id) "
+    "VALUES (new.id, new.first_name, new.last_name, new.hospital_card_id); END",
+    "CREATE TRIGGER patients_fts_delete AFTER DELETE ON patients BEGIN "
+    "INSERT INTO patients_fts(patients_fts, rowid, first_name, last_name, hospital_card_id) "
+    "VALUES ('delete', old.id, old.first_name, old.last_name, old.hospital_card_id); END",
+    "CREATE TRIGGER patients_fts_update AFTER UPDATE OF first_name, last_name, hospital_card_id ON patients BEGIN "
+    "INSERT INTO patients_fts(patients_fts, rowid, first_name, last_name, hospital_card_id) "
+    "VALUES ('delete', old.id, old.first_name, old.last_name, old.hospital_card_id); "
+    "INSERT INTO patients_fts(rowid, first_name, last_name, hospital_card_id) "
+    "VALUES (new.id, new.first_name, new.last_name, new.hospital_card_id); END",
+    "INSERT INTO patients_fts(patients_fts) VALUES ('rebuild')",
+)
+
+
+def upgrade() -> None:
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        with op.get_context().autocommit_block():
+            for column in TRIGRAM_COLUMNS:
+                op.create_index('ix_patients_%s_trgm' % column, 'patients', [column], unique=False,
+                                postgresql_using='gin', postgresql_ops={column: 'gin_trgm_ops'},
+                                postgresql_concurrently=True)
+            op.create_index('ix_patients_hospital_card_id_pattern', 'patients', ['hospital_card_id'], unique=False,
+                            postgresql_ops={'hospital_card_id': 'varchar_pattern_ops'}, postgresql_concurrently=True)
+    elif dialect == 'sqlite':
+        for statement in SQLITE_FTS:
+            op.execute(statement)
+
+
+def downgrade() -> None:
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        with op.get_context().autocommit_block():
+            op.drop_index('ix_patients_hospital_card_id_pattern', table_name='patients', postgresql_concurrently=True)
+            for column in reversed(TRIGRAM_COLUMNS):
+                op.drop_index('ix_patients_%s_trgm' % column, table_name='patients', postgresql_concurrently=True)
+    elif dialect == 'sqlite':
+        for trigger in ('patients_fts_update', 'patients_fts_delete', 'patients_fts_insert'):
+            op.execute('DROP TRIGGER IF EXISTS %s' % trigger)
+        op.execute('DROP TABLE IF EXISTS patients_fts')
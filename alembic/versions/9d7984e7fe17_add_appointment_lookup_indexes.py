@@ -0,0 +1,40 @@
+"""add appointment lookup indexes
+
+Revision ID: 9d7984e7fe17
+Revises: 01788b62349e
+Create Date: 2026-10-18 15:02:41.118310
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9d7984e7fe17'
+down_revision: Union[str, None] = '01788b62349e'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+OPEN_STATUSES = "status IN ('PENDING', 'IN_PROGRESS')"
+
+
+def upgrade() -> None:
+    # CONCURRENTLY keeps appointments writable while the indexes build; it cannot run in a transaction
+    with op.get_context().autocommit_block():
+        op.create_index('ix_appointments_patient_id_status', 'appointments', ['patient_id', 'status'], unique=False, postgresql_concurrently=True)
+        op.create_index('ix_appointments_doctor_id_status', 'appointments', ['doctor_id', 'status'], unique=False, postgresql_concurrently=True)
+        op.create_index('ix_appointments_patient_id_doctor_id', 'appointments', ['patient_id', 'doctor_id'], unique=False, postgresql_concurrently=True)
+        op.create_index('ix_appointments_doctor_id_appointment_date', 'appointments', ['doctor_id', 'appointment_date'], unique=False, postgresql_concurrently=True)
+        op.create_index('ix_appointments_open_patient_id', 'appointments', ['patient_id'], unique=False, postgresql_concurrently=True,
+                        postgresql_where=sa.text(OPEN_STATUSES), sqlite_where=sa.text(OPEN_STATUSES))
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_appointments_open_patient_id', table_name='appointments', postgresql_concurrently=True)
+        op.drop_index('ix_appointments_doctor_id_appointment_date', table_name='appointments', postgresql_concurrently=True)
+        op.drop_index('ix_appointments_patient_id_doctor_id', table_name='appointments', postgresql_concurrently=True)
+        op.drop_index('ix_appointments_doctor_id_status', table_name='appointments', postgresql_concurrently=True)
+        op.drop_index('ix_appointments_patient_id_status', table_name='appointments', postgresql_concurrently=True)
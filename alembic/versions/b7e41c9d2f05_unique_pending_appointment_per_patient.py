@@ -0,0 +1,32 @@
+"""unique pending appointment per patient
+
+Revision ID: b7e41c9d2f05
+Revises: 06da4c6a8322
+Create Date: 2026-10-18 22:14:06.482913
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7e41c9d2f05'
+down_revision: Union[str, None] = '06da4c6a8322'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+PENDING = "status = 'PENDING'"
+
+
+def upgrade() -> None:
+    # fails if a patient already has several pending appointments; cancel the extra ones first
+    with op.get_context().autocommit_block():
+        op.create_index('ix_appointments_pending_patient_id', 'appointments', ['patient_id'], unique=True, postgresql_concurrently=True,
+                        postgresql_where=sa.text(PENDING), sqlite_where=sa.text(PENDING))
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_appointments_pending_patient_id', table_name='appointments', postgresql_concurrently=True)
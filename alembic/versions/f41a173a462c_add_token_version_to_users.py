@@ -0,0 +1,28 @@
+"""add token_version to patients and doctors
+
+Revision ID: f41a173a462c
+Revises: 679650962b07
+Create Date: 2026-10-18 10:02:41.118204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f41a173a462c'
+down_revision: Union[str, None] = '679650962b07'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('doctors', sa.Column('token_version', sa.Integer(), server_default=sa.text('0'), nullable=False))
+    op.add_column('patients', sa.Column('token_version', sa.Integer(), server_default=sa.text('0'), nullable=False))
+
+
+def downgrade() -> None:
+    op.drop_column('patients', 'token_version')
+    op.drop_column('doctors', 'token_version')
@@ -0,0 +1,428 @@
+import os
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Hashable, List, Optional
+
+import orjson
+from dotenv import load_dotenv
+from fastapi.concurrency import run_in_threadpool
+from app import metrics
+
+load_dotenv()
+
+PRINCIPAL_CACHE_SIZE = int(os.getenv('PRINCIPAL_CACHE_SIZE', 1024))
+PRINCIPAL_CACHE_TTL = float(os.getenv('PRINCIPAL_CACHE_TTL', 60))
+TOKEN_VERSION_CACHE_TTL = float(os.getenv('TOKEN_VERSION_CACHE_TTL', 30))
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', 4096))
+# upper bound only, entries normally expire with the token's own `exp`
+TOKEN_CACHE_MAX_TTL = float(os.getenv('TOKEN_CACHE_MAX_TTL', 3600))
+# memory:// keeps everything in this process; redis://host:6379/0 (any Redis-protocol server) shares it between workers
+CACHE_URL = os.getenv('CACHE_URL', 'memory://')
+CACHE_KEY_PREFIX = os.getenv('CACHE_KEY_PREFIX', 'medflow:')
+# a slow cache server must not hold up requests for longer than this; errors count as misses
+CACHE_SOCKET_TIMEOUT = float(os.getenv('CACHE_SOCKET_TIMEOUT', 1))
+
+
+class TTLCache:
+    """Thread-safe LRU cache with a bounded size and a per-entry time to live."""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # set by SharedCache.attach(): tells the other workers which keys to drop
+        self.broadcast: Optional[Callable[[List[Hashable]], None]] = None
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[1] <= time.monotonic():
+                del self._data[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, *keys: Hashable):
+        self.evict(*keys)
+        if self.broadcast is not None:
+            self.broadcast(list(keys))
+
+    def evict(self, *keys: Hashable):
+        # local only, for invalidations received from other workers
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+class CacheBackend(ABC):
+    """Key/value store plus a pub/sub channel, shared by every worker that connects to it."""
+
+    # exceptions that mean the backend is unavailable; callers degrade to a cache miss
+    errors: tuple = ()
+    # calls wait on the network: async code makes them through off_loop()
+    blocking: bool = False
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[bytes]:
+        ...
+
+    @abstractmethod
+    def set(self, key: str, value: bytes, ttl: float):
+        ...
+
+    @abstractmethod
+    def incr(self, key: str) -> int:
+        ...
+
+    @abstractmethod
+    def publish(self, channel: str, message: bytes):
+        ...
+
+    @abstractmethod
+    def subscribe(self, channel: str, handler: Callable[[bytes], None]):
+        ...
+
+    @abstractmethod
+    def reset(self, prefix: str = ""):
+        ...
+
+    def close(self):
+        pass
+
+
+class InMemoryCacheBackend(CacheBackend):
+    """Single-process stand-in for Redis: the default with one worker, and for tests."""
+
+    def __init__(self, max_keys: int = 10_000):
+        self.max_keys = max_keys
+        self._data = {}
+        self._subscribers = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[1] is not None and entry[1] <= time.monotonic():
+                del self._data[key]
+                entry = None
+            return entry[0] if entry is not None else None
+
+    def set(self, key: str, value: bytes, ttl: float):
+        now = time.monotonic()
+        with self._lock:
+            self._data[key] = (value, now + ttl)
+            if len(self._data) > self.max_keys:
+                # values under retired versions are never read again, expiry is what removes them
+                for stale in [k for k, (_, expires_at) in self._data.items() if expires_at is not None and expires_at <= now]:
+                    del self._data[stale]
+                while len(self._data) > self.max_keys:
+                    del self._data[next(iter(self._data))]
+
+    def incr(self, key: str) -> int:
+        with self._lock:
+            value = int(self._data.get(key, (b"0", None))[0]) + 1
+            self._data[key] = (str(value).encode(), None)
+        return value
+
+    def publish(self, channel: str, message: bytes):
+        for handler in list(self._subscribers[channel]):
+            handler(message)
+
+    def subscribe(self, channel: str, handler: Callable[[bytes], None]):
+        self._subscribers[channel].append(handler)
+
+    def reset(self, prefix: str = ""):
+        with self._lock:
+            for key in [key for key in self._data if key.startswith(prefix)]:
+                del self._data[key]
+
+    def close(self):
+        self._subscribers.clear()
+
+
+class RedisCacheBackend(CacheBackend):
+    """Redis, Valkey or any other Redis-protocol server; needs the `redis` package."""
+
+    blocking = True
+
+    def __init__(self, url: str):
+        import redis
+
+        self.errors = (redis.RedisError,)
+        self._client = redis.Redis.from_url(
+            url, socket_timeout=CACHE_SOCKET_TIMEOUT, socket_connect_timeout=CACHE_SOCKET_TIMEOUT)
+        self._pubsub = None
+        self._listener = None
+
+    @property
+    def client(self):
+        return self._client
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self._client.get(key)
+
+    def set(self, key: str, value: bytes, ttl: float):
+        self._client.set(key, value, px=max(1, int(ttl * 1000)))
+
+    def incr(self, key: str) -> int:
+        return self._client.incr(key)
+
+    def publish(self, channel: str, message: bytes):
+        self._client.publish(channel, message)
+
+    def subscribe(self, channel: str, handler: Callable[[bytes], None]):
+        # messages are handled on a daemon thread; redis-py resubscribes after reconnects
+        self._pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+        self._pubsub.subscribe(**{channel: lambda message: handler(message["data"])})
+        self._listener = self._pubsub.run_in_thread(sleep_time=1, daemon=True)
+
+    def reset(self, prefix: str = ""):
+        for key in self._client.scan_iter(match=prefix + "*"):
+            self._client.delete(key)
+
+    def close(self):
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+        if self._pubsub is not None:
+            self._pubsub.close()
+            self._pubsub = None
+        self._client.close()
+
+
+async def off_loop(backend, func: Callable, *args):
+    # a blocking backend can take up to CACHE_SOCKET_TIMEOUT per call; waiting for it on the
+    # event loop would hold up every other request, so those calls go to the threadpool
+    if backend.blocking:
+        return await run_in_threadpool(func, *args)
+    return func(*args)
+
+
+def cache_backend(url: str) -> CacheBackend:
+    scheme = url.split("://", 1)[0]
+    if scheme == "memory":
+        return InMemoryCacheBackend()
+    if scheme in ("redis", "rediss", "unix"):
+        return RedisCacheBackend(url)
+    raise ValueError("Unsupported CACHE_URL scheme '%s'" % scheme)
+
+
+class SharedCache:
+    """Versioned keys and cross-worker invalidation on top of a CacheBackend.
+
+    Each namespace has a version counter in the backend and values live under
+    `<namespace>:<version>:<key>`. Bumping the version retires every value at once, and a
+    worker still storing something computed before the bump stores it under a key nobody reads.
+    Every bump is also broadcast so each worker can drop what it keeps in process.
+
+    Invalidations are often sent from the event loop (commit hooks of async sessions, CRUD
+    code), so with a blocking backend they are handed to a single sender thread, which keeps
+    them in order. Local handlers still run right away, and a namespace whose bump has not
+    reached the backend yet is not read from or stored in it.
+    """
+
+    def __init__(self, backend: CacheBackend, prefix: str = CACHE_KEY_PREFIX):
+        self.backend = backend
+        self.prefix = prefix
+        self.channel = prefix + "invalidate"
+        self.origin = uuid.uuid4().hex
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.published = 0
+        self.received = 0
+        self._handlers = defaultdict(list)
+        self._listening = False
+        self._pending = defaultdict(int)
+        self._sender: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def versioned_key(self, namespace: str, key: str) -> Optional[str]:
+        """Read the namespace version before computing a value, and store the value under this key."""
+        if self._pending[namespace]:
+            # the stored value may predate a write this worker has already seen
+            return None
+        try:
+            version = self.backend.get(self.prefix + "version:" + namespace)
+        except self.backend.errors:
+            self.errors += 1
+            return None
+        return "%s%s:%d:%s" % (self.prefix, namespace, int(version or 0), key)
+
+    def get(self, key: Optional[str]) -> Optional[bytes]:
+        value = None
+        if key is not None:
+            try:
+                value = self.backend.get(key)
+            except self.backend.errors:
+                self.errors += 1
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key: Optional[str], value: bytes, ttl: float):
+        if key is None:
+            return
+        try:
+            self.backend.set(key, value, ttl)
+        except self.backend.errors:
+            self.errors += 1
+
+    def invalidate(self, namespace: str, *keys: Hashable):
+        """Retire the namespace's values everywhere and tell every worker which rows changed."""
+        self._send(namespace, list(keys), bump=True)
+
+    def broadcast(self, namespace: str, keys: List[Hashable]):
+        self._send(namespace, keys, bump=False)
+
+    def _send(self, namespace: str, keys: List[Hashable], bump: bool):
+        if self.backend.blocking:
+            with self._lock:
+                self._pending[namespace] += bump
+                if self._sender is None:
+                    self._sender = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cache-broadcast")
+                self._sender.submit(self._deliver, namespace, keys, bump)
+        else:
+            self._deliver(namespace, keys, bump)
+        # our own handlers run right away instead of waiting for the round trip
+        self._dispatch(namespace, keys)
+
+    def _deliver(self, namespace: str, keys: List[Hashable], bump: bool):
+        try:
+            if bump:
+                try:
+                    self.backend.incr(self.prefix + "version:" + namespace)
+                except self.backend.errors:
+                    self.errors += 1
+            try:
+                self.backend.publish(self.channel, orjson.dumps({"origin": self.origin, "namespace": namespace, "keys": keys}))
+                self.published += 1
+            except self.backend.errors:
+                self.errors += 1
+        finally:
+            if bump and self.backend.blocking:
+                with self._lock:
+                    self._pending[namespace] -= 1
+
+    def subscribe(self, namespace: str, handler: Callable[[List[Hashable]], None]):
+        self._handlers[namespace].append(handler)
+
+    def attach(self, namespace: str, cache: TTLCache):
+        """Keep `cache` coherent across workers: its invalidations are broadcast and applied everywhere."""
+        cache.broadcast = lambda keys: self.broadcast(namespace, keys)
+        self.subscribe(namespace, lambda keys: cache.evict(*keys))
+
+    def _dispatch(self, namespace: str, keys: List[Hashable]):
+        for handler in self._handlers.get(namespace, ()):
+            handler(keys)
+
+    def _on_message(self, raw: bytes):
+        message = orjson.loads(raw)
+        if message["origin"] == self.origin:
+            return
+        self.received += 1
+        # JSON turns tuple keys into lists
+        keys = [tuple(key) if isinstance(key, list) else key for key in message["keys"]]
+        self._dispatch(message["namespace"], keys)
+
+    def start(self):
+        if self._listening:
+            return
+        try:
+            self.backend.subscribe(self.channel, self._on_message)
+            self._listening = True
+        except self.backend.errors:
+            # serve anyway; in-process caches still expire on their TTLs
+            self.errors += 1
+
+    def close(self):
+        with self._lock:
+            sender, self._sender = self._sender, None
+        if sender is not None:
+            # deliver what is still queued before the connection goes
+            sender.shutdown(wait=True)
+        self.backend.close()
+        self._listening = False
+
+    def reset(self):
+        self.backend.reset(self.prefix)
+        self.hits = self.misses = self.errors = self.published = self.received = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "backend": type(self.backend).__name__,
+            "listening": self._listening,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "errors": self.errors,
+            "published": self.published,
+            "received": self.received,
+        }
+
+
+shared_cache = SharedCache(cache_backend(CACHE_URL))
+
+
+# Authenticated users keyed by the token `sub` (the user's email). The CRUD services
+# invalidate entries whenever the underlying patient or doctor row changes.
+principal_cache = TTLCache(maxsize=PRINCIPAL_CACHE_SIZE, ttl=PRINCIPAL_CACHE_TTL)
+
+# Current token_version per (role, user id), used to revoke stateless tokens without
+# loading the user. Bumping a user's version must invalidate its entry.
+token_version_cache = TTLCache(maxsize=PRINCIPAL_CACHE_SIZE, ttl=TOKEN_VERSION_CACHE_TTL)
+
+# Decoded claims of already verified JWTs keyed by a digest of the raw token, so repeat
+# calls with the same bearer token skip signature verification.
+token_cache = TTLCache(maxsize=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_MAX_TTL)
+
+# evictions of users and token versions reach every worker, not just the one that made the change
+shared_cache.attach("principals", principal_cache)
+shared_cache.attach("token_versions", token_version_cache)
+
+metrics.register("shared_cache", shared_cache.stats)
+metrics.register("principal_cache", principal_cache.stats)
+metrics.register("token_version_cache", token_version_cache.stats)
+metrics.register("token_cache", token_cache.stats)
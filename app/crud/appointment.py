@@ -1,26 +1,124 @@
 from fastapi import Depends, HTTPException, status
-from sqlalchemy import or_
-from sqlalchemy.orm import Session
-from typing import Optional
-from app import models, schema
+from sqlalchemy import or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, joinedload
+from typing import Optional, Sequence
+from app import models, scheduling, schema
+from app.crud.schedules import schedule_crud_service
+from app.pagination import Page, paginate
 
 # create an appointment
 # list appointments
 # update an appointment
 # cancel/delete an appointment
 
-def create_appointment(payload: schema.AppointmentCreate, patient_id: int, db: Session) -> models.Appointment:
+# AppointmentResponse nests the patient and the doctor: both are many-to-one, so joining them
+# costs no extra rows and replaces two lazy loads per appointment during serialisation
+RESPONSE_LOADERS = (joinedload(models.Appointment.patient), joinedload(models.Appointment.doctor))
+
+def pending_appointment_error() -> HTTPException:
+    return HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="The patient already has a pending appointment. Please progress with the previous appointment or cancel it.")
+
+def book_appointment(payload: schema.AppointmentCreate, patient_id: int, current_user: schema.Principal, db: Session) -> models.Appointment:
+    """Validate the booking, claim the doctor and insert the appointment in one transaction."""
+    pending = select(models.Appointment.id).where(
+        models.Appointment.patient_id == patient_id, models.Appointment.status == schema.AppointmentStatus.PENDING).exists()
+    patient = db.execute(select(models.Patient.id, pending).where(models.Patient.id == patient_id)).first()
+    if patient is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="The patient with id '%s' does not exist" % patient_id)
+    if patient[1]:
+        raise pending_appointment_error()
+    #only patients can create an appointment
+    if current_user.role != schema.UserRole.PATIENT or current_user.id != patient_id:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only patients can create appointments.")
+
+    # doctors with working hours take bookings per slot; the rest keep the single is_available flag
+    schedules = schedule_crud_service.get_schedules(db, payload.doctor_id)
+    if schedules:
+        # the flag no longer tracks bookings here, only whether the doctor takes any at all
+        if not db.scalar(select(models.Doctor.is_available).where(models.Doctor.id == payload.doctor_id)):
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="The doctor is not available at the moment.")
+        return book_slot(payload, patient_id, schedules, db)
+
+    # check and claim in one statement: the row lock makes concurrent bookings of the same
+    # doctor queue up, and only the first still finds is_available true
+    claimed = db.execute(
+        update(models.Doctor)
+        .where(models.Doctor.id == payload.doctor_id, models.Doctor.is_available.is_(True))
+        .values(is_available=False, version=models.Doctor.version + 1)
+        .returning(models.Doctor.id)
+        # only this doctor can change; the directory patches the one entry (app/invalidation.py)
+        .execution_options(changed_ids=(payload.doctor_id,))
+    ).first()
+    if claimed is None:
+        db.rollback()
+        if db.scalar(select(models.Doctor.id).where(models.Doctor.id == payload.doctor_id)) is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="The doctor with id '%s' does not exist" % payload.doctor_id)
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="The doctor is not available at the moment.")
+
     appointment = models.Appointment(**payload.model_dump(), patient_id=patient_id)
     db.add(appointment)
+    try:
+        db.flush()
+    except IntegrityError:
+        # a concurrent booking by the same patient took the pending slot of ix_appointments_pending_patient_id;
+        # the rollback releases the doctor claimed above
+        db.rollback()
+        raise pending_appointment_error()
+    appointment_id = appointment.id
+    # a failure before this commit rolls the claim back with everything else
     db.commit()
-    db.refresh(appointment)
-    return appointment
 
-def get_appointment(offset: int, limit: int, db: Session) -> models.Appointment:
-    return db.query(models.Appointment).offset(offset).limit(limit).all()
+    return get_appointment_by_id(appointment_id, db)
+
+def book_slot(payload: schema.AppointmentCreate, patient_id: int, schedules: Sequence[models.DoctorSchedule], db: Session) -> models.Appointment:
+    """Book a free place in the slot starting at payload.appointment_date."""
+    slot = scheduling.slot_for(schedules, scheduling.localize(payload.appointment_date))
+    if slot is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="The doctor has no slot starting at %s" % payload.appointment_date.isoformat())
+
+    # Postgres rejects a place booked twice with its exclusion constraint; elsewhere the insert
+    # takes the write lock and the interval tree check below runs under it
+    enforced = db.get_bind().dialect.name == "postgresql"
+    # every lost race means another booking took a place, so at most `capacity` attempts
+    for _ in range(slot.capacity):
+        taken = {row.seat for row in schedule_crud_service.get_booked(db, payload.doctor_id, slot.start, slot.end)}
+        free = [seat for seat in range(slot.capacity) if seat not in taken]
+        if not free:
+            break
+
+        appointment = models.Appointment(**payload.model_dump(exclude={"appointment_date"}), patient_id=patient_id,
+                                         appointment_date=slot.start, ends_at=slot.end, seat=free[0])
+        db.add(appointment)
+        try:
+            db.flush()
+        except IntegrityError:
+            db.rollback()
+            if check_pending_appointment(patient_id, db):
+                raise pending_appointment_error()
+            continue
+        if not enforced and seat_conflict(appointment, slot, db):
+            db.rollback()
+            continue
+
+        appointment_id = appointment.id
+        db.commit()
+        return get_appointment_by_id(appointment_id, db)
+
+    raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="The slot is fully booked.")
+
+def seat_conflict(appointment: models.Appointment, slot: scheduling.Slot, db: Session) -> bool:
+    booked = schedule_crud_service.get_booked(db, appointment.doctor_id, slot.start, slot.end)
+    tree = scheduling.IntervalTree(
+        (scheduling.from_db(row.appointment_date), scheduling.from_db(row.ends_at), row) for row in booked)
+    return any(row.seat == appointment.seat and row.id != appointment.id for row in tree.overlapping(slot.start, slot.end))
+
+def get_appointment(offset: int, limit: int, db: Session, cursor: Optional[str] = None) -> Page:
+    statement = select(models.Appointment).options(*RESPONSE_LOADERS)
+    return paginate(db, statement, ((models.Appointment.id, False),), limit, cursor, offset)
 
 def get_appointments_by_patient_id(patient_id: int, db: Session) -> models.Appointment:
-    return db.query(models.Appointment).filter(models.Appointment.patient_id == patient_id).all()
+    return db.query(models.Appointment).options(*RESPONSE_LOADERS).filter(models.Appointment.patient_id == patient_id).all()
 
 def status_validation(patient_id: int, appointment_id: int, db: Session) -> models.Appointment:
     return db.query(models.Appointment).filter(models.Appointment.id == appointment_id, models.Appointment.patient_id == patient_id).first()
@@ -30,7 +128,7 @@ def get_uncompleted_appointments(db: Session, patient_id: int):
     return db.query(models.Appointment).filter(models.Appointment.patient_id == patient_id, or_(models.Appointment.status == schema.AppointmentStatus.PENDING, models.Appointment.status == schema.AppointmentStatus.IN_PROGRESS)).all()
 
 def get_appointment_by_id(appointment_id: int, db: Session) -> models.Appointment:
-    return db.query(models.Appointment).filter(models.Appointment.id == appointment_id).first()
+    return db.query(models.Appointment).options(*RESPONSE_LOADERS).filter(models.Appointment.id == appointment_id).first()
 
 def update_appointment(appointment_id: int, payload: schema.AppointmentUpdate, db: Session) -> models.Appointment:
     appointment = get_appointment_by_id(appointment_id, db)
@@ -38,12 +136,22 @@ def update_appointment(appointment_id: int, payload: schema.AppointmentUpdate, d
         return None
     
     apt_dict = payload.model_dump(exclude_unset=True)
+    # a slot booking holds a seat between appointment_date and ends_at; moving only the date would
+    # free the seat while keeping it booked, so a new time means cancelling and booking that slot
+    if appointment.ends_at is not None and "appointment_date" in apt_dict:
+        if scheduling.localize(apt_dict.pop("appointment_date")) != scheduling.from_db(appointment.appointment_date):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="A slot booking cannot be moved. Please cancel it and book the new slot.")
     for k, v in apt_dict.items():
         setattr(appointment, k, v)
     
-    db.commit()
-    db.refresh(appointment)
-    return appointment
+    try:
+        db.commit()
+    except IntegrityError:
+        # moved back to pending while another appointment is pending
+        db.rollback()
+        raise pending_appointment_error()
+    # reloads the expired appointment together with its patient and doctor
+    return get_appointment_by_id(appointment_id, db)
 
 def cancel_appointment(appointment_id: int, db: Session) -> models.Appointment:
     appointment = get_appointment_by_id(appointment_id, db)
@@ -55,6 +163,10 @@ def cancel_appointment(appointment_id: int, db: Session) -> models.Appointment:
     else:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Appointment in-progress or completed cannot be cancelled')
     
+    # one commit: a failure can never leave the appointment cancelled and the doctor still claimed.
+    # Slot bookings (ends_at set) never claimed the flag, which is then the doctor's own choice
+    if appointment.ends_at is None:
+        appointment.doctor.is_available = True
     db.commit()
     db.refresh(appointment)
     
@@ -1,9 +1,24 @@
-from app import models, schema
+import bisect
+import os
+import threading
+import time
+from collections import namedtuple
+from datetime import date
+from types import MappingProxyType
+from typing import Iterable, List, Mapping, NamedTuple, Optional, Sequence, Tuple
+import orjson
+from fastapi import HTTPException, status
+from app import metrics, models, schema
+from app.cache import off_loop, principal_cache, shared_cache, token_version_cache
+from app.database import async_engine, read_only_async_sessionmaker
+from app.fieldsets import load_fields
+from app.pagination import Page, decode_cursor, encode_cursor
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-
-
-
+# the directory snapshot is rebuilt at least this often, so writes made by other workers show up
+DOCTOR_DIRECTORY_TTL = float(os.getenv('DOCTOR_DIRECTORY_TTL', 30))
 
 
 class DoctorCRUDServices:
@@ -39,16 +54,8 @@ class DoctorCRUDServices:
         return doctor
     
     @staticmethod
-    def get_all_doctors(db: Session, offset: int = 0, limit: int = 10):
-        return db.query(models.Doctor).offset(offset).limit(limit).all()
-    
-    @staticmethod
-    def get_doctor_by_id(db: Session, doctor_id: int):
-        return db.query(models.Doctor).filter(models.Doctor.id == doctor_id).first()
-    
-    @staticmethod
-    def get_doctor_by_specialization(db: Session, specialization: str, offset: int = 0, limit: int = 10):
-        return db.query(models.Doctor).filter(models.Doctor.specialization == specialization).offset(offset).limit(limit).all()
+    def get_doctor_by_id(db: Session, doctor_id: int, fields: Optional[Sequence[str]] = None):
+        return db.query(models.Doctor).options(*load_fields(models.Doctor, fields)).filter(models.Doctor.id == doctor_id).first()
     
     @staticmethod
     def change_doctor_availability_status(db: Session, doctor_id: int):
@@ -69,6 +76,7 @@ class DoctorCRUDServices:
         if not doctor:
             return None
         
+        previous_email = doctor.email
         payload_dict = payload.model_dump(exclude_unset=True)
 
         for key, value in payload_dict.items():
@@ -77,6 +85,7 @@ class DoctorCRUDServices:
         db.add(doctor)
         db.commit()
         db.refresh(doctor)
+        principal_cache.invalidate(previous_email, doctor.email)
 
         return doctor
     
@@ -84,8 +93,11 @@ class DoctorCRUDServices:
     def delete_doctor(db: Session, doctor_id: int):
         doctor = doctor_crud_service.get_doctor_by_id(db, doctor_id=doctor_id)
         
+        email = doctor.email
         db.delete(doctor)
         db.commit()
+        principal_cache.invalidate(email)
+        token_version_cache.invalidate((schema.UserRole.DOCTOR, doctor_id))
 
         return None
         
@@ -93,3 +105,252 @@ class DoctorCRUDServices:
 
 
 doctor_crud_service = DoctorCRUDServices()
+
+
+class AsyncDoctorCRUDServices:
+
+    @staticmethod
+    async def create_doctor(db: AsyncSession, payload: schema.DoctorCreate):
+        doctor = models.Doctor(**payload.model_dump())
+
+        db.add(doctor)
+        await db.commit()
+        await db.refresh(doctor)
+        return doctor
+
+    @staticmethod
+    async def get_doctor_by_email(db: AsyncSession, email: str):
+        return await db.scalar(select(models.Doctor).filter(models.Doctor.email == email))
+
+    @staticmethod
+    async def get_doctor_by_hospital_id(db: AsyncSession, hospital_id: str):
+        return await db.scalar(select(models.Doctor).filter(models.Doctor.hospital_id == hospital_id))
+
+    #  Check if doctor Email or Id is in database
+    @staticmethod
+    async def get_doctor(db: AsyncSession, credential: str):
+        doctor = await async_doctor_crud_service.get_doctor_by_email(db, email=credential)
+        if not doctor:
+            doctor = await async_doctor_crud_service.get_doctor_by_hospital_id(db, hospital_id=credential)
+        return doctor
+
+    @staticmethod
+    async def get_doctor_by_id(db: AsyncSession, doctor_id: int, fields: Optional[Sequence[str]] = None):
+        return await db.scalar(select(models.Doctor).options(*load_fields(models.Doctor, fields)).filter(models.Doctor.id == doctor_id))
+
+    @staticmethod
+    async def change_doctor_availability_status(db: AsyncSession, doctor_id: int):
+        doctor = await async_doctor_crud_service.get_doctor_by_id(db, doctor_id=doctor_id)
+        if not doctor:
+            return None
+
+        doctor.is_available = not doctor.is_available
+
+        await db.commit()
+        await db.refresh(doctor)
+
+        return doctor
+
+    @staticmethod
+    async def update_doctor(db: AsyncSession, payload: schema.DoctorUpdate, doctor_id: int):
+        doctor = await async_doctor_crud_service.get_doctor_by_id(db, doctor_id=doctor_id)
+        if not doctor:
+            return None
+
+        previous_email = doctor.email
+        payload_dict = payload.model_dump(exclude_unset=True)
+
+        for key, value in payload_dict.items():
+            setattr(doctor, key, value)
+
+        await db.commit()
+        await db.refresh(doctor)
+        principal_cache.invalidate(previous_email, doctor.email)
+
+        return doctor
+
+    @staticmethod
+    async def delete_doctor(db: AsyncSession, doctor_id: int):
+        doctor = await async_doctor_crud_service.get_doctor_by_id(db, doctor_id=doctor_id)
+
+        email = doctor.email
+        await db.delete(doctor)
+        await db.commit()
+        principal_cache.invalidate(email)
+        token_version_cache.invalidate((schema.UserRole.DOCTOR, doctor_id))
+
+        return None
+
+
+async_doctor_crud_service = AsyncDoctorCRUDServices()
+
+
+# a doctor as served by the directory: the public fields plus the row version for ETags
+DoctorEntry = namedtuple("DoctorEntry", [*schema.Doctor.model_fields, "version"])
+
+
+class DirectorySnapshot(NamedTuple):
+    doctors: Tuple[DoctorEntry, ...]
+    by_id: Mapping[int, DoctorEntry]
+    by_specialization: Mapping[str, Tuple[DoctorEntry, ...]]
+    # changes whenever a doctor is added (max id), removed (count) or updated (sum of row versions)
+    version: Tuple[int, int, int]
+    loaded_at: float
+
+
+def to_entry(doctor: models.Doctor) -> DoctorEntry:
+    return DoctorEntry(*(getattr(doctor, name) for name in DoctorEntry._fields))
+
+
+def dump_entries(entries: Sequence[DoctorEntry]) -> bytes:
+    return orjson.dumps([entry._asdict() for entry in entries])
+
+
+def load_entries(payload: bytes) -> Optional[List[DoctorEntry]]:
+    try:
+        return [DoctorEntry(**{**row, "date_of_birth": date.fromisoformat(row["date_of_birth"])})
+                for row in orjson.loads(payload)]
+    except (TypeError, KeyError, ValueError):
+        # stored by a worker running a different DoctorEntry layout (mid-deploy)
+        return None
+
+
+def build_snapshot(entries: Sequence[DoctorEntry]) -> DirectorySnapshot:
+    entries = tuple(sorted(entries, key=lambda entry: entry.id))
+    by_specialization = {}
+    for entry in entries:
+        by_specialization.setdefault(entry.specialization, []).append(entry)
+    return DirectorySnapshot(
+        doctors=entries,
+        by_id=MappingProxyType({entry.id: entry for entry in entries}),
+        by_specialization=MappingProxyType({name: tuple(group) for name, group in by_specialization.items()}),
+        version=(len(entries), max((entry.id for entry in entries), default=0), sum(entry.version for entry in entries)),
+        loaded_at=time.monotonic(),
+    )
+
+
+def page_entries(entries: Sequence[DoctorEntry], offset: int = 0, limit: int = 10, cursor: Optional[str] = None) -> Page:
+    # same cursors as paginate() ordered by id, the other list endpoints use that format too
+    if cursor:
+        (last_id,) = decode_cursor(cursor, 1)
+        if not isinstance(last_id, int):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+        start = bisect.bisect_right(entries, last_id, key=lambda entry: entry.id)
+    else:
+        start = max(offset, 0)
+    limit = max(limit, 0)
+    rows = entries[start:start + limit + 1]
+    next_cursor = encode_cursor([rows[limit - 1].id]) if len(rows) > limit and limit > 0 else None
+    return Page(list(rows[:limit]), next_cursor)
+
+
+class DoctorDirectory:
+    """Immutable in-process snapshot of the doctors table, indexed by id and specialization.
+
+    Directory reads are served from memory. A committed doctor write, in this worker or
+    another, marks its rows stale (app/invalidation.py) and the next read reloads just those rows
+    into a patched snapshot. Writes whose rows are unknown drop the snapshot; the next read then
+    takes the rebuilt directory from the shared cache if a worker has already stored one for the
+    current version, and only otherwise reloads the table.
+    """
+
+    def __init__(self, session_factory=None, ttl: float = DOCTOR_DIRECTORY_TTL):
+        # the primary, not the replica: a lagging replica could hand back the rows a write just invalidated
+        self.session_factory = session_factory or read_only_async_sessionmaker(async_engine)
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.patches = 0
+        self.invalidations = 0
+        self._snapshot: Optional[DirectorySnapshot] = None
+        self._stale_ids = set()
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def invalidate(self, ids: Iterable[int] = ()):
+        ids = set(ids)
+        with self._lock:
+            self._generation += 1
+            if ids and self._snapshot is not None:
+                self._stale_ids |= ids
+            else:
+                self._snapshot = None
+                self._stale_ids = set()
+            self.invalidations += 1
+
+    def reset(self):
+        self.invalidate()
+        self.hits = self.misses = self.loads = self.patches = self.invalidations = 0
+
+    async def snapshot(self) -> DirectorySnapshot:
+        snapshot = self._snapshot
+        if snapshot is not None and time.monotonic() - snapshot.loaded_at < self.ttl:
+            if not self._stale_ids:
+                self.hits += 1
+                return snapshot
+            return await self._patch(snapshot)
+
+        self.misses += 1
+        generation = self._generation
+        key = await off_loop(shared_cache.backend, shared_cache.versioned_key, "doctors", "directory")
+        payload = await off_loop(shared_cache.backend, shared_cache.get, key)
+        entries = load_entries(payload) if payload is not None else None
+        if entries is None:
+            async with self.session_factory() as db:
+                entries = [to_entry(doctor) for doctor in (await db.scalars(select(models.Doctor))).all()]
+            await off_loop(shared_cache.backend, shared_cache.set, key, dump_entries(entries), self.ttl)
+        snapshot = build_snapshot(entries)
+        with self._lock:
+            self.loads += 1
+            # a write committed while we were loading: answer this request with it, but do not keep it
+            if generation == self._generation:
+                self._snapshot = snapshot
+        return snapshot
+
+    async def _patch(self, snapshot: DirectorySnapshot) -> DirectorySnapshot:
+        with self._lock:
+            generation = self._generation
+            ids = set(self._stale_ids)
+        async with self.session_factory() as db:
+            rows = (await db.scalars(select(models.Doctor).where(models.Doctor.id.in_(ids)))).all()
+        # deleted doctors have no row and drop out, new ones are added
+        entries = [entry for entry in snapshot.doctors if entry.id not in ids] + [to_entry(row) for row in rows]
+        # keeps the original load time, the TTL still forces a full reload now and then
+        patched = build_snapshot(entries)._replace(loaded_at=snapshot.loaded_at)
+        with self._lock:
+            self.patches += 1
+            # not if a write with unknown rows dropped the snapshot meanwhile
+            if self._snapshot is snapshot:
+                self._snapshot = patched
+                if generation == self._generation:
+                    self._stale_ids = set()
+        return patched
+
+    async def get_doctor_by_id(self, doctor_id: int) -> Optional[DoctorEntry]:
+        return (await self.snapshot()).by_id.get(doctor_id)
+
+    def stats(self) -> dict:
+        snapshot = self._snapshot
+        lookups = self.hits + self.misses
+        return {
+            "doctors": len(snapshot.doctors) if snapshot else 0,
+            "specializations": len(snapshot.by_specialization) if snapshot else 0,
+            "age_seconds": round(time.monotonic() - snapshot.loaded_at, 3) if snapshot else None,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "loads": self.loads,
+            "patches": self.patches,
+            "invalidations": self.invalidations,
+        }
+
+
+doctor_directory = DoctorDirectory()
+
+metrics.register("doctor_directory", doctor_directory.stats)
+
+
+# committed doctor writes in any worker (see app/invalidation.py) patch or drop the local snapshot
+shared_cache.subscribe("doctors", doctor_directory.invalidate)
@@ -1,7 +1,41 @@
+import os
 from app import models, schema
 from app.crud.appointment import get_appointments_by_patient_id
-from app.crud.patients import patient_crud_service
-from sqlalchemy.orm import Session
+from app.crud.patients import patient_crud_service, async_patient_crud_service
+from sqlalchemy import Text, cast, func, literal_column, select
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, selectinload
+
+# opt-in: on Postgres, patient records are built as one JSON document by the database (see
+# emr_json_statement). That response bypasses response_model, so timestamps are formatted by Postgres
+EMR_JSON_AGGREGATION = os.getenv("EMR_JSON_AGGREGATION", "false").lower() in ("1", "true", "yes")
+
+EMR_APPOINTMENT_FIELDS = ("id", "diagnosis", "severity", "appointment_date", "patient_id", "doctor_id", "emr_id")
+
+
+def json_object(*pairs):
+    # keys are rendered inline, asyncpg cannot infer the type of json_build_object parameters
+    arguments = []
+    for key, value in pairs:
+        arguments += [literal_column("'%s'" % key), value]
+    return func.json_build_object(*arguments)
+
+
+def emr_json_statement(patient_id: int):
+    """List[schema.EMRResponse] for a patient as a single JSON text value (Postgres only)."""
+    appointment = json_object(
+        *((field, getattr(models.Appointment, field)) for field in EMR_APPOINTMENT_FIELDS),
+        # enum names are stored, the API returns the lower-case values
+        ("status", func.lower(cast(models.Appointment.status, Text))),
+    )
+    appointments = select(
+        func.coalesce(func.json_agg(aggregate_order_by(appointment, models.Appointment.id)), literal_column("'[]'::json"))
+    ).where(models.Appointment.emr_id == models.EMR.id).scalar_subquery()
+    emr = json_object(("id", models.EMR.id), ("patient_id", models.EMR.patient_id), ("appointments", appointments))
+    return select(
+        cast(func.coalesce(func.json_agg(aggregate_order_by(emr, models.EMR.id)), literal_column("'[]'::json")), Text)
+    ).where(models.EMR.patient_id == patient_id)
 
 
 class EmrCRUDServices:
@@ -24,9 +58,14 @@ class EmrCRUDServices:
         return Emr
 
 
+    # one query for the records, one for all of their appointments
     @staticmethod
     def get_patient_EMR(patient_id: int, db: Session):
-        return db.query(models.EMR).filter(models.EMR.patient_id == patient_id).all()
+        return db.query(models.EMR).options(selectinload(models.EMR.appointments)).filter(models.EMR.patient_id == patient_id).all()
+
+    @staticmethod
+    def get_patient_EMR_json(patient_id: int, db: Session) -> str:
+        return db.scalar(emr_json_statement(patient_id))
     
     @staticmethod
     def get_patient_EMR2(patient_id: int, emr_id: int, db: Session):
@@ -51,3 +90,60 @@ class EmrCRUDServices:
 
 
 emr_crud_service = EmrCRUDServices()
+
+
+class AsyncEmrCRUDServices:
+
+    @staticmethod
+    async def create_patient_EMR(db: AsyncSession, payload: schema.EMRCreate, patient_id: int):
+        patient = await async_patient_crud_service.get_patient_by_id(patient_id, db)
+        if not patient:
+            return None
+
+        appointments = await db.scalars(
+            select(models.Appointment).filter(models.Appointment.patient_id == patient_id))
+        Emr = models.EMR(
+            **payload.model_dump(),
+            appointments=appointments.all()
+        )
+
+        db.add(Emr)
+        await db.commit()
+        return Emr
+
+    # appointments are loaded up front, async sessions cannot lazy-load during serialisation
+    @staticmethod
+    async def get_patient_EMR(patient_id: int, db: AsyncSession):
+        result = await db.scalars(
+            select(models.EMR).options(selectinload(models.EMR.appointments)).filter(models.EMR.patient_id == patient_id))
+        return result.all()
+
+    @staticmethod
+    async def get_patient_EMR_json(patient_id: int, db: AsyncSession) -> str:
+        return await db.scalar(emr_json_statement(patient_id))
+
+    @staticmethod
+    async def get_patient_EMR2(patient_id: int, emr_id: int, db: AsyncSession):
+        return await db.scalar(
+            select(models.EMR).filter(models.EMR.id == emr_id, models.EMR.patient_id == patient_id)) # single validation
+
+    @staticmethod
+    async def delete_patient_EMR(patient_id: int, emr_id: int, db: AsyncSession):
+        emr = await async_emr_crud_service.get_patient_EMR2(patient_id, emr_id, db)
+
+        if not emr:
+            return None
+
+        await db.delete(emr)
+        await db.commit()
+
+        return emr
+
+    @staticmethod
+    async def validate_patient_doctor(patient_id: int, doctor_id: int, db: AsyncSession):
+        result = await db.scalars(
+            select(models.Appointment).filter(models.Appointment.patient_id == patient_id, models.Appointment.doctor_id == doctor_id))
+        return result.all()
+
+
+async_emr_crud_service = AsyncEmrCRUDServices()
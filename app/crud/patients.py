@@ -1,7 +1,13 @@
 from fastapi import Depends
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from typing import Optional
+from typing import Optional, Sequence
 from app import models, schema
+from app.fieldsets import load_fields
+from app.pagination import Page
+from app.search import search_patients
+from app.cache import principal_cache, token_version_cache
 
 
 
@@ -18,8 +24,9 @@ class PatientCRUDServices:
         return patient
     
     @staticmethod
-    def get_patients(offset: int = 0, limit: int = 10, search: Optional[str] = "", db: Session = Depends()) -> models.Patient:
-        return db.query(models.Patient).filter((models.Patient.hospital_card_id.contains(search.upper())) | (models.Patient.last_name.contains(search.title()))).offset(offset).limit(limit).all() # the filtering will enable the admin retrieve patients by a specific year or pattern using the card_id (e.g MEDFLOW/PAT/24/001 -> MEDFLOW/PAT/24 will retrieve only a specific year 2024 or MEDFLOW/PAT/23 etc...) or by last name
+    def get_patients(offset: int = 0, limit: int = 10, search: Optional[str] = "", db: Session = Depends(), cursor: Optional[str] = None, fields: Optional[Sequence[str]] = None) -> Page:
+        # card ID prefixes (e.g MEDFLOW/PAT/24 -> every patient registered in 2024) or names, see app/search.py
+        return search_patients(db, search, offset, limit, cursor, fields)
     
     
     @staticmethod
@@ -27,8 +34,8 @@ class PatientCRUDServices:
         return db.query(models.Patient).filter(models.Patient.email == email).first()
 
     @staticmethod
-    def get_patient_by_id(id: int, db: Session):
-        return db.query(models.Patient).filter(models.Patient.id == id).first()
+    def get_patient_by_id(id: int, db: Session, fields: Optional[Sequence[str]] = None):
+        return db.query(models.Patient).options(*load_fields(models.Patient, fields)).filter(models.Patient.id == id).first()
     
     @staticmethod
     def get_patient_by_hospital_id(db: Session, hospital_id: str) -> models.Patient:
@@ -40,12 +47,14 @@ class PatientCRUDServices:
         if not patient:
             return None
         
+        previous_email = patient.email
         patient_dict = payload.model_dump(exclude_unset=True)
         for k, v in patient_dict.items():
             setattr(patient, k, v)
 
         db.commit()
         db.refresh(patient)
+        principal_cache.invalidate(previous_email, patient.email)
         return patient
     
     @staticmethod
@@ -54,8 +63,11 @@ class PatientCRUDServices:
         if not patient:
             return None
 
+        email = patient.email
         db.delete(patient)
         db.commit()
+        principal_cache.invalidate(email)
+        token_version_cache.invalidate((schema.UserRole.PATIENT, id))
         return patient
 
 
@@ -77,4 +89,39 @@ class PatientCRUDServices:
 
 
 
-patient_crud_service = PatientCRUDServices()
\ No newline at end of file
+patient_crud_service = PatientCRUDServices()
+
+
+class AsyncPatientCRUDServices:
+
+    @staticmethod
+    async def create_patient(db: AsyncSession, payload: schema.PatientCreate):
+        patient = models.Patient(**payload.model_dump())
+
+        db.add(patient)
+        await db.commit()
+        await db.refresh(patient)
+        return patient
+
+    @staticmethod
+    async def get_patient_by_email(db: AsyncSession, email: str):
+        return await db.scalar(select(models.Patient).filter(models.Patient.email == email))
+
+    @staticmethod
+    async def get_patient_by_id(id: int, db: AsyncSession):
+        return await db.scalar(select(models.Patient).filter(models.Patient.id == id))
+
+    @staticmethod
+    async def get_patient_by_hospital_id(db: AsyncSession, hospital_id: str) -> models.Patient:
+        return await db.scalar(select(models.Patient).filter(models.Patient.hospital_card_id == hospital_id))
+
+    # To check if patient Email or ID in database
+    @staticmethod
+    async def get_patient(db: AsyncSession, credential: str):
+        patient = await async_patient_crud_service.get_patient_by_email(db, email=credential)
+        if not patient:
+            patient = await async_patient_crud_service.get_patient_by_hospital_id(db, hospital_id=credential)
+        return patient
+
+
+async_patient_crud_service = AsyncPatientCRUDServices()
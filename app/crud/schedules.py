@@ -0,0 +1,53 @@
+from datetime import datetime
+from typing import List
+from app import models, schema
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+
+def booked_statement(doctor_id: int, start: datetime, end: datetime):
+    # slot bookings overlapping [start, end); the doctor_id/appointment_date index bounds the scan
+    return select(models.Appointment.id, models.Appointment.appointment_date, models.Appointment.ends_at, models.Appointment.seat).where(
+        models.Appointment.doctor_id == doctor_id,
+        models.Appointment.ends_at.isnot(None),
+        models.Appointment.status != schema.AppointmentStatus.CANCELLED,
+        models.Appointment.appointment_date < end,
+        models.Appointment.ends_at > start,
+    )
+
+
+class ScheduleCRUDServices:
+
+    @staticmethod
+    def get_schedules(db: Session, doctor_id: int) -> List[models.DoctorSchedule]:
+        return db.scalars(select(models.DoctorSchedule).where(models.DoctorSchedule.doctor_id == doctor_id)).all()
+
+    @staticmethod
+    def get_booked(db: Session, doctor_id: int, start: datetime, end: datetime):
+        return db.execute(booked_statement(doctor_id, start, end)).all()
+
+
+schedule_crud_service = ScheduleCRUDServices()
+
+
+class AsyncScheduleCRUDServices:
+
+    @staticmethod
+    async def get_schedules(db: AsyncSession, doctor_id: int) -> List[models.DoctorSchedule]:
+        return (await db.scalars(select(models.DoctorSchedule).where(models.DoctorSchedule.doctor_id == doctor_id))).all()
+
+    @staticmethod
+    async def get_booked(db: AsyncSession, doctor_id: int, start: datetime, end: datetime):
+        return (await db.execute(booked_statement(doctor_id, start, end))).all()
+
+    @staticmethod
+    async def replace_schedules(db: AsyncSession, doctor_id: int, payload: List[schema.DoctorScheduleCreate]) -> List[models.DoctorSchedule]:
+        await db.execute(delete(models.DoctorSchedule).where(models.DoctorSchedule.doctor_id == doctor_id))
+        schedules = [models.DoctorSchedule(**item.model_dump(), doctor_id=doctor_id) for item in payload]
+        db.add_all(schedules)
+        await db.commit()
+        return schedules
+
+
+async_schedule_crud_service = AsyncScheduleCRUDServices()
@@ -1,18 +1,194 @@
 import os
-from sqlalchemy import create_engine
+import threading
+import time
+from sqlalchemy import create_engine, exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 from dotenv import load_dotenv
+from app import metrics
 
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-engine = create_engine(DATABASE_URL)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+# recycle connections before server-side idle timeouts or a failover can kill them; -1 disables
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+# connections opened per engine during startup so the first requests do not pay for them
+DB_POOL_WARMUP = int(os.getenv("DB_POOL_WARMUP", 0))
+
+
+class PoolWaitStats:
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float, timed_out: bool = False):
+        with self._lock:
+            self.checkouts += 1
+            self.timeouts += timed_out
+            self.total_wait += seconds
+            self.max_wait = max(self.max_wait, seconds)
+
+    def as_dict(self) -> dict:
+        return {
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "avg_wait_ms": round(self.total_wait / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+            "max_wait_ms": round(self.max_wait * 1000, 3),
+        }
+
+
+class _TimedPoolMixin:
+    """Measures how long each checkout waits for a free connection."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wait_stats = PoolWaitStats()
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            self.wait_stats.record(time.perf_counter() - started, timed_out=True)
+            raise
+        self.wait_stats.record(time.perf_counter() - started)
+        return connection
+
+
+class TimedQueuePool(_TimedPoolMixin, QueuePool):
+    pass
+
+
+class TimedAsyncAdaptedQueuePool(_TimedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def pool_options(url: str, is_async: bool = False) -> dict:
+    # SQLite engines use single-connection pools that take none of these settings
+    if make_url(url).get_backend_name() == "sqlite":
+        return {}
+    return {
+        "poolclass": TimedAsyncAdaptedQueuePool if is_async else TimedQueuePool,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+
+def pool_status(engine) -> dict:
+    if isinstance(engine, AsyncEngine):
+        engine = engine.sync_engine
+    pool = engine.pool
+    status = {"pool": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        status.update({
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "idle": pool.checkedin(),
+            "overflow": max(0, pool.overflow()),
+        })
+    if hasattr(pool, "wait_stats"):
+        status.update(pool.wait_stats.as_dict())
+    return status
+
+# async drivers for the backends we run on
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+
+def async_database_url(url: str) -> str:
+    parsed = make_url(url)
+    driver = ASYNC_DRIVERS.get(parsed.get_backend_name())
+    if driver is None:
+        raise ValueError("No async driver configured for '%s'" % parsed.get_backend_name())
+    return parsed.set(drivername=driver).render_as_string(hide_password=False)
+
+
+# defaults to DATABASE_URL with its driver swapped for the async one
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or async_database_url(DATABASE_URL)
+
+engine = create_engine(DATABASE_URL, **pool_options(DATABASE_URL))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **pool_options(ASYNC_DATABASE_URL, is_async=True))
+# objects stay usable after commit; async sessions cannot lazy-load expired attributes
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+def read_only_sessionmaker(bind):
+    # AUTOCOMMIT: no BEGIN/ROLLBACK round trips, and objects stay loaded once the
+    # connection is handed back with release_connection(). Only for handlers that never write.
+    return sessionmaker(
+        bind=bind.execution_options(isolation_level="AUTOCOMMIT"), autoflush=False, expire_on_commit=False)
+
+
+def read_only_async_sessionmaker(bind: AsyncEngine):
+    return async_sessionmaker(
+        bind.execution_options(isolation_level="AUTOCOMMIT"), class_=AsyncSession,
+        autoflush=False, expire_on_commit=False)
+
+
+def release_connection(db):
+    # ends the (autocommit) session transaction so the connection returns to the pool
+    # before FastAPI serialises the response; a later lazy load checks one out again
+    return db.commit()
+
+
+# optional read replica for query-only endpoints, see app/replica.py
+REPLICA_DATABASE_URL = os.getenv("REPLICA_DATABASE_URL")
+ASYNC_REPLICA_DATABASE_URL = os.getenv("ASYNC_REPLICA_DATABASE_URL") or (
+    REPLICA_DATABASE_URL and async_database_url(REPLICA_DATABASE_URL))
+
+replica_engine = None
+async_replica_engine = None
+if REPLICA_DATABASE_URL:
+    replica_engine = create_engine(REPLICA_DATABASE_URL, **pool_options(REPLICA_DATABASE_URL))
+    async_replica_engine = create_async_engine(
+        ASYNC_REPLICA_DATABASE_URL, **pool_options(ASYNC_REPLICA_DATABASE_URL, is_async=True))
+
 Base = declarative_base()
 
+
+def pool_metrics() -> dict:
+    pools = {
+        "primary": pool_status(engine),
+        "primary_async": pool_status(async_engine),
+    }
+    if replica_engine is not None:
+        pools["replica"] = pool_status(replica_engine)
+        pools["replica_async"] = pool_status(async_replica_engine)
+    return pools
+
+
+metrics.register("db_pool", pool_metrics)
+
+
+def warm_up_pool(engine, connections: int):
+    # hold them all at once so the pool really grows to `connections`
+    opened = [engine.connect() for _ in range(connections)]
+    for connection in opened:
+        connection.close()
+
+
+async def warm_up_async_pool(engine: AsyncEngine, connections: int):
+    opened = [await engine.connect() for _ in range(connections)]
+    for connection in opened:
+        await connection.close()
+
 # Dependency
 def get_db():
     db = SessionLocal()
@@ -20,3 +196,15 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+# Dependency for streaming responses: the response body is produced after the request's
+# dependencies have exited, so the generator opens and closes its own session
+def get_session_factory():
+    return SessionLocal
+
+
+# Dependency for async handlers: keeps the event loop free while waiting on the database
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,36 @@
+import hashlib
+from typing import Optional, Sequence
+
+from fastapi import Request, Response, status
+
+ETAG_HEADER = "ETag"
+
+
+def make_etag(*parts) -> str:
+    # strong validator: the parts identify the exact representation (resource, version, fields)
+    digest = hashlib.sha1(":".join(str(part) for part in parts).encode()).hexdigest()[:20]
+    return '"%s"' % digest
+
+
+def resource_etag(kind: str, row, fields: Optional[Sequence[str]] = None) -> str:
+    return make_etag(kind, row.id, row.version, ",".join(fields or ()))
+
+
+def collection_etag(kind: str, version: Sequence, request: Request) -> str:
+    # the path and query string pick the filter, page and fields, each gets its own validator
+    return make_etag(kind, *version, request.url.path, request.url.query)
+
+
+def matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # If-None-Match uses the weak comparison, W/"x" matches "x"
+    candidates = (candidate.strip().removeprefix("W/") for candidate in header.split(","))
+    return etag in candidates
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={ETAG_HEADER: etag})
@@ -0,0 +1,93 @@
+import csv
+import io
+import os
+from datetime import date, datetime, time, timedelta, timezone
+from enum import Enum
+from typing import Callable, Iterator, Optional
+
+import orjson
+from sqlalchemy import Select, select
+from sqlalchemy.orm import Session
+
+from app import models, schema
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", 1000))
+
+# never exported: password hashes and token versions
+PATIENT_EXPORT_COLUMNS = (
+    models.Patient.id, models.Patient.hospital_card_id, models.Patient.title, models.Patient.first_name,
+    models.Patient.last_name, models.Patient.email, models.Patient.phone_number, models.Patient.date_of_birth,
+    models.Patient.age, models.Patient.gender, models.Patient.address_line1, models.Patient.address_line2,
+    models.Patient.city, models.Patient.state, models.Patient.zip_code, models.Patient.country,
+    models.Patient.is_active, models.Patient.created_at,
+)
+APPOINTMENT_EXPORT_COLUMNS = (
+    models.Appointment.id, models.Appointment.patient_id, models.Appointment.doctor_id, models.Appointment.emr_id,
+    models.Appointment.diagnosis, models.Appointment.severity, models.Appointment.status,
+    models.Appointment.appointment_date,
+)
+
+MEDIA_TYPES = {
+    schema.ExportFormat.NDJSON: "application/x-ndjson",
+    schema.ExportFormat.CSV: "text/csv",
+}
+
+
+def _day_start(day: date) -> datetime:
+    return datetime.combine(day, time.min, tzinfo=timezone.utc)
+
+
+def export_statement(columns, timestamp, start: Optional[date] = None, end: Optional[date] = None) -> Select:
+    # both ends inclusive, in UTC days
+    statement = select(*columns).order_by(columns[0])
+    if start:
+        statement = statement.where(timestamp >= _day_start(start))
+    if end:
+        statement = statement.where(timestamp < _day_start(end + timedelta(days=1)))
+    return statement
+
+
+def patients_export_statement(start: Optional[date] = None, end: Optional[date] = None) -> Select:
+    return export_statement(PATIENT_EXPORT_COLUMNS, models.Patient.created_at, start, end)
+
+
+def appointments_export_statement(start: Optional[date] = None, end: Optional[date] = None) -> Select:
+    return export_statement(APPOINTMENT_EXPORT_COLUMNS, models.Appointment.appointment_date, start, end)
+
+
+def _csv_value(value):
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+def _ndjson_chunk(keys, rows) -> bytes:
+    return b"".join(orjson.dumps(dict(zip(keys, row))) + b"\n" for row in rows)
+
+
+def _csv_chunk(rows) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows([_csv_value(value) for value in row] for row in rows)
+    return buffer.getvalue()
+
+
+def stream_rows(session_factory: Callable[[], Session], statement: Select,
+                export_format: schema.ExportFormat) -> Iterator:
+    """Yields the export one batch at a time.
+
+    The generator owns its session: it runs after the request's dependencies have been torn
+    down. yield_per streams through a server-side cursor on Postgres, so only one batch of
+    rows is held in memory whatever the table size.
+    """
+    with session_factory() as db:
+        result = db.execute(statement, execution_options={"yield_per": EXPORT_BATCH_SIZE})
+        keys = list(result.keys())
+        if export_format == schema.ExportFormat.CSV:
+            yield _csv_chunk([keys])
+        for rows in result.partitions():
+            if export_format == schema.ExportFormat.CSV:
+                yield _csv_chunk(rows)
+            else:
+                yield _ndjson_chunk(keys, rows)
@@ -0,0 +1,25 @@
+from typing import List, Optional, Sequence, Tuple, Type
+
+from fastapi import HTTPException, status
+from pydantic import BaseModel
+from sqlalchemy.orm import load_only
+
+def parse_fields(fields: Optional[str], response_model: Type[BaseModel]) -> Optional[Tuple[str, ...]]:
+    if not fields:
+        return None
+    requested = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in requested if field not in response_model.model_fields]
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Unknown field(s): %s" % ", ".join(unknown)
+        )
+    # id is always returned, clients need it to follow up on a row
+    return tuple(dict.fromkeys(["id", *requested]))
+
+
+def load_fields(model, fields: Optional[Sequence[str]]) -> List:
+    # SELECT only these columns (and the row version, for ETags); the rest stay unloaded and must not be touched
+    if not fields:
+        return []
+    return [load_only(*(getattr(model, field) for field in fields), model.version)]
@@ -0,0 +1,123 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+
+from dotenv import load_dotenv
+from passlib.context import CryptContext
+from app import metrics
+
+load_dotenv()
+
+# bcrypt releases the GIL, so a thread pool already spreads hashes across cores;
+# "process" isolates them completely at the cost of worker start-up time
+PASSWORD_HASH_EXECUTOR = os.getenv('PASSWORD_HASH_EXECUTOR', 'thread')
+PASSWORD_HASH_CONCURRENCY = int(os.getenv('PASSWORD_HASH_CONCURRENCY', os.cpu_count() or 1))
+# bcrypt cost factor; every extra round doubles the time per hash
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', 12))
+
+
+def build_context(rounds: int) -> CryptContext:
+    # pinning min/max to the configured cost makes needs_update() flag any hash
+    # created under a different setting, so it is replaced on the next login
+    return CryptContext(
+        schemes=["bcrypt"], deprecated="auto",
+        bcrypt__default_rounds=rounds,
+        bcrypt__min_rounds=rounds,
+        bcrypt__max_rounds=rounds,
+    )
+
+
+# the single password context shared by the whole app
+pwd_context = build_context(BCRYPT_ROUNDS)
+
+
+# module level so they can be pickled into a process pool
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def _verify(password: str, hashed_password: str) -> bool:
+    return pwd_context.verify(password, hashed_password)
+
+
+class PasswordHasher:
+    """Runs bcrypt on a bounded worker pool so it never blocks the event loop."""
+
+    def __init__(self, max_concurrency: int, executor: str = "thread"):
+        if executor not in ("thread", "process"):
+            raise ValueError("executor must be 'thread' or 'process'")
+        self.max_concurrency = max(1, max_concurrency)
+        self.executor = executor
+        self.in_flight = 0
+        self.peak_queue_depth = 0
+        self.completed = 0
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self):
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    if self.executor == "process":
+                        self._pool = ProcessPoolExecutor(max_workers=self.max_concurrency)
+                    else:
+                        self._pool = ThreadPoolExecutor(
+                            max_workers=self.max_concurrency, thread_name_prefix="password-hasher")
+        return self._pool
+
+    @property
+    def queue_depth(self) -> int:
+        return max(0, self.in_flight - self.max_concurrency)
+
+    def _submit(self, fn, *args) -> Future:
+        with self._lock:
+            self.in_flight += 1
+            self.peak_queue_depth = max(self.peak_queue_depth, self.queue_depth)
+        future = self._get_pool().submit(fn, *args)
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, _future: Future):
+        with self._lock:
+            self.in_flight -= 1
+            self.completed += 1
+
+    async def hash(self, password: str) -> str:
+        return await asyncio.wrap_future(self._submit(_hash, password))
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        return await asyncio.wrap_future(self._submit(_verify, password, hashed_password))
+
+    def needs_update(self, hashed_password: str) -> bool:
+        # only parses the hash, cheap enough to run inline
+        return pwd_context.needs_update(hashed_password)
+
+    # for sync handlers, which already run in the threadpool but should share the same bound
+    def hash_sync(self, password: str) -> str:
+        return self._submit(_hash, password).result()
+
+    def verify_sync(self, password: str, hashed_password: str) -> bool:
+        return self._submit(_verify, password, hashed_password).result()
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True)
+
+    def stats(self) -> dict:
+        return {
+            "executor": self.executor,
+            "bcrypt_rounds": BCRYPT_ROUNDS,
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+            "peak_queue_depth": self.peak_queue_depth,
+            "completed": self.completed,
+        }
+
+
+password_hasher = PasswordHasher(PASSWORD_HASH_CONCURRENCY, executor=PASSWORD_HASH_EXECUTOR)
+
+metrics.register("password_hasher", password_hasher.stats)
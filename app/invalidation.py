@@ -0,0 +1,54 @@
+from itertools import chain
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app import models
+from app.cache import shared_cache
+
+# tables whose committed writes are broadcast, and the shared cache namespace of each
+NAMESPACES = {
+    models.Patient: "patients",
+    models.Doctor: "doctors",
+    models.Appointment: "appointments",
+}
+
+
+# Any session, sync or async, collects the rows it flushes (or bulk UPDATE/DELETE statements it
+# runs) and invalidates their namespaces once it commits: announcing the write any earlier would
+# let another worker reload the rows from before it. Bulk statements name the rows they can touch
+# with the `changed_ids` execution option; without it the whole namespace counts as changed.
+@event.listens_for(Session, "after_flush")
+def _collect_flushed_rows(session, flush_context):
+    for obj in chain(session.new, session.dirty, session.deleted):
+        namespace = NAMESPACES.get(type(obj))
+        if namespace is not None:
+            session.info.setdefault("changed_rows", {}).setdefault(namespace, set()).add(obj.id)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _collect_bulk_statements(orm_execute_state):
+    if (orm_execute_state.is_update or orm_execute_state.is_delete) and orm_execute_state.bind_mapper is not None:
+        namespace = NAMESPACES.get(orm_execute_state.bind_mapper.class_)
+        if namespace is None:
+            return
+        ids = orm_execute_state.execution_options.get("changed_ids")
+        if ids is None:
+            orm_execute_state.session.info.setdefault("changed_namespaces", set()).add(namespace)
+        else:
+            orm_execute_state.session.info.setdefault("changed_rows", {}).setdefault(namespace, set()).update(ids)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_committed_rows(session):
+    rows = session.info.pop("changed_rows", {})
+    whole = session.info.pop("changed_namespaces", set())
+    for namespace in whole | rows.keys():
+        # no ids: subscribers drop everything they keep for the namespace
+        shared_cache.invalidate(namespace, *(() if namespace in whole else sorted(rows[namespace])))
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_rolled_back_rows(session):
+    session.info.pop("changed_rows", None)
+    session.info.pop("changed_namespaces", None)
@@ -1,14 +1,51 @@
+import asyncio
+from contextlib import asynccontextmanager
+
 from fastapi import Depends, FastAPI, HTTPException
+from fastapi.responses import ORJSONResponse
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 
-from app import models
-from app.database import engine
-from app.routers import auth, patients, emr, doctors, appointment
+from app import invalidation, models
+from app.cache import shared_cache
+from app.database import (
+    DB_POOL_WARMUP, async_engine, async_replica_engine, engine, replica_engine, warm_up_async_pool, warm_up_pool)
+from app.hashing import password_hasher
+from app.replica import ReadYourWritesMiddleware
+from app.revocation import revocation_list
+from app.routers import auth, patients, emr, doctors, appointment, metrics, exports
 
 # models.Base.metadata.create_all(bind=engine)
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if DB_POOL_WARMUP:
+        # the replica serves most reads, so its pools are warmed as well when there is one
+        for target in (engine, replica_engine):
+            if target is not None:
+                await run_in_threadpool(warm_up_pool, target, DB_POOL_WARMUP)
+        for target in (async_engine, async_replica_engine):
+            if target is not None:
+                await warm_up_async_pool(target, DB_POOL_WARMUP)
+    # listen for invalidations broadcast by the other workers; the session hooks in app/invalidation.py send ours
+    await run_in_threadpool(shared_cache.start)
+    # revocations recorded before this worker started are in the filter before its first request
+    await revocation_list.try_refresh()
+    refresh_task = asyncio.create_task(revocation_list.refresh_periodically())
+    purge_task = asyncio.create_task(revocation_list.purge_periodically())
+    yield
+    refresh_task.cancel()
+    purge_task.cancel()
+    await run_in_threadpool(shared_cache.close)
+    password_hasher.shutdown()
+    await async_engine.dispose()
+    if async_replica_engine is not None:
+        await async_replica_engine.dispose()
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+app.add_middleware(ReadYourWritesMiddleware)
 
 app.include_router(
     auth.auth_router, tags=["Authentication"])
@@ -16,6 +53,8 @@ app.include_router(patients.router)
 app.include_router(emr.router)
 app.include_router(doctors.router)
 app.include_router(appointment.router)
+app.include_router(exports.router)
+app.include_router(metrics.router)
 
 @app.get('/')
 def root():
@@ -0,0 +1,13 @@
+from typing import Callable, Dict
+
+# Registry of in-process counters exposed on GET /metrics. Each source is a
+# zero-argument callable returning a JSON-serialisable dict.
+_sources: Dict[str, Callable[[], dict]] = {}
+
+
+def register(name: str, source: Callable[[], dict]):
+    _sources[name] = source
+
+
+def snapshot() -> dict:
+    return {name: source() for name, source in _sources.items()}
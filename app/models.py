@@ -1,11 +1,17 @@
-from sqlalchemy import Boolean, Column, DateTime, ForeignKey, Integer, String, Enum, Date, Text
-from sqlalchemy.orm import relationship
+import os
+from sqlalchemy import DDL, Boolean, Column, DateTime, ForeignKey, Index, Integer, String, Enum, Date, Text, Time, event, func
+from sqlalchemy.dialects.postgresql import ExcludeConstraint
+from sqlalchemy.orm import object_session, relationship
 from sqlalchemy.sql.sqltypes import TIMESTAMP
 from sqlalchemy.sql.expression import text
 from app.schema import AppointmentStatus
 
 from app.database import Base
 
+# default loader for every relationship. "raise" (or "raise_on_sql", which still allows identity
+# map hits) turns any lazy load a query forgot to eager-load into an error; use it in development/CI
+LAZY_LOADING = os.getenv("ORM_LAZY_LOADING", "select")
+
 
 class Patient(Base):
     __tablename__ = "patients"
@@ -29,9 +35,55 @@ class Patient(Base):
     email = Column(String, unique=True, index=True)
     password = Column(String, nullable=False)
     is_active = Column(Boolean, default=True)
-
-    appointments = relationship("Appointment", back_populates="patient")
-    emr = relationship("EMR", back_populates="patient")
+    token_version = Column(Integer, nullable=False, default=0, server_default=text('0'))
+    created_at = Column(DateTime(timezone=True), nullable=False, index=True, server_default=text('CURRENT_TIMESTAMP'))
+    # bumped by every ORM update (bump_version below), the ETag of the patient resource (app/etags.py)
+    version = Column(Integer, nullable=False, server_default=text('1'))
+
+    appointments = relationship("Appointment", back_populates="patient", lazy=LAZY_LOADING)
+    emr = relationship("EMR", back_populates="patient", lazy=LAZY_LOADING)
+
+    # read the bumped version back with RETURNING; async sessions cannot lazy-load it afterwards
+    __mapper_args__ = {"eager_defaults": True}
+
+    # patient search (app/search.py): trigram indexes for substring/fuzzy matches and a
+    # pattern_ops index for left-anchored card ID prefixes
+    __table_args__ = (
+        Index('ix_patients_first_name_trgm', 'first_name', postgresql_using='gin',
+              postgresql_ops={'first_name': 'gin_trgm_ops'}).ddl_if(dialect='postgresql'),
+        Index('ix_patients_last_name_trgm', 'last_name', postgresql_using='gin',
+              postgresql_ops={'last_name': 'gin_trgm_ops'}).ddl_if(dialect='postgresql'),
+        Index('ix_patients_hospital_card_id_trgm', 'hospital_card_id', postgresql_using='gin',
+              postgresql_ops={'hospital_card_id': 'gin_trgm_ops'}).ddl_if(dialect='postgresql'),
+        Index('ix_patients_hospital_card_id_pattern', 'hospital_card_id',
+              postgresql_ops={'hospital_card_id': 'varchar_pattern_ops'}).ddl_if(dialect='postgresql'),
+    )
+
+
+# SQLite fallback for the patient search: an external-content FTS5 trigram table kept in
+# sync by triggers. Mirrors migration 67c3552a2705.
+PATIENT_FTS_DDL = (
+    "CREATE VIRTUAL TABLE patients_fts USING fts5("
+    "first_name, last_name, hospital_card_id, content='patients', content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER patients_fts_insert AFTER INSERT ON patients BEGIN "
+    "INSERT INTO patients_fts(rowid, first_name, last_name, hospital_card_id) "
+    "VALUES (new.id, new.first_name, new.last_name, new.hospital_card_id); END",
+    "CREATE TRIGGER patients_fts_delete AFTER DELETE ON patients BEGIN "
+    "INSERT INTO patients_fts(patients_fts, rowid, first_name, last_name, hospital_card_id) "
+    "VALUES ('delete', old.id, old.first_name, old.last_name, old.hospital_card_id); END",
+    "CREATE TRIGGER patients_fts_update AFTER UPDATE OF first_name, last_name, hospital_card_id ON patients BEGIN "
+    "INSERT INTO patients_fts(patients_fts, rowid, first_name, last_name, hospital_card_id) "
+    "VALUES ('delete', old.id, old.first_name, old.last_name, old.hospital_card_id); "
+    "INSERT INTO patients_fts(rowid, first_name, last_name, hospital_card_id) "
+    "VALUES (new.id, new.first_name, new.last_name, new.hospital_card_id); END",
+)
+
+event.listen(Patient.__table__, "before_create",
+             DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect='postgresql'))
+for statement in PATIENT_FTS_DDL:
+    event.listen(Patient.__table__, "after_create", DDL(statement).execute_if(dialect='sqlite'))
+event.listen(Patient.__table__, "before_drop",
+             DDL("DROP TABLE IF EXISTS patients_fts").execute_if(dialect='sqlite'))
 
 
 class Doctor(Base):
@@ -57,8 +109,24 @@ class Doctor(Base):
     country = Column(String, nullable=False)
     is_available = Column(Boolean, nullable=False, default=True)
     password = Column(String, nullable=False)
+    token_version = Column(Integer, nullable=False, default=0, server_default=text('0'))
+    version = Column(Integer, nullable=False, server_default=text('1'))
+
+    appointments = relationship("Appointment", back_populates="doctor", lazy=LAZY_LOADING)
+
+    # read the bumped version back with RETURNING; async sessions cannot lazy-load it afterwards
+    __mapper_args__ = {"eager_defaults": True}
 
-    appointments = relationship("Appointment", back_populates="doctor")
+
+def bump_version(mapper, connection, target):
+    # incremented in SQL rather than compared (no version_id_col): concurrent updates of the
+    # same row both succeed and each produces a new version
+    if object_session(target).is_modified(target, include_collections=False):
+        target.version = mapper.class_.version + 1
+
+
+event.listen(Patient, "before_update", bump_version)
+event.listen(Doctor, "before_update", bump_version)
 
 
 class Appointment(Base):
@@ -77,10 +145,57 @@ class Appointment(Base):
     appointment_date = Column(DateTime(timezone=True), nullable=False,
                               server_default=text('CURRENT_TIMESTAMP'))
     status = Column(Enum(AppointmentStatus), default=AppointmentStatus.PENDING)
+    # set for bookings against a doctor's schedule (app/scheduling.py): the end of the slot and
+    # which of its `capacity` places the booking holds; NULL for doctors without a schedule
+    ends_at = Column(DateTime(timezone=True), nullable=True)
+    seat = Column(Integer, nullable=True)
+
+    patient = relationship("Patient", back_populates="appointments", lazy=LAZY_LOADING)
+    doctor = relationship("Doctor", back_populates="appointments", lazy=LAZY_LOADING)
+    emr = relationship("EMR", back_populates="appointments", lazy=LAZY_LOADING)
+
+    __table_args__ = (
+        Index('ix_appointments_patient_id_status', 'patient_id', 'status'),
+        Index('ix_appointments_doctor_id_status', 'doctor_id', 'status'),
+        Index('ix_appointments_patient_id_doctor_id', 'patient_id', 'doctor_id'),
+        Index('ix_appointments_doctor_id_appointment_date', 'doctor_id', 'appointment_date'),
+        # loading a patient's records fetches their appointments by emr_id
+        Index('ix_appointments_emr_id', 'emr_id'),
+        # most rows end up completed or cancelled, the booking checks only look for open ones
+        Index('ix_appointments_open_patient_id', 'patient_id',
+              postgresql_where=text("status IN ('PENDING', 'IN_PROGRESS')"),
+              sqlite_where=text("status IN ('PENDING', 'IN_PROGRESS')")),
+        # at most one pending appointment per patient, even for concurrent bookings
+        Index('ix_appointments_pending_patient_id', 'patient_id', unique=True,
+              postgresql_where=text("status = 'PENDING'"),
+              sqlite_where=text("status = 'PENDING'")),
+        # no two live bookings may hold the same place of a doctor's calendar at overlapping times;
+        # other databases fall back to the interval tree check in book_appointment
+        ExcludeConstraint(
+            (doctor_id, '='), (seat, '='), (func.tstzrange(appointment_date, ends_at), '&&'),
+            name='ex_appointments_doctor_seat_time', using='gist',
+            where=text("ends_at IS NOT NULL AND status <> 'CANCELLED'")).ddl_if(dialect='postgresql'),
+    )
+
+
+# `doctor_id WITH =` in the appointments exclusion constraint needs btree_gist
+event.listen(Appointment.__table__, "before_create",
+             DDL("CREATE EXTENSION IF NOT EXISTS btree_gist").execute_if(dialect='postgresql'))
+
+
+# working hours of a doctor on one weekday, cut into bookable slots
+class DoctorSchedule(Base):
+    __tablename__ = 'doctor_schedules'
 
-    patient = relationship("Patient", back_populates="appointments")
-    doctor = relationship("Doctor", back_populates="appointments")
-    emr = relationship("EMR", back_populates="appointments")
+    id = Column(Integer, primary_key=True, index=True,
+                autoincrement=True, nullable=False)
+    doctor_id = Column(Integer, ForeignKey(
+        "doctors.id", ondelete="CASCADE"), nullable=False, index=True)
+    weekday = Column(Integer, nullable=False)  # 0 = Monday
+    start_time = Column(Time, nullable=False)
+    end_time = Column(Time, nullable=False)
+    slot_minutes = Column(Integer, nullable=False)
+    capacity = Column(Integer, nullable=False, default=1, server_default=text('1'))
 
 
 class EMR(Base):
@@ -91,5 +206,14 @@ class EMR(Base):
     patient_id = Column(Integer, ForeignKey(
         "patients.id", ondelete="CASCADE"), nullable=False)
 
-    appointments = relationship("Appointment", back_populates="emr")
-    patient = relationship("Patient", back_populates="emr")
+    appointments = relationship("Appointment", back_populates="emr", lazy=LAZY_LOADING)
+    patient = relationship("Patient", back_populates="emr", lazy=LAZY_LOADING)
+
+
+class RevokedToken(Base):
+    __tablename__ = 'revoked_tokens'
+
+    id = Column(Integer, primary_key=True, index=True,
+                autoincrement=True, nullable=False)
+    jti = Column(String, nullable=False, unique=True, index=True)
+    expires_at = Column(DateTime(timezone=True), nullable=False)
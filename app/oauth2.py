@@ -1,65 +1,211 @@
+import hashlib
 import os
+import time
+import uuid
 
 from datetime import datetime, timedelta, timezone
-from typing import Optional
+from typing import Callable, List, Optional
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from fastapi import Depends, HTTPException
 from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from dotenv import load_dotenv
-from app.utils import get_user
+from app import models, schema
+from app.utils import get_user, get_user_async, user_role
 from app.database import get_db
+from app.cache import principal_cache, token_cache, token_version_cache
+from app.hashing import password_hasher
+from app.revocation import revocation_list
 
 load_dotenv()
 
 SECRET_KEY = os.getenv('SECRET_KEY')
 ALGORITHM = os.getenv('ALGORITHM')
-ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv('ACCESS_TOKEN_EXPIRE_MINUTES'))
+# access tokens are only revoked through the filter and live on in caches until `exp`;
+# clients keep sessions going with refresh tokens, so the lifetime stays short
+ACCESS_TOKEN_MAX_MINUTES = int(os.getenv('ACCESS_TOKEN_MAX_MINUTES', 60))
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv('ACCESS_TOKEN_EXPIRE_MINUTES', 15))
+if not 0 < ACCESS_TOKEN_EXPIRE_MINUTES <= ACCESS_TOKEN_MAX_MINUTES:
+    raise ValueError("ACCESS_TOKEN_EXPIRE_MINUTES must be between 1 and %d" % ACCESS_TOKEN_MAX_MINUTES)
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv('REFRESH_TOKEN_EXPIRE_DAYS', 7))
+# opt-in: embed the user id, role and token version in access tokens so most
+# authorization checks can run without loading the user
+STATELESS_TOKENS = os.getenv('STATELESS_TOKENS', 'false').lower() in ('1', 'true', 'yes')
 
 
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
+# Called with the decoded claims on every request, cached or not; returning True rejects the token.
+revocation_hooks: List[Callable[[dict], bool]] = []
+
+
+def register_revocation_hook(hook: Callable[[dict], bool]):
+    revocation_hooks.append(hook)
+
+
+register_revocation_hook(revocation_list.is_revoked_claims)
+
 
 def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    return password_hasher.verify_sync(plain_password, hashed_password)
 
 
-def authenticate_user(db: Session, credential: str, password: str):
-    user = get_user(db, credential=credential)
-    if not user or not verify_password(password, user.password):
+async def authenticate_user(db: AsyncSession, credential: str, password: str):
+    user = await get_user_async(db, credential=credential)
+    if not user or not await password_hasher.verify(password, user.password):
         return False
+
+    # transparently upgrade hashes created under an older cost setting
+    if password_hasher.needs_update(user.password):
+        user.password = await password_hasher.hash(password)
+        await db.commit()
+        await db.refresh(user)
+        principal_cache.invalidate(user.email)
     return user
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
-        expire = datetime.now(timezone.utc) + expires_delta
+        expire = datetime.now(timezone.utc) + min(expires_delta, timedelta(minutes=ACCESS_TOKEN_MAX_MINUTES))
     else:
         expire = datetime.now(timezone.utc) + \
             timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
+    to_encode.update({"exp": expire, "jti": uuid.uuid4().hex, "type": "access"})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
 
-def get_current_user(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
-    credentials_exception = HTTPException(
+def create_refresh_token(data: dict):
+    to_encode = data.copy()
+    expire = datetime.now(timezone.utc) + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+    to_encode.update({"exp": expire, "jti": uuid.uuid4().hex, "type": "refresh"})
+    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+
+
+def issue_tokens(principal: schema.Principal) -> dict:
+    # refresh tokens always carry the token version so a password reset revokes them too
+    refresh_claims = {"sub": principal.email, "ver": principal.token_version}
+    return {
+        "access_token": create_access_token(data=token_claims(principal)),
+        "refresh_token": create_refresh_token(data=refresh_claims),
+        "token_type": "bearer",
+    }
+
+
+def token_claims(principal: schema.Principal) -> dict:
+    claims = {"sub": principal.email}
+    if STATELESS_TOKENS:
+        claims.update({
+            "uid": principal.id,
+            "role": principal.role.value,
+            "ver": principal.token_version,
+        })
+    return claims
+
+
+def as_principal(user) -> schema.Principal:
+    return schema.Principal(
+        id=user.id, email=user.email,
+        role=user_role(user), token_version=user.token_version or 0)
+
+
+def credentials_exception():
+    return HTTPException(
         status_code=401,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+
+def token_digest(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def decode_access_token(token: str) -> dict:
+    digest = token_digest(token)
+    payload = token_cache.get(digest)
+    if payload is None:
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        except JWTError:
+            raise credentials_exception()
+        # tokens issued before refresh support carry no type and are access tokens
+        if not payload.get("sub") or payload.get("type", "access") != "access":
+            raise credentials_exception()
+        remaining = payload.get("exp", 0) - time.time()
+        if remaining > 0:
+            token_cache.set(digest, payload, ttl=min(remaining, token_cache.ttl))
+
+    if any(hook(payload) for hook in revocation_hooks):
+        token_cache.invalidate(digest)
+        raise credentials_exception()
+    return payload
+
+
+def decode_refresh_token(token: str) -> dict:
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if not username:
-            raise credentials_exception
     except JWTError:
-        raise credentials_exception
-    user = get_user(db, credential=username)
-    if user is None:
-        raise credentials_exception
-    return user
+        raise credentials_exception()
+    if not payload.get("sub") or payload.get("type") != "refresh" or not payload.get("jti"):
+        raise credentials_exception()
+    if revocation_list.is_revoked(payload["jti"]):
+        raise credentials_exception()
+    return payload
+
+
+def revoke_token(db: Session, claims: dict) -> bool:
+    if not claims.get("jti"):
+        return False
+    return revocation_list.revoke(db, claims["jti"], datetime.fromtimestamp(claims["exp"], timezone.utc))
+
+
+def load_user(db: Session, username: str) -> schema.Principal:
+    principal = principal_cache.get(username)
+    if principal is None:
+        user = get_user(db, credential=username)
+        if user is None:
+            raise credentials_exception()
+        # the cache is shared by every request and thread, so it holds a frozen copy, not the row
+        principal = as_principal(user)
+        principal_cache.set(username, principal)
+    return principal
+
+
+def current_token_version(db: Session, role: schema.UserRole, user_id: int) -> Optional[int]:
+    key = (role, user_id)
+    version = token_version_cache.get(key)
+    if version is None:
+        model = models.Doctor if role == schema.UserRole.DOCTOR else models.Patient
+        version = db.query(model.token_version).filter(model.id == user_id).scalar()
+        if version is None:
+            return None
+        token_version_cache.set(key, version)
+    return version
+
+
+def get_current_user(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
+    payload = decode_access_token(token)
+    return load_user(db, payload["sub"])
+
+
+# Lightweight identity for authorization checks. Stateless tokens are trusted as long as
+# their version still matches the user's; legacy tokens fall back to loading the user.
+def get_current_principal(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)) -> schema.Principal:
+    payload = decode_access_token(token)
+
+    if "uid" in payload and "role" in payload:
+        try:
+            principal = schema.Principal(
+                id=payload["uid"], email=payload["sub"],
+                role=payload["role"], token_version=payload.get("ver", 0))
+        except ValueError:
+            raise credentials_exception()
+        if current_token_version(db, principal.role, principal.id) != principal.token_version:
+            raise credentials_exception()
+        return principal
+
+    return load_user(db, payload["sub"])
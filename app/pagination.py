@@ -0,0 +1,67 @@
+import base64
+import json
+from typing import Any, List, NamedTuple, Optional, Sequence, Tuple
+
+from fastapi import HTTPException, status
+from sqlalchemy import Select, and_, or_, tuple_
+from sqlalchemy.orm import Session
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+# (expression, descending) pairs; the last one must be unique (normally the primary key)
+SortKeys = Sequence[Tuple[Any, bool]]
+
+
+class Page(NamedTuple):
+    items: List[Any]
+    next_cursor: Optional[str]
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    raw = json.dumps(list(values), separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, size: int) -> list:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        values = None
+    if not isinstance(values, list) or len(values) != size:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    return values
+
+
+def after(keys: SortKeys, values: Sequence[Any]):
+    if len({descending for _, descending in keys}) == 1:
+        # a single row-value comparison lets the database seek on a matching index
+        columns, row = tuple_(*(key for key, _ in keys)), tuple_(*values)
+        return columns < row if keys[0][1] else columns > row
+    conditions = []
+    for position, (key, descending) in enumerate(keys):
+        preceding = [k == v for (k, _), v in zip(keys[:position], values)]
+        conditions.append(and_(*preceding, key < values[position] if descending else key > values[position]))
+    return or_(*conditions)
+
+
+def page_statement(statement: Select, keys: SortKeys, limit: int,
+                   cursor: Optional[str] = None, offset: int = 0) -> Select:
+    statement = statement.add_columns(*(key.label("_sort_key_%d" % i) for i, (key, _) in enumerate(keys)))
+    statement = statement.order_by(*(key.desc() if descending else key.asc() for key, descending in keys))
+    if cursor:
+        statement = statement.where(after(keys, decode_cursor(cursor, len(keys))))
+    elif offset:
+        statement = statement.offset(offset)
+    # one extra row tells whether there is a next page
+    return statement.limit(limit + 1)
+
+
+def to_page(rows, limit: int) -> Page:
+    next_cursor = encode_cursor(tuple(rows[limit - 1])[1:]) if len(rows) > limit and limit > 0 else None
+    return Page([row[0] for row in rows[:limit]], next_cursor)
+
+
+def paginate(db: Session, statement: Select, keys: SortKeys, limit: int,
+             cursor: Optional[str] = None, offset: int = 0) -> Page:
+    rows = db.execute(page_statement(statement, keys, limit, cursor, offset)).all()
+    return to_page(rows, limit)
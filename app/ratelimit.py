@@ -0,0 +1,175 @@
+import math
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Tuple
+
+from dotenv import load_dotenv
+from app import metrics
+from app.cache import CACHE_KEY_PREFIX, CacheBackend, RedisCacheBackend, shared_cache
+
+load_dotenv()
+
+LOGIN_CREDENTIAL_BURST = float(os.getenv('LOGIN_CREDENTIAL_BURST', 10))
+LOGIN_CREDENTIAL_PER_MINUTE = float(os.getenv('LOGIN_CREDENTIAL_PER_MINUTE', 10))
+LOGIN_IP_BURST = float(os.getenv('LOGIN_IP_BURST', 100))
+LOGIN_IP_PER_MINUTE = float(os.getenv('LOGIN_IP_PER_MINUTE', 100))
+LOGIN_THROTTLE_MAX_KEYS = int(os.getenv('LOGIN_THROTTLE_MAX_KEYS', 100_000))
+
+
+class RateLimitBackend(ABC):
+    """Token bucket storage. Shared backends let every worker see the same buckets."""
+
+    # as for CacheBackend: async code calls a blocking backend through off_loop()
+    blocking: bool = False
+
+    @abstractmethod
+    def take(self, key: str, capacity: float, refill_per_second: float) -> float:
+        """Consume one token from `key`; return 0 if allowed, else seconds until one is available."""
+
+    @abstractmethod
+    def reset(self):
+        ...
+
+
+class InMemoryRateLimitBackend(RateLimitBackend):
+    """Per-process buckets, bounded so a spray of unique usernames cannot exhaust memory."""
+
+    def __init__(self, max_keys: int = LOGIN_THROTTLE_MAX_KEYS):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key: str, capacity: float, refill_per_second: float) -> float:
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated_at) * refill_per_second)
+            if tokens >= 1:
+                retry_after = 0.0
+                tokens -= 1
+            else:
+                retry_after = (1 - tokens) / refill_per_second
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return retry_after
+
+    def reset(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+# refill and take in one step on the server, so concurrent workers cannot both spend the last
+# token; Redis' own clock keeps the buckets consistent across hosts
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local refill = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+local tokens = tonumber(bucket[1]) or capacity
+local updated_at = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated_at) * refill)
+local retry_after = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    retry_after = (1 - tokens) / refill
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated_at', tostring(now))
+-- a bucket left alone this long is full again, the same as a missing one
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / refill * 1000))
+return tostring(retry_after)
+"""
+
+
+class RedisRateLimitBackend(RateLimitBackend):
+    """Buckets shared by every worker through the CACHE_URL Redis server."""
+
+    blocking = True
+
+    def __init__(self, client, prefix: str = CACHE_KEY_PREFIX):
+        import redis
+
+        self.errors = (redis.RedisError,)
+        self.prefix = prefix + "ratelimit:"
+        self.failures = 0
+        self._client = client
+        self._take = client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    def take(self, key: str, capacity: float, refill_per_second: float) -> float:
+        try:
+            return float(self._take(keys=[self.prefix + key], args=[capacity, refill_per_second]))
+        except self.errors:
+            # fail open: an unreachable Redis must not lock every user out of logging in
+            self.failures += 1
+            return 0.0
+
+    def reset(self):
+        for key in self._client.scan_iter(match=self.prefix + "*"):
+            self._client.delete(key)
+
+
+def rate_limit_backend(cache: CacheBackend) -> RateLimitBackend:
+    # share buckets whenever the caches are shared, otherwise each worker keeps its own
+    if isinstance(cache, RedisCacheBackend):
+        return RedisRateLimitBackend(cache.client)
+    return InMemoryRateLimitBackend()
+
+
+class LoginThrottle:
+    """Rejects login attempts per credential and per client IP before any bcrypt work."""
+
+    def __init__(self, backend: RateLimitBackend,
+                 credential_burst: float, credential_per_minute: float,
+                 ip_burst: float, ip_per_minute: float):
+        self.backend = backend
+        self.credential_burst = credential_burst
+        self.credential_per_minute = credential_per_minute
+        self.ip_burst = ip_burst
+        self.ip_per_minute = ip_per_minute
+        self.allowed = 0
+        self.rejected = 0
+
+    def check(self, credential: str, client_ip: str) -> int:
+        """Return 0 if the attempt may proceed, else the Retry-After value in seconds."""
+        retry_after = self.backend.take(
+            f"login:ip:{client_ip}", self.ip_burst, self.ip_per_minute / 60)
+        if not retry_after:
+            retry_after = self.backend.take(
+                f"login:credential:{credential.strip().lower()}",
+                self.credential_burst, self.credential_per_minute / 60)
+
+        if retry_after:
+            self.rejected += 1
+            return max(1, math.ceil(retry_after))
+        self.allowed += 1
+        return 0
+
+    def reset(self):
+        self.backend.reset()
+        self.allowed = 0
+        self.rejected = 0
+
+    def stats(self) -> dict:
+        return {
+            "backend": type(self.backend).__name__,
+            "allowed": self.allowed,
+            "rejected": self.rejected,
+            "backend_failures": getattr(self.backend, "failures", 0),
+        }
+
+
+login_throttle = LoginThrottle(
+    rate_limit_backend(shared_cache.backend),
+    credential_burst=LOGIN_CREDENTIAL_BURST,
+    credential_per_minute=LOGIN_CREDENTIAL_PER_MINUTE,
+    ip_burst=LOGIN_IP_BURST,
+    ip_per_minute=LOGIN_IP_PER_MINUTE,
+)
+
+metrics.register("login_throttle", login_throttle.stats)
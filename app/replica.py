@@ -0,0 +1,210 @@
+import hashlib
+import os
+import threading
+import time
+from typing import Optional
+
+from dotenv import load_dotenv
+from fastapi import Request
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import text
+from starlette.datastructures import Headers
+
+from app import metrics
+from app.cache import SharedCache, TTLCache, off_loop, shared_cache
+from app.database import (
+    async_engine, async_replica_engine, engine, read_only_async_sessionmaker, read_only_sessionmaker,
+    replica_engine)
+
+load_dotenv()
+
+# after a write the client reads from the primary for this long, so it sees its own changes
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", 5))
+READ_YOUR_WRITES_CLIENTS = int(os.getenv("READ_YOUR_WRITES_CLIENTS", 10000))
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", 10))
+REPLICA_LAG_CHECK_SECONDS = float(os.getenv("REPLICA_LAG_CHECK_SECONDS", 5))
+
+SAFE_METHODS = frozenset(("GET", "HEAD", "OPTIONS"))
+
+# dialects without an entry report no lag and the replica is always trusted.
+# The time since the last replayed transaction keeps growing while the primary is idle, so a
+# replica that has replayed everything it received counts as caught up whatever that time is.
+LAG_QUERIES = {
+    "postgresql": (
+        "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0"
+        " ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"),
+}
+
+
+def client_identity(scope) -> str:
+    authorization = Headers(scope=scope).get("authorization")
+    if authorization:
+        return "token:" + hashlib.sha256(authorization.encode()).hexdigest()
+    client = scope.get("client")
+    return "ip:%s" % (client[0] if client else "unknown")
+
+
+class ReplicaRouter:
+    """Sends read-only requests to the replica unless the client wrote recently or the replica lags."""
+
+    def __init__(self, session_factory, async_session_factory, replica_session_factory=None,
+                 async_replica_session_factory=None, replica_engine=None,
+                 sticky_seconds: float = READ_YOUR_WRITES_SECONDS,
+                 max_lag_seconds: float = REPLICA_MAX_LAG_SECONDS,
+                 lag_check_seconds: float = REPLICA_LAG_CHECK_SECONDS,
+                 shared: SharedCache = shared_cache):
+        self.session_factory = session_factory
+        self.async_session_factory = async_session_factory
+        self.replica_session_factory = replica_session_factory
+        self.async_replica_session_factory = async_replica_session_factory
+        self.replica_engine = replica_engine
+        self.max_lag_seconds = max_lag_seconds
+        self.lag_check_seconds = lag_check_seconds
+        self.sticky_seconds = sticky_seconds
+        # the local copy saves a round trip for clients that come back to the same worker;
+        # the shared one covers the next read landing on any other worker
+        self.recent_writers = TTLCache(maxsize=READ_YOUR_WRITES_CLIENTS, ttl=sticky_seconds)
+        self.shared = shared
+        self.lag_seconds: Optional[float] = None
+        self.replica_reachable = True
+        self._lag_checked_at = float("-inf")
+        self._lock = threading.Lock()
+        self.routed = self._empty_counters()
+
+    @staticmethod
+    def _empty_counters() -> dict:
+        return {"replica": 0, "primary_sticky": 0, "primary_lagging": 0, "primary_no_replica": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.replica_session_factory is not None
+
+    def _sticky_key(self, identity: str) -> str:
+        return self.shared.prefix + "sticky:" + identity
+
+    def mark_write(self, identity: str):
+        if self.enabled:
+            self.recent_writers.set(identity, True)
+            try:
+                self.shared.backend.set(self._sticky_key(identity), b"1", self.sticky_seconds)
+            except self.shared.backend.errors:
+                pass
+
+    def wrote_recently(self, identity: str) -> bool:
+        if self.recent_writers.get(identity):
+            return True
+        try:
+            return self.shared.backend.get(self._sticky_key(identity)) is not None
+        except self.shared.backend.errors:
+            return False
+
+    def clear_writes(self):
+        self.recent_writers.clear()
+        try:
+            self.shared.backend.reset(self.shared.prefix + "sticky:")
+        except self.shared.backend.errors:
+            pass
+
+    def lag_is_stale(self) -> bool:
+        return self.enabled and time.monotonic() - self._lag_checked_at >= self.lag_check_seconds
+
+    def refresh_lag(self):
+        self._lag_checked_at = time.monotonic()
+        query = self.replica_engine is not None and LAG_QUERIES.get(self.replica_engine.dialect.name)
+        if not query:
+            return
+        try:
+            with self.replica_engine.connect() as connection:
+                self.lag_seconds = float(connection.execute(text(query)).scalar())
+            self.replica_reachable = True
+        except Exception:
+            self.lag_seconds = None
+            self.replica_reachable = False
+
+    def use_replica(self, identity: str) -> bool:
+        if not self.enabled:
+            decision = "primary_no_replica"
+        elif self.wrote_recently(identity):
+            decision = "primary_sticky"
+        elif not self.replica_reachable or (self.lag_seconds or 0) > self.max_lag_seconds:
+            decision = "primary_lagging"
+        else:
+            decision = "replica"
+        with self._lock:
+            self.routed[decision] += 1
+        return decision == "replica"
+
+    def reset(self):
+        self.clear_writes()
+        self.lag_seconds = None
+        self.replica_reachable = True
+        self._lag_checked_at = float("-inf")
+        with self._lock:
+            self.routed = self._empty_counters()
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "lag_seconds": self.lag_seconds,
+            "replica_reachable": self.replica_reachable,
+            "sticky_clients": len(self.recent_writers),
+            "routed": dict(self.routed),
+        }
+
+
+class ReadYourWritesMiddleware:
+    """Marks clients whose unsafe request succeeded so their next reads stay on the primary."""
+
+    def __init__(self, app, router: Optional[ReplicaRouter] = None):
+        self.app = app
+        self.router = router
+
+    async def __call__(self, scope, receive, send):
+        router = self.router or replica_router
+        if scope["type"] != "http" or scope["method"] in SAFE_METHODS or not router.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                await off_loop(router.shared.backend, router.mark_write, client_identity(scope))
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+
+replica_router = ReplicaRouter(
+    read_only_sessionmaker(engine),
+    read_only_async_sessionmaker(async_engine),
+    replica_engine and read_only_sessionmaker(replica_engine),
+    async_replica_engine and read_only_async_sessionmaker(async_replica_engine),
+    replica_engine)
+
+metrics.register("replica", replica_router.stats)
+
+
+# Dependency for query-only handlers: read-only autocommit session on the replica or primary.
+# Handlers call database.release_connection(db) once their queries are done.
+def get_read_db(request: Request):
+    if replica_router.lag_is_stale():
+        replica_router.refresh_lag()
+    if replica_router.use_replica(client_identity(request.scope)):
+        db = replica_router.replica_session_factory()
+    else:
+        db = replica_router.session_factory()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_async_read_db(request: Request):
+    if replica_router.lag_is_stale():
+        await run_in_threadpool(replica_router.refresh_lag)
+    # use_replica() asks the shared cache whether the client wrote recently
+    if await off_loop(replica_router.shared.backend, replica_router.use_replica, client_identity(request.scope)):
+        factory = replica_router.async_replica_session_factory
+    else:
+        factory = replica_router.async_session_factory
+    async with factory() as db:
+        yield db
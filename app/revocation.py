@@ -0,0 +1,204 @@
+import asyncio
+import hashlib
+import math
+import os
+import threading
+from datetime import datetime, timezone
+from itertools import chain
+
+from dotenv import load_dotenv
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.orm import Session
+from app import metrics, models
+from app.database import SessionLocal
+
+load_dotenv()
+
+REVOCATION_FILTER_CAPACITY = int(os.getenv('REVOCATION_FILTER_CAPACITY', 100_000))
+REVOCATION_FILTER_ERROR_RATE = float(os.getenv('REVOCATION_FILTER_ERROR_RATE', 0.001))
+# how often each worker's background task merges revocations made by other workers into its filter
+REVOCATION_REFRESH_SECONDS = float(os.getenv('REVOCATION_REFRESH_SECONDS', 30))
+# how often the background task deletes revocations of tokens that have expired anyway
+REVOCATION_PURGE_SECONDS = float(os.getenv('REVOCATION_PURGE_SECONDS', 3600))
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter: no false negatives, false positives at about `error_rate`."""
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: str):
+        # double hashing: k positions from two 64-bit halves of one digest
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "big")
+        h2 = int.from_bytes(digest[8:], "big") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hash_count))
+
+    def add(self, item: str):
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class RevocationList:
+    """Revoked token ids persisted in `revoked_tokens` and mirrored into a Bloom filter.
+
+    A filter miss proves a token was never revoked, so the common path is an in-memory
+    O(1) check. Only filter hits (real revocations or rare false positives) touch the table.
+    Requests never reload the table: a lifespan task merges other workers' revocations into
+    the filter every `refresh_seconds` (refresh_periodically()).
+    """
+
+    def __init__(self, session_factory=SessionLocal, capacity: int = REVOCATION_FILTER_CAPACITY,
+                 error_rate: float = REVOCATION_FILTER_ERROR_RATE, refresh_seconds: float = REVOCATION_REFRESH_SECONDS):
+        self.session_factory = session_factory
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.refresh_seconds = refresh_seconds
+        self.checks = 0
+        self.filter_hits = 0
+        self.false_positives = 0
+        self.purged = 0
+        self.refreshes = 0
+        self.rebuilds = 0
+        self._filter = BloomFilter(capacity, error_rate)
+        # jtis added while a rebuild reads the table, replayed into the new filter
+        self._added_during_rebuild = None
+        self._lock = threading.Lock()
+
+    def add(self, jti: str):
+        with self._lock:
+            if jti not in self._filter:
+                self._filter.add(jti)
+            if self._added_during_rebuild is not None:
+                self._added_during_rebuild.append(jti)
+
+    def refresh(self):
+        """Merge the unexpired revocations recorded by any worker into the filter."""
+        with self._lock:
+            # expired tokens stay in the filter until it holds more than it was sized for;
+            # then it is rebuilt from the table, without them
+            rebuild = self._filter.count > self._filter.capacity
+            if rebuild:
+                self._added_during_rebuild = []
+        try:
+            now = datetime.now(timezone.utc)
+            with self.session_factory() as db:
+                # expired rows wait for purge_expired(); their tokens are rejected on exp already
+                jtis = [jti for (jti,) in db.query(models.RevokedToken.jti).filter(models.RevokedToken.expires_at >= now)]
+            with self._lock:
+                if rebuild:
+                    bloom = BloomFilter(max(self.capacity, len(jtis) * 2), self.error_rate)
+                    for jti in chain(jtis, self._added_during_rebuild):
+                        if jti not in bloom:
+                            bloom.add(jti)
+                    self._filter = bloom
+                    self.rebuilds += 1
+                else:
+                    for jti in jtis:
+                        if jti not in self._filter:
+                            self._filter.add(jti)
+                self.refreshes += 1
+        finally:
+            if rebuild:
+                with self._lock:
+                    self._added_during_rebuild = None
+
+    async def refresh_periodically(self):
+        # started by the app lifespan after the first try_refresh()
+        while True:
+            await asyncio.sleep(self.refresh_seconds)
+            await self.try_refresh()
+
+    async def try_refresh(self) -> bool:
+        try:
+            await run_in_threadpool(self.refresh)
+            return True
+        except SQLAlchemyError:
+            # keep checking against the filter we have, the next run tries again
+            return False
+
+    def is_revoked(self, jti: str) -> bool:
+        self.checks += 1
+        if jti not in self._filter:
+            return False
+        self.filter_hits += 1
+        with self.session_factory() as db:
+            revoked = db.query(models.RevokedToken.id).filter(models.RevokedToken.jti == jti).first() is not None
+        if not revoked:
+            self.false_positives += 1
+        return revoked
+
+    # revocation hook for oauth2.decode_access_token
+    def is_revoked_claims(self, claims: dict) -> bool:
+        jti = claims.get("jti")
+        return bool(jti) and self.is_revoked(jti)
+
+    def revoke(self, db: Session, jti: str, expires_at: datetime) -> bool:
+        """Record the revocation; False if `jti` was already revoked, e.g. by a concurrent request."""
+        # the unique index on jti makes the insert the claim, there is no window between check and write
+        db.add(models.RevokedToken(jti=jti, expires_at=expires_at))
+        try:
+            db.commit()
+            claimed = True
+        except IntegrityError:
+            db.rollback()
+            claimed = False
+        self.add(jti)
+        return claimed
+
+    def purge_expired(self) -> int:
+        now = datetime.now(timezone.utc)
+        with self.session_factory() as db:
+            deleted = db.query(models.RevokedToken).filter(models.RevokedToken.expires_at < now).delete()
+            db.commit()
+        self.purged += deleted
+        return deleted
+
+    async def purge_periodically(self, interval: float = REVOCATION_PURGE_SECONDS):
+        # started by the app lifespan so no request ever waits on the DELETE
+        while True:
+            try:
+                await run_in_threadpool(self.purge_expired)
+            except SQLAlchemyError:
+                pass
+            await asyncio.sleep(interval)
+
+    def reset(self):
+        with self._lock:
+            self._filter = BloomFilter(self.capacity, self.error_rate)
+            self._added_during_rebuild = None
+        self.refreshes = 0
+        self.rebuilds = 0
+        self.checks = 0
+        self.filter_hits = 0
+        self.false_positives = 0
+        self.purged = 0
+
+    def stats(self) -> dict:
+        return {
+            "entries": self._filter.count,
+            "filter_bits": self._filter.size,
+            "hash_functions": self._filter.hash_count,
+            "refreshes": self.refreshes,
+            "rebuilds": self.rebuilds,
+            "checks": self.checks,
+            "filter_hits": self.filter_hits,
+            "false_positives": self.false_positives,
+            "purged": self.purged,
+        }
+
+
+revocation_list = RevocationList()
+
+metrics.register("revocation_list", revocation_list.stats)
@@ -3,64 +3,20 @@ from sqlalchemy.orm import Session
 from typing import Optional, List
 from app.crud.patients import patient_crud_service as pat_crud
 from app.crud import appointment as apt_crud
-from app.crud.doctors import doctor_crud_service as doc_crud
-from app import schema, database, models, oauth2
+from app import schema, database, oauth2, replica
+from app.serializers import appointment_list, json_list_response
 
 router = APIRouter(
     tags=['Appointments']
     )
 
 @router.post('/appointments/{patient_id}', status_code=status.HTTP_201_CREATED, response_model=schema.AppointmentResponse)
-def create_appointment(payload: schema.AppointmentCreate, patient_id: int, db: Session = Depends(database.get_db), current_user: models.Patient = Depends(oauth2.get_current_user)):
-    patient = pat_crud.get_patient_by_id(patient_id, db)
-    if not patient:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="The patient with id '%s' does not exist" % patient_id
-        )
-    
-    #check if the patient has a pending appointment
-    if apt_crud.check_pending_appointment(patient_id, db):
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="The patient already has a pending appointment. Please progress with the previous appointment or cancel it."
-        )
-
-    #check if the doctor
-    #only patients can create an appointment
-    if current_user.id != patient.id:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Only patients can create appointments."
-        )
-    
-    #updating this session with doctor id validation
-    doctor = doc_crud.get_doctor_by_id(db, payload.doctor_id)
-
-    # validating availability of doctor in the database
-    if not doctor:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="The doctor with id '%s' does not exist" % payload.doctor_id
-        )
-
-    # validate doctor status
-    if doctor.is_available == False:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="The doctor is not available at the moment."
-        )
-
-    appointment = apt_crud.create_appointment(payload, patient_id, db)
-
-    doctor.is_available = False
-    db.commit()
-    db.refresh(doctor)
-
-    return appointment
+def create_appointment(payload: schema.AppointmentCreate, patient_id: int, db: Session = Depends(database.get_db), current_user: schema.Principal = Depends(oauth2.get_current_principal)):
+    # one transaction, see apt_crud.book_appointment: a doctor can never be claimed by two bookings
+    return apt_crud.book_appointment(payload, patient_id, current_user, db)
 
 @router.get('/appointments/{patient_id}', status_code=status.HTTP_200_OK, response_model=List[schema.AppointmentResponse])
-def get_appointments(patient_id: int, db: Session = Depends(database.get_db), current_user: models.Patient = Depends(oauth2.get_current_user)):
+def get_appointments(patient_id: int, db: Session = Depends(replica.get_read_db), current_user: schema.Principal = Depends(oauth2.get_current_principal)):
     patient = pat_crud.get_patient_by_id(patient_id, db)
     if not patient:
         raise HTTPException(
@@ -69,16 +25,18 @@ def get_appointments(patient_id: int, db: Session = Depends(database.get_db), cu
         )
     
     appointments = apt_crud.get_appointments_by_patient_id(patient_id, db)
+    database.release_connection(db)
 
-    return appointments
+    return json_list_response(appointment_list, appointments)
 
 @router.get('/appointments', status_code=status.HTTP_200_OK, response_model=List[schema.AppointmentResponse])
-def get_appointments(offset: int = 0, limit: int = 10, db: Session = Depends(database.get_db)):
-    appointments = apt_crud.get_appointment(offset, limit, db)
-    return appointments
+def get_appointments(offset: int = 0, limit: int = 10, cursor: Optional[str] = None, db: Session = Depends(replica.get_read_db)):
+    page = apt_crud.get_appointment(offset, limit, db, cursor)
+    database.release_connection(db)
+    return json_list_response(appointment_list, page.items, page.next_cursor)
 
 @router.put('/appointments/{appointment_id}', status_code=status.HTTP_202_ACCEPTED, response_model=schema.AppointmentResponse)
-def update_appointment(appointment_id: int, payload: schema.AppointmentUpdate, db: Session = Depends(database.get_db), current_user: models.Patient = Depends(oauth2.get_current_user)):
+def update_appointment(appointment_id: int, payload: schema.AppointmentUpdate, db: Session = Depends(database.get_db), current_user: schema.Principal = Depends(oauth2.get_current_principal)):
     appointment = apt_crud.get_appointment_by_id(appointment_id, db)
     if not appointment:
         raise HTTPException(
@@ -86,7 +44,7 @@ def update_appointment(appointment_id: int, payload: schema.AppointmentUpdate, d
             detail="The appointment with id '%s' does not exist" % appointment_id
         )
     
-    if appointment.patient_id != current_user.id:
+    if current_user.role != schema.UserRole.PATIENT or appointment.patient_id != current_user.id:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="You are not authorized to perform this action."
@@ -96,7 +54,7 @@ def update_appointment(appointment_id: int, payload: schema.AppointmentUpdate, d
     return appointment
 
 @router.post('/appointments/{appointment_id}/cancel_appointment', status_code=status.HTTP_202_ACCEPTED)
-def cancel_appointment(appointment_id: int, db: Session = Depends(database.get_db), current_user: models.Patient = Depends(oauth2.get_current_user)):
+def cancel_appointment(appointment_id: int, db: Session = Depends(database.get_db), current_user: schema.Principal = Depends(oauth2.get_current_principal)):
     appointment = apt_crud.get_appointment_by_id(appointment_id, db)
     if not appointment:
         raise HTTPException(
@@ -104,8 +62,7 @@ def cancel_appointment(appointment_id: int, db: Session = Depends(database.get_d
             detail="The appointment with id '%s' does not exist" % appointment_id
         )
     
-    patient = pat_crud.get_patient_by_id(current_user.id, db)
-    if appointment.patient_id != patient.id:
+    if current_user.role != schema.UserRole.PATIENT or appointment.patient_id != current_user.id:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="You are not authorized to perform this action."
@@ -113,10 +70,4 @@ def cancel_appointment(appointment_id: int, db: Session = Depends(database.get_d
     
     apt_crud.cancel_appointment(appointment_id, db)
 
-    doctor = doc_crud.get_doctor_by_id(db, appointment.doctor_id)
-
-    doctor.is_available = True
-    db.commit()
-    db.refresh(doctor)
-
     return {"message": "Appointment cancelled successfully"}
\ No newline at end of file
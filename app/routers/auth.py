@@ -1,25 +1,29 @@
 
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordRequestForm
+from typing import Optional
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from app.oauth2 import authenticate_user, create_access_token, pwd_context, verify_password
-from app.database import get_db
-from app import schema, models,oauth2
-from app.crud.patients import patient_crud_service
-from app.crud.doctors import doctor_crud_service
+from app.oauth2 import authenticate_user, password_hasher, verify_password
+from app.database import get_async_db, get_db
+from app import schema, oauth2
+from app.crud.patients import async_patient_crud_service
+from app.crud.doctors import async_doctor_crud_service, doctor_crud_service
 from app.crud import appointment as apt_crud
-from app.utils import validate_password, users_email, update_password, users_id
+from app.utils import validate_password, users_email, update_password, user_role
+from app.cache import off_loop
+from app.ratelimit import login_throttle
 
 auth_router = APIRouter()
 
 
 @auth_router.post('/signup/patient', status_code=201, response_model=schema.Patient)
-async def create_patient(payload: schema.PatientCreate, db: Session = Depends(get_db)):
-    patient = patient_crud_service.get_patient(db, credential=payload.email)
+async def create_patient(payload: schema.PatientCreate, db: AsyncSession = Depends(get_async_db)):
+    patient = await async_patient_crud_service.get_patient(db, credential=payload.email)
     if patient:
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail='Email already registered')
-    patient = patient_crud_service.get_patient(db, credential=payload.hospital_card_id)
+    patient = await async_patient_crud_service.get_patient(db, credential=payload.hospital_card_id)
     if patient:
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail='Hospital ID already registered')
     
@@ -30,18 +34,18 @@ async def create_patient(payload: schema.PatientCreate, db: Session = Depends(ge
     if password_validation_result != "Password is valid":
         raise HTTPException(status_code=400, detail=password_validation_result)
     
-    hashed_password = pwd_context.hash(payload.password)
+    hashed_password = await password_hasher.hash(payload.password)
     payload.password = hashed_password
-    return patient_crud_service.create_patient(db=db, payload=payload)
+    return await async_patient_crud_service.create_patient(db=db, payload=payload)
 
 
 @auth_router.post('/signup/doctor', status_code=201, response_model=schema.Doctor)
-async def create_doctor(payload: schema.DoctorCreate, db: Session = Depends(get_db)):
-    doctor = doctor_crud_service.get_doctor(db, credential=payload.email)
+async def create_doctor(payload: schema.DoctorCreate, db: AsyncSession = Depends(get_async_db)):
+    doctor = await async_doctor_crud_service.get_doctor(db, credential=payload.email)
     if doctor:
         raise HTTPException(status_code=status.HTTP_409_CONFLICT,
                             detail='Email already registered')
-    doctor = doctor_crud_service.get_doctor(
+    doctor = await async_doctor_crud_service.get_doctor(
         db, credential=payload.hospital_id)
     if doctor:
         raise HTTPException(status_code=status.HTTP_409_CONFLICT,
@@ -54,26 +58,59 @@ async def create_doctor(payload: schema.DoctorCreate, db: Session = Depends(get_
     if password_validation_result != "Password is valid":
         raise HTTPException(status_code=400, detail=password_validation_result)
 
-    hashed_password = pwd_context.hash(payload.password)
+    hashed_password = await password_hasher.hash(payload.password)
     payload.password = hashed_password
 
-    return doctor_crud_service.create_doctor(db=db, payload=payload)
+    return await async_doctor_crud_service.create_doctor(db=db, payload=payload)
 
 
-@auth_router.post("/login", status_code=200)
-async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = authenticate_user(db, credential=form_data.username, password=form_data.password)
+@auth_router.post("/login", status_code=200, response_model=schema.Token)
+async def login(request: Request, form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)):
+    # shed excess attempts before they cost a database lookup and a bcrypt verify
+    client_ip = request.client.host if request.client else "unknown"
+    retry_after = await off_loop(login_throttle.backend, login_throttle.check, form_data.username, client_ip)
+    if retry_after:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many login attempts. Please try again later.",
+            headers={"Retry-After": str(retry_after)},
+        )
+
+    user = await authenticate_user(db, credential=form_data.username, password=form_data.password)
     if not user:
         raise HTTPException(
             status_code=401,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    access_token = create_access_token(data={"sub": user.email})
-    return {"access_token": access_token, "token_type": "bearer"}
+    return oauth2.issue_tokens(oauth2.as_principal(user))
+
+
+@auth_router.post("/token/refresh", status_code=200, response_model=schema.Token)
+def refresh_token(payload: schema.RefreshRequest, db: Session = Depends(get_db)):
+    claims = oauth2.decode_refresh_token(payload.refresh_token)
+    principal = oauth2.load_user(db, claims["sub"])
+    if claims.get("ver", 0) != principal.token_version:
+        raise oauth2.credentials_exception()
+
+    # rotate: each refresh token can be exchanged exactly once. Revoking is the claim,
+    # so of two concurrent requests with the same token only one gets new tokens
+    if not oauth2.revoke_token(db, claims):
+        raise oauth2.credentials_exception()
+    return oauth2.issue_tokens(principal)
+
+
+@auth_router.post("/logout", status_code=status.HTTP_200_OK)
+def logout(payload: Optional[schema.LogoutRequest] = None, db: Session = Depends(get_db), token: str = Depends(oauth2.oauth2_scheme)):
+    oauth2.revoke_token(db, oauth2.decode_access_token(token))
+
+    if payload and payload.refresh_token:
+        oauth2.revoke_token(db, oauth2.decode_refresh_token(payload.refresh_token))
+
+    return {"message": "Logged out successfully"}
 
 @auth_router.post('/auth/password_reset', status_code=status.HTTP_202_ACCEPTED)
-def password_reset(payload: schema.PasswordReset, db: Session = Depends(get_db), patient_current_user: models.Patient=Depends(oauth2.get_current_user), doctor_current_user: models.Doctor=Depends(oauth2.get_current_user)):
+def password_reset(payload: schema.PasswordReset, db: Session = Depends(get_db), patient_current_user: schema.Principal=Depends(oauth2.get_current_principal), doctor_current_user: schema.Principal=Depends(oauth2.get_current_principal)):
     user = users_email(email=payload.email, db=db)
     if not user:
         raise HTTPException(
@@ -82,9 +119,8 @@ def password_reset(payload: schema.PasswordReset, db: Session = Depends(get_db),
         )
     
     #validate user
-    patient_user = users_id(patient_current_user.id, db)
-    doctor_user = users_id(doctor_current_user.id, db)
-    if patient_user.email != user.email and doctor_user.email != user.email:
+    # patient and doctor ids overlap, so the role has to match as well as the id
+    if user_role(user) != patient_current_user.role or user.id != patient_current_user.id:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="You are not allowed to perform this action!"
@@ -115,7 +151,7 @@ def password_reset(payload: schema.PasswordReset, db: Session = Depends(get_db),
     return {"details": "Password has been changed successfully!"}
 
 @auth_router.put('/admin/apppointment_status', status_code=status.HTTP_202_ACCEPTED)
-def appointment_status_switch(patient_id: int, appointment_id: int, payload: schema.AppointmentStatusSwitch, db: Session = Depends(get_db), current_user: models.Doctor = Depends(oauth2.get_current_user)):
+def appointment_status_switch(patient_id: int, appointment_id: int, payload: schema.AppointmentStatusSwitch, db: Session = Depends(get_db), current_user: schema.Principal = Depends(oauth2.get_current_principal)):
     
     appointment = apt_crud.status_validation(patient_id, appointment_id, db)
     if not appointment:
@@ -126,7 +162,7 @@ def appointment_status_switch(patient_id: int, appointment_id: int, payload: sch
     
     doctor = doctor_crud_service.get_doctor_by_id(db=db, doctor_id=current_user.id)
 
-    if not doctor:
+    if current_user.role != schema.UserRole.DOCTOR or not doctor:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="You are not authorized to perform this action!"
@@ -1,10 +1,16 @@
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from app import schema
-from app.crud.doctors import doctor_crud_service
-from app.database import get_db
-from app.oauth2 import get_current_user
+from datetime import datetime, timedelta
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from sqlalchemy.ext.asyncio import AsyncSession
+from app import scheduling, schema
+from app.crud.doctors import async_doctor_crud_service as doctor_crud_service, doctor_directory, page_entries
+from app.crud.schedules import async_schedule_crud_service as schedule_crud_service
+from app.database import get_async_db, release_connection
+from app.etags import ETAG_HEADER, collection_etag, matches, not_modified, resource_etag
+from app.replica import get_async_read_db
+from app.oauth2 import get_current_principal
+from app.fieldsets import parse_fields
+from app.serializers import doctor_list, json_list_response, sparse_json_response
 
 
 router = APIRouter(
@@ -13,70 +19,132 @@ router = APIRouter(
 
 
 @router.get('/doctors', status_code=200, response_model=List[schema.Doctor])
-async def get_doctors(db: Session = Depends(get_db), offset: int = 0, limit: int = 10):
-    doctors = doctor_crud_service.get_all_doctors(db, offset, limit)
+async def get_doctors(request: Request, offset: int = 0, limit: int = 10, cursor: Optional[str] = None, fields: Optional[str] = None):
+    fields = parse_fields(fields, schema.Doctor)
+    # served from the in-memory directory snapshot, no database access
+    directory = await doctor_directory.snapshot()
+    etag = collection_etag("doctors", directory.version, request)
+    if matches(request, etag):
+        return not_modified(etag)
 
-    return doctors
+    page = page_entries(directory.doctors, offset, limit, cursor)
+
+    response = json_list_response(doctor_list, page.items, page.next_cursor, fields)
+    response.headers[ETAG_HEADER] = etag
+    return response
 
 @router.get('/doctors/specialization', status_code=200, response_model=List[schema.Doctor])
-async def get_doctor_by_specialization(specialization: str, db: Session = Depends(get_db), offset: int = 0, limit: int = 10):
-    doctors = doctor_crud_service.get_doctor_by_specialization(db, specialization=specialization, offset=offset, limit=limit)
+async def get_doctor_by_specialization(specialization: str, request: Request, offset: int = 0, limit: int = 10, cursor: Optional[str] = None, fields: Optional[str] = None):
+    fields = parse_fields(fields, schema.Doctor)
+    directory = await doctor_directory.snapshot()
+    etag = collection_etag("doctors", directory.version, request)
+    if matches(request, etag):
+        return not_modified(etag)
+
+    page = page_entries(directory.by_specialization.get(specialization, ()), offset, limit, cursor)
+    doctors = page.items
 
     if not doctors:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Enter a valid specialization')
-    
-    if len(doctors) == 0:
-        return {'message': 'No available doctors yet. Check at another time'}
-    
-    return doctors
+
+    response = json_list_response(doctor_list, doctors, page.next_cursor, fields)
+    response.headers[ETAG_HEADER] = etag
+    return response
 
 
 @router.get('/doctors/{doctor_id}', status_code=200, response_model=schema.Doctor)
-async def get_doctor_by_id(doctor_id: str, db: Session = Depends(get_db)):
-    doctor = doctor_crud_service.get_doctor_by_id(db, doctor_id=doctor_id)
+async def get_doctor_by_id(doctor_id: int, request: Request, response: Response, db: AsyncSession = Depends(get_async_read_db), fields: Optional[str] = None):
+    fields = parse_fields(fields, schema.Doctor)
+    doctor = await doctor_directory.get_doctor_by_id(doctor_id)
+    if doctor is None:
+        # possibly created by another worker since our snapshot was taken
+        doctor = await doctor_crud_service.get_doctor_by_id(db, doctor_id=doctor_id, fields=fields)
+        await release_connection(db)
 
     if not doctor:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Doctor not found')
     
+    etag = resource_etag("doctor", doctor, fields)
+    if matches(request, etag):
+        return not_modified(etag)
+
+    if fields:
+        return sparse_json_response(doctor, fields, {ETAG_HEADER: etag})
+    response.headers[ETAG_HEADER] = etag
     return doctor
 
+@router.get('/doctors/{doctor_id}/schedule', status_code=200, response_model=List[schema.ScheduleSlot])
+async def get_doctor_schedule(doctor_id: int, start: datetime = Query(alias="from"), end: datetime = Query(alias="to"), db: AsyncSession = Depends(get_async_read_db)):
+    start, end = scheduling.localize(start), scheduling.localize(end)
+    if not start < end <= start + timedelta(days=scheduling.MAX_SCHEDULE_DAYS):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Enter a range of at most %d days' % scheduling.MAX_SCHEDULE_DAYS)
+
+    if await doctor_directory.get_doctor_by_id(doctor_id) is None and not await doctor_crud_service.get_doctor_by_id(db, doctor_id=doctor_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Doctor not found')
+
+    schedules = await schedule_crud_service.get_schedules(db, doctor_id)
+    booked = await schedule_crud_service.get_booked(db, doctor_id, start, end)
+    await release_connection(db)
+
+    bookings = scheduling.IntervalTree(
+        (scheduling.from_db(row.appointment_date), scheduling.from_db(row.ends_at), row.id) for row in booked)
+    slots = []
+    for slot in scheduling.slots_between(schedules, start, end):
+        taken = len(bookings.overlapping(slot.start, slot.end))
+        slots.append({"start": slot.start, "end": slot.end, "capacity": slot.capacity,
+                      "booked": taken, "available": max(slot.capacity - taken, 0)})
+    return slots
+
+
+@router.put('/doctors/{doctor_id}/schedule', status_code=200, response_model=List[schema.DoctorSchedule])
+async def update_doctor_schedule(doctor_id: int, payload: List[schema.DoctorScheduleCreate], db: AsyncSession = Depends(get_async_db), current_user: schema.Principal = Depends(get_current_principal)):
+    if current_user.role != schema.UserRole.DOCTOR or current_user.id != doctor_id:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Not authorized to make changes')
+
+    if scheduling.overlapping_hours(payload):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Working hours overlap on the same weekday')
+
+    # an empty list clears the schedule and puts the doctor back on the is_available flag
+    return await schedule_crud_service.replace_schedules(db, doctor_id, payload)
+
+
 @router.post('/doctors/{doctor_id}/change_availability', status_code=200)
-async def change_availability_status(doctor_id: int, db: Session = Depends(get_db), current_user: schema.Doctor = Depends(get_current_user)):
-    doctor = doctor_crud_service.get_doctor_by_id(db, doctor_id=doctor_id)
+async def change_availability_status(doctor_id: int, db: AsyncSession = Depends(get_async_db), current_user: schema.Principal = Depends(get_current_principal)):
+    doctor = await doctor_crud_service.get_doctor_by_id(db, doctor_id=doctor_id)
     if not doctor:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Doctor not found')
     
-    if current_user.id != doctor_id:
+    if current_user.role != schema.UserRole.DOCTOR or current_user.id != doctor_id:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Not authorized to make changes')
     
-    doctor_crud_service.change_doctor_availability_status(db, doctor_id=doctor_id)
+    await doctor_crud_service.change_doctor_availability_status(db, doctor_id=doctor_id)
 
     return {"Status updated successfully!"}
 
 
 @router.put('/doctors/{doctor_id}', status_code=200, response_model=schema.Doctor)
-async def update_doctor(doctor_id: int, payload: schema.DoctorUpdate, db: Session = Depends(get_db), current_user: schema.Doctor = Depends(get_current_user)):
-    doctor = doctor_crud_service.get_doctor_by_id(db, doctor_id=doctor_id)
+async def update_doctor(doctor_id: int, payload: schema.DoctorUpdate, db: AsyncSession = Depends(get_async_db), current_user: schema.Principal = Depends(get_current_principal)):
+    doctor = await doctor_crud_service.get_doctor_by_id(db, doctor_id=doctor_id)
     if not doctor:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Doctor not found')
     
-    if doctor_id != current_user.id:
+    if current_user.role != schema.UserRole.DOCTOR or doctor_id != current_user.id:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Not authorized to make changes')
     
-    updated_doctor = doctor_crud_service.update_doctor(db, payload=payload, doctor_id=doctor_id)
+    updated_doctor = await doctor_crud_service.update_doctor(db, payload=payload, doctor_id=doctor_id)
 
     return updated_doctor
 
 
 @router.delete('/doctors/{doctor_id}', status_code=200)
-async def delete_doctor(doctor_id: int, db: Session = Depends(get_db), current_user: schema.Doctor = Depends(get_current_user)):
-    doctor = doctor_crud_service.get_doctor_by_id(db, doctor_id=doctor_id)
+async def delete_doctor(doctor_id: int, db: AsyncSession = Depends(get_async_db), current_user: schema.Principal = Depends(get_current_principal)):
+    doctor = await doctor_crud_service.get_doctor_by_id(db, doctor_id=doctor_id)
     if not doctor:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Doctor not found')
     
-    if doctor_id != current_user.id:
+    if current_user.role != schema.UserRole.DOCTOR or doctor_id != current_user.id:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Not authorized to make changes')
 
-    doctor = doctor_crud_service.delete_doctor(db, doctor_id=doctor_id)
+    doctor = await doctor_crud_service.delete_doctor(db, doctor_id=doctor_id)
 
     return {'message': 'Deleted Successfully'}
\ No newline at end of file
@@ -1,13 +1,13 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Response, status
 from typing import List
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from app import models, schema, oauth2
-from app.crud.patients import patient_crud_service
+from app.crud.patients import async_patient_crud_service as patient_crud_service
 from app.crud.appointment import get_uncompleted_appointments
-from app.crud.doctors import doctor_crud_service as doc_crud
-from app.database import get_db
-from app.oauth2 import get_current_user
-from app.crud.emr import emr_crud_service # type: ignore
+from app.crud.doctors import async_doctor_crud_service as doc_crud
+from app.database import get_async_db
+from app.oauth2 import get_current_principal
+from app.crud.emr import EMR_JSON_AGGREGATION, async_emr_crud_service as emr_crud_service # type: ignore
 
 
 router = APIRouter(
@@ -47,53 +47,62 @@ router = APIRouter(
 #     return appointments
 
 @router.get('/emr/patient_records/{patient_id}', status_code=200, response_model=List[schema.EMRResponse])
-async def get_patient_records(patient_id: int, db: Session = Depends(get_db), doctor_current_user: models.Doctor = Depends(oauth2.get_current_user)):
+async def get_patient_records(patient_id: int, db: AsyncSession = Depends(get_async_db), doctor_current_user: schema.Principal = Depends(oauth2.get_current_principal)):
     
-    patient = patient_crud_service.get_patient_by_id(id=patient_id, db=db)
+    patient = await patient_crud_service.get_patient_by_id(id=patient_id, db=db)
     if not patient:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Emr with patient id not found')
     
-    doc_validate = emr_crud_service.validate_patient_doctor(patient_id, doctor_current_user.id, db)
+    doc_validate = await emr_crud_service.validate_patient_doctor(patient_id, doctor_current_user.id, db)
 
     doctors_id = [doctors.doctor_id for doctors in doc_validate]
 
-    if doctor_current_user.id not in doctors_id:
+    if doctor_current_user.role != schema.UserRole.DOCTOR or doctor_current_user.id not in doctors_id:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='You are not authorized to view these records')
     
-    patient_emrs = emr_crud_service.get_patient_EMR(patient_id, db)
+    # the whole history in one round trip, already serialised by Postgres
+    if EMR_JSON_AGGREGATION and db.get_bind().dialect.name == "postgresql":
+        return Response(await emr_crud_service.get_patient_EMR_json(patient_id, db), media_type="application/json")
+
+    patient_emrs = await emr_crud_service.get_patient_EMR(patient_id, db)
 
     return patient_emrs
 
 @router.post('/emr/{patient_id}', status_code=201, response_model=schema.EMRResponse)
-async def create_record(patient_id: int,  payload: schema.EMRCreate, db: Session = Depends(get_db), current_user: models.Doctor = Depends(get_current_user)):
-    patient = patient_crud_service.get_patient_by_id(patient_id, db)
+async def create_record(patient_id: int,  payload: schema.EMRCreate, db: AsyncSession = Depends(get_async_db), current_user: schema.Principal = Depends(get_current_principal)):
+    patient = await patient_crud_service.get_patient_by_id(patient_id, db)
     if not patient:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Patient not found')
     
-    doctor_validate = doc_crud.get_doctor_by_id(db=db, doctor_id=current_user.id)
+    if current_user.role != schema.UserRole.DOCTOR:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Not authorized')
+
+    doctor_validate = await doc_crud.get_doctor_by_id(db=db, doctor_id=current_user.id)
+    if not doctor_validate:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Doctor not found')
     if doctor_validate.id != current_user.id:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Not authorized')
     
-    Emr = emr_crud_service.create_patient_EMR(db, payload, patient_id)
+    Emr = await emr_crud_service.create_patient_EMR(db, payload, patient_id)
 
     return Emr
 
 
 @router.delete('/emr/{emr_id}', status_code=status.HTTP_202_ACCEPTED)
-async def delete_record(patient_id: int, emr_id: int, db: Session = Depends(get_db), current_user: models.Doctor = Depends(get_current_user)):
-    emr = emr_crud_service.get_patient_EMR2(patient_id, emr_id, db)
+async def delete_record(patient_id: int, emr_id: int, db: AsyncSession = Depends(get_async_db), current_user: schema.Principal = Depends(get_current_principal)):
+    emr = await emr_crud_service.get_patient_EMR2(patient_id, emr_id, db)
     
     if not emr:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail='Record not found')
 
-    doc_validate = emr_crud_service.validate_patient_doctor(patient_id, current_user.id, db)
+    doc_validate = await emr_crud_service.validate_patient_doctor(patient_id, current_user.id, db)
 
     doctors_id = [doctors.doctor_id for doctors in doc_validate]
 
-    if current_user.id not in doctors_id:
+    if current_user.role != schema.UserRole.DOCTOR or current_user.id not in doctors_id:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='You can not perform the requested action')
 
-    emr_crud_service.delete_patient_EMR(emr.id, emr.patient_id, db)
+    await emr_crud_service.delete_patient_EMR(patient_id=emr.patient_id, emr_id=emr.id, db=db)
 
     return {'message': 'Record deleted successfully'}
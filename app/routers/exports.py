@@ -0,0 +1,43 @@
+from datetime import date
+from typing import Callable, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy import Select
+
+from app import schema
+from app.database import get_session_factory
+from app.exports import MEDIA_TYPES, appointments_export_statement, patients_export_statement, stream_rows
+from app.oauth2 import get_current_principal
+
+
+router = APIRouter(
+    tags=['Exports']
+)
+
+
+def export_response(name: str, statement: Select, export_format: schema.ExportFormat, session_factory: Callable) -> StreamingResponse:
+    return StreamingResponse(
+        stream_rows(session_factory, statement, export_format),
+        media_type=MEDIA_TYPES[export_format],
+        headers={"Content-Disposition": 'attachment; filename="%s.%s"' % (name, export_format.value)},
+    )
+
+
+def require_doctor(current_user: schema.Principal):
+    if current_user.role != schema.UserRole.DOCTOR:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='Only doctors can export records')
+
+
+@router.get('/exports/patients', status_code=200)
+def export_patients(format: schema.ExportFormat = schema.ExportFormat.NDJSON, start: Optional[date] = None, end: Optional[date] = None, session_factory: Callable = Depends(get_session_factory), current_user: schema.Principal = Depends(get_current_principal)):
+    require_doctor(current_user)
+    # filtered on the registration date
+    return export_response("patients", patients_export_statement(start, end), format, session_factory)
+
+
+@router.get('/exports/appointments', status_code=200)
+def export_appointments(format: schema.ExportFormat = schema.ExportFormat.NDJSON, start: Optional[date] = None, end: Optional[date] = None, session_factory: Callable = Depends(get_session_factory), current_user: schema.Principal = Depends(get_current_principal)):
+    require_doctor(current_user)
+    # filtered on the appointment date
+    return export_response("appointments", appointments_export_statement(start, end), format, session_factory)
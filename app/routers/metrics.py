@@ -0,0 +1,17 @@
+import os
+from fastapi import APIRouter, HTTPException, status
+from app import metrics
+
+# pool, cache and replica internals are for operators only; off unless explicitly enabled
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+
+router = APIRouter(
+    tags=['Metrics']
+)
+
+
+@router.get('/metrics', status_code=status.HTTP_200_OK)
+def get_metrics():
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    return metrics.snapshot()
@@ -1,8 +1,11 @@
-from fastapi import APIRouter, HTTPException, status, Depends
+from fastapi import APIRouter, HTTPException, Request, Response, status, Depends
 from sqlalchemy.orm import Session
 from typing import Optional, List
 from app.crud.patients import patient_crud_service as pat_crud
-from app import schema, database, models, oauth2
+from app import schema, database, oauth2, replica
+from app.etags import ETAG_HEADER, matches, not_modified, resource_etag
+from app.fieldsets import parse_fields
+from app.serializers import json_list_response, patient_list, sparse_json_response
 
 router = APIRouter(
     tags=['Patients']
@@ -10,23 +13,35 @@ router = APIRouter(
 
 #retrieve patients information
 @router.get('/patients', status_code=status.HTTP_200_OK, response_model=List[schema.Patient])
-def get_patients(offset: int = 0, limit: int = 10, search: Optional[str] = "", db: Session = Depends(database.get_db)):
-    patients = pat_crud.get_patients(offset, limit, search, db)
-    return patients
+def get_patients(offset: int = 0, limit: int = 10, search: Optional[str] = "", cursor: Optional[str] = None, fields: Optional[str] = None, db: Session = Depends(replica.get_read_db)):
+    fields = parse_fields(fields, schema.Patient)
+    page = pat_crud.get_patients(offset, limit, search, db, cursor, fields)
+    database.release_connection(db)
+    # X-Next-Cursor: pass it back as ?cursor= for the next page; cheaper than a growing offset and stable under inserts
+    return json_list_response(patient_list, page.items, page.next_cursor, fields)
 
 @router.get('/patients/{id}', status_code=status.HTTP_200_OK, response_model=schema.Patient)
-def get_patient_by_id(id: int, db: Session = Depends(database.get_db)):
-    patient = pat_crud.get_patient_by_id(id, db)
+def get_patient_by_id(id: int, request: Request, response: Response, fields: Optional[str] = None, db: Session = Depends(replica.get_read_db)):
+    fields = parse_fields(fields, schema.Patient)
+    patient = pat_crud.get_patient_by_id(id, db, fields)
+    database.release_connection(db)
     if not patient:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="The patient with id '%s' does not exist" % id
         )
+    etag = resource_etag("patient", patient, fields)
+    if matches(request, etag):
+        return not_modified(etag)
+
+    if fields:
+        return sparse_json_response(patient, fields, {ETAG_HEADER: etag})
+    response.headers[ETAG_HEADER] = etag
     return patient
 
 
 @router.put('/patients/{id}', status_code=status.HTTP_202_ACCEPTED, response_model=schema.Patient)
-def update_patient(id: int, payload: schema.PatientUpdate, db: Session = Depends(database.get_db), current_user: models.Patient = Depends(oauth2.get_current_user)):
+def update_patient(id: int, payload: schema.PatientUpdate, db: Session = Depends(database.get_db), current_user: schema.Principal = Depends(oauth2.get_current_principal)):
     patient = pat_crud.get_patient_by_id(id, db)
     if not patient:
         raise HTTPException(
@@ -35,9 +50,7 @@ def update_patient(id: int, payload: schema.PatientUpdate, db: Session = Depends
         )
     
     # intializing authourization logic
-    user = pat_crud.get_patient_by_id(current_user.id, db)
-
-    if patient.id != int(user.id):
+    if current_user.role != schema.UserRole.PATIENT or patient.id != current_user.id:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="You are not authorized to perform this action."
@@ -49,7 +62,7 @@ def update_patient(id: int, payload: schema.PatientUpdate, db: Session = Depends
 
 
 @router.delete('/patients/{id}', status_code=status.HTTP_202_ACCEPTED)
-def delete_patient(id: int, db: Session = Depends(database.get_db), current_user: models.Patient = Depends(oauth2.get_current_user)):
+def delete_patient(id: int, db: Session = Depends(database.get_db), current_user: schema.Principal = Depends(oauth2.get_current_principal)):
     patient = pat_crud.get_patient_by_id(id, db)
     if not patient:
         raise HTTPException(
@@ -58,8 +71,7 @@ def delete_patient(id: int, db: Session = Depends(database.get_db), current_user
             )
         
     # intializing authourization logic
-    user = pat_crud.get_patient_by_id(current_user.id, db)
-    if patient.id != int(user.id):
+    if current_user.role != schema.UserRole.PATIENT or patient.id != current_user.id:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="You are not authorized to perform this action."
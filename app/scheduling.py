@@ -0,0 +1,127 @@
+import os
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+from zoneinfo import ZoneInfo
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# working hours are wall-clock times here, and so are appointment dates sent without an offset
+CLINIC_TIMEZONE = ZoneInfo(os.getenv('CLINIC_TIMEZONE', 'UTC'))
+MAX_SCHEDULE_DAYS = int(os.getenv('MAX_SCHEDULE_DAYS', 31))
+
+
+class Slot(NamedTuple):
+    start: datetime
+    end: datetime
+    capacity: int
+
+
+def localize(value: datetime) -> datetime:
+    """A client-supplied datetime in UTC; naive values are clinic time."""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=CLINIC_TIMEZONE)
+    return value.astimezone(timezone.utc)
+
+
+def from_db(value: datetime) -> datetime:
+    # SQLite hands back naive datetimes; slot bookings are always stored in UTC
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def day_slots(schedule, day: date) -> Iterator[Slot]:
+    start = datetime.combine(day, schedule.start_time, CLINIC_TIMEZONE)
+    closing = datetime.combine(day, schedule.end_time, CLINIC_TIMEZONE)
+    step = timedelta(minutes=schedule.slot_minutes)
+    while start + step <= closing:
+        yield Slot(start.astimezone(timezone.utc), (start + step).astimezone(timezone.utc), schedule.capacity)
+        start += step
+
+
+def slots_between(schedules: Sequence, start: datetime, end: datetime) -> List[Slot]:
+    """Every slot of `schedules` starting in [start, end)."""
+    slots = []
+    day = start.astimezone(CLINIC_TIMEZONE).date()
+    last = end.astimezone(CLINIC_TIMEZONE).date()
+    while day <= last:
+        for schedule in schedules:
+            if schedule.weekday == day.weekday():
+                slots.extend(slot for slot in day_slots(schedule, day) if start <= slot.start < end)
+        day += timedelta(days=1)
+    return sorted(slots)
+
+
+def slot_for(schedules: Sequence, at: datetime) -> Optional[Slot]:
+    """The slot starting exactly at `at`, if the doctor works then."""
+    day = at.astimezone(CLINIC_TIMEZONE).date()
+    for schedule in schedules:
+        if schedule.weekday == day.weekday():
+            for slot in day_slots(schedule, day):
+                if slot.start == at:
+                    return slot
+    return None
+
+
+def overlapping_hours(schedules: Sequence) -> bool:
+    shifts = sorted((schedule.weekday, schedule.start_time, schedule.end_time) for schedule in schedules)
+    return any(a[0] == b[0] and b[1] < a[2] for a, b in zip(shifts, shifts[1:]))
+
+
+class IntervalTree:
+    """Static centred interval tree over half-open [start, end) intervals.
+
+    Answers "which bookings overlap this range" in O(log n + k); used to count bookings per slot
+    and, on databases without exclusion constraints, to find conflicting bookings.
+    """
+
+    def __init__(self, intervals: Iterable[Tuple[Any, Any, Any]]):
+        intervals = list(intervals)
+        self.size = len(intervals)
+        self._root = self._build(intervals)
+
+    @classmethod
+    def _build(cls, intervals: list):
+        if not intervals:
+            return None
+        points = sorted(point for start, end, _ in intervals for point in (start, end))
+        center = points[len(points) // 2]
+        # the center is an endpoint, so at least one interval stays here and the recursion shrinks
+        here = [interval for interval in intervals if interval[0] <= center <= interval[1]]
+        return (
+            center,
+            sorted(here, key=lambda interval: interval[0]),
+            sorted(here, key=lambda interval: interval[1], reverse=True),
+            cls._build([interval for interval in intervals if interval[1] < center]),
+            cls._build([interval for interval in intervals if interval[0] > center]),
+        )
+
+    def overlapping(self, start, end) -> list:
+        found = []
+        nodes = [self._root]
+        while nodes:
+            node = nodes.pop()
+            if node is None:
+                continue
+            center, by_start, by_end, left, right = node
+            if end <= center:
+                for interval in by_start:
+                    if interval[0] >= end:
+                        break
+                    found.append(interval[2])
+                nodes.append(left)
+            elif start > center:
+                for interval in by_end:
+                    if interval[1] <= start:
+                        break
+                    found.append(interval[2])
+                nodes.append(right)
+            else:
+                found.extend(interval[2] for interval in by_start if interval[0] < end and interval[1] > start)
+                nodes.extend((left, right))
+        return found
+
+    def __len__(self):
+        return self.size
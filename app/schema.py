@@ -1,6 +1,6 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field, model_validator
 from typing import Optional
-from datetime import datetime, date
+from datetime import datetime, date, time
 from enum import Enum
 from typing import List
 
@@ -10,6 +10,14 @@ class AppointmentStatus(str, Enum):
     COMPLETED = "completed"
     CANCELLED = "cancelled"
 
+class UserRole(str, Enum):
+    PATIENT = "patient"
+    DOCTOR = "doctor"
+
+class ExportFormat(str, Enum):
+    NDJSON = "ndjson"
+    CSV = "csv"
+
 class PatientBase(BaseModel):
     title: str = "Mr"
     first_name: str = "John"
@@ -72,6 +80,38 @@ class Doctor(DoctorBase):
     is_available: bool = True
 
 
+# Doctor schedule schema definition
+class DoctorScheduleBase(BaseModel):
+    weekday: int = Field(ge=0, le=6)  # 0 = Monday
+    start_time: time
+    end_time: time
+    slot_minutes: int = Field(30, ge=5, le=480)
+    capacity: int = Field(1, ge=1, le=100)
+
+    @model_validator(mode="after")
+    def check_hours(self):
+        if self.end_time <= self.start_time:
+            raise ValueError("end_time must be after start_time")
+        return self
+
+class DoctorScheduleCreate(DoctorScheduleBase):
+    pass
+
+class DoctorSchedule(DoctorScheduleBase):
+    id: int
+    doctor_id: int
+
+    class Config:
+        from_attributes = True
+
+class ScheduleSlot(BaseModel):
+    start: datetime
+    end: datetime
+    capacity: int
+    booked: int
+    available: int
+
+
 # Appointment schema definition
 class AppointmentBase(BaseModel):
     diagnosis: str
@@ -132,6 +172,30 @@ class EMRResponse(BaseModel):
     appointments: List[Appointment]
 
 
+class Principal(BaseModel):
+    id: int
+    email: str
+    role: UserRole
+    token_version: int = 0
+
+    class Config:
+        frozen = True
+
+
+class Token(BaseModel):
+    access_token: str
+    refresh_token: str
+    token_type: str = "bearer"
+
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
+
+class LogoutRequest(BaseModel):
+    refresh_token: Optional[str] = None
+
+
 class PasswordReset(BaseModel):
     email: EmailStr
     new_password: str
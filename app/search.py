@@ -0,0 +1,92 @@
+import re
+from typing import Optional, Sequence, Tuple
+
+from sqlalchemy import Double, Float, Integer, Select, cast, func, or_, select, text
+from sqlalchemy.orm import Session
+
+from app import models
+from app.fieldsets import load_fields
+from app.pagination import Page, SortKeys, paginate
+
+# card ID prefixes such as MEDFLOW/PAT/24 (all 2024 patients) or MEDFLOW/PAT/24/00
+CARD_ID_PREFIX = re.compile(r"^[A-Z]+/[A-Z]+/\d{2}(/\d*)?$", re.IGNORECASE)
+# trigrams need at least three characters, shorter terms only match name prefixes
+MIN_TRIGRAM_LENGTH = 3
+
+SEARCH_COLUMNS = (models.Patient.first_name, models.Patient.last_name, models.Patient.hospital_card_id)
+
+
+def escape_like(term: str) -> str:
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+# every builder returns the filtered statement and the sort keys app/pagination.py orders and pages by
+SearchQuery = Tuple[Select, SortKeys]
+ID_ORDER = ((models.Patient.id, False),)
+
+
+def card_id_prefix_statement(prefix: str, dialect: str) -> SearchQuery:
+    if dialect == "sqlite":
+        # GLOB is case sensitive, so SQLite can range-scan the unique index on hospital_card_id
+        condition = models.Patient.hospital_card_id.op("GLOB")(prefix + "*")
+    else:
+        # left-anchored LIKE is served by ix_patients_hospital_card_id_pattern
+        condition = models.Patient.hospital_card_id.like(escape_like(prefix) + "%", escape="\\")
+    return select(models.Patient).where(condition), ((models.Patient.hospital_card_id, False), *ID_ORDER)
+
+
+def name_prefix_statement(term: str) -> SearchQuery:
+    pattern = escape_like(term) + "%"
+    return select(models.Patient).where(or_(
+        models.Patient.first_name.ilike(pattern, escape="\\"),
+        models.Patient.last_name.ilike(pattern, escape="\\"),
+    )), ((models.Patient.last_name, False), *ID_ORDER)
+
+
+def trigram_statement(term: str) -> SearchQuery:
+    pattern = "%" + escape_like(term) + "%"
+    # similarity() is a real; as double precision the cursor value round-trips exactly
+    relevance = cast(func.greatest(*(func.similarity(column, term) for column in SEARCH_COLUMNS)), Double)
+    return select(models.Patient).where(or_(
+        *(column.ilike(pattern, escape="\\") for column in SEARCH_COLUMNS),
+        # pg_trgm similarity operator, tolerates typos in last names
+        models.Patient.last_name.op("%")(term),
+    )), ((relevance, True), *ID_ORDER)
+
+
+def fts_statement(term: str) -> SearchQuery:
+    matches = text(
+        "SELECT rowid AS id, rank FROM patients_fts WHERE patients_fts MATCH :query"
+    ).bindparams(query='"%s"' % term.replace('"', '""')).columns(id=Integer, rank=Float).subquery("matches")
+    # bm25 rank: lower is more relevant
+    return select(models.Patient).join(
+        matches, matches.c.id == models.Patient.id), ((matches.c.rank, False), *ID_ORDER)
+
+
+def contains_statement(term: str) -> SearchQuery:
+    pattern = "%" + escape_like(term) + "%"
+    return select(models.Patient).where(
+        or_(*(column.ilike(pattern, escape="\\") for column in SEARCH_COLUMNS))), ID_ORDER
+
+
+def search_statement(term: str, dialect: str) -> SearchQuery:
+    term = term.strip()
+    if not term:
+        return select(models.Patient), ID_ORDER
+    if CARD_ID_PREFIX.match(term):
+        return card_id_prefix_statement(term.upper(), dialect)
+    if len(term) < MIN_TRIGRAM_LENGTH:
+        return name_prefix_statement(term)
+    if dialect == "postgresql":
+        return trigram_statement(term)
+    if dialect == "sqlite":
+        return fts_statement(term)
+    # no index support on other backends
+    return contains_statement(term)
+
+
+def search_patients(db: Session, term: str, offset: int = 0, limit: int = 10, cursor: Optional[str] = None,
+                    fields: Optional[Sequence[str]] = None) -> Page:
+    statement, keys = search_statement(term or "", db.get_bind().dialect.name)
+    statement = statement.options(*load_fields(models.Patient, fields))
+    return paginate(db, statement, keys, limit, cursor, offset)
@@ -0,0 +1,66 @@
+from typing import Any, Callable, List, Optional, Sequence, Type
+
+import orjson
+from fastapi import Response
+from pydantic import BaseModel, TypeAdapter
+
+from app import schema
+from app.pagination import NEXT_CURSOR_HEADER
+
+
+def _row_constructor(model: Type[BaseModel]) -> Callable[[Any], BaseModel]:
+    names = tuple(model.model_fields)
+    nested = {
+        name: _row_constructor(field.annotation)
+        for name, field in model.model_fields.items()
+        if isinstance(field.annotation, type) and issubclass(field.annotation, BaseModel)
+    }
+
+    def construct(row: Any) -> BaseModel:
+        values = {name: getattr(row, name) for name in names}
+        for name, build in nested.items():
+            if values[name] is not None:
+                values[name] = build(values[name])
+        return model.model_construct(**values)
+
+    return construct
+
+
+class ListSerializer:
+    """Dumps ORM rows as a JSON list of `model` without validating them again.
+
+    Rows come from our own tables and were validated on the way in; re-validating them
+    (EmailStr alone is most of the cost) is what FastAPI's response_model path spends its time on.
+    """
+
+    def __init__(self, model: Type[BaseModel]):
+        self.adapter = TypeAdapter(List[model])
+        self._construct = _row_constructor(model)
+
+    def dump_json(self, rows: List[Any]) -> bytes:
+        return self.adapter.dump_json([self._construct(row) for row in rows])
+
+
+# built once at import, the TypeAdapter compiles its serializer up front
+patient_list = ListSerializer(schema.Patient)
+doctor_list = ListSerializer(schema.Doctor)
+appointment_list = ListSerializer(schema.AppointmentResponse)
+
+
+def sparse_dict(row: Any, fields: Sequence[str]) -> dict:
+    return {field: getattr(row, field) for field in fields}
+
+
+def json_list_response(serializer: ListSerializer, rows: List[Any], next_cursor: Optional[str] = None,
+                       fields: Optional[Sequence[str]] = None) -> Response:
+    headers = {NEXT_CURSOR_HEADER: next_cursor} if next_cursor else None
+    if fields:
+        # rows were loaded with load_only(fields), see app/fieldsets.py
+        content = orjson.dumps([sparse_dict(row, fields) for row in rows])
+    else:
+        content = serializer.dump_json(rows)
+    return Response(content=content, media_type="application/json", headers=headers)
+
+
+def sparse_json_response(row: Any, fields: Sequence[str], headers: Optional[dict] = None) -> Response:
+    return Response(content=orjson.dumps(sparse_dict(row, fields)), media_type="application/json", headers=headers)
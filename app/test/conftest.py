@@ -1,22 +1,42 @@
+import os
+import tempfile
+
 import pytest
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.pool import StaticPool
+from sqlalchemy.pool import NullPool
+
+# cheapest bcrypt cost keeps the suite fast; must be set before the app is imported
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+os.environ.setdefault("METRICS_ENABLED", "true")
 
-from app.database import Base, get_db
+from app.cache import principal_cache, shared_cache, token_cache, token_version_cache
+from app.crud.doctors import doctor_directory
+from app.database import Base, get_async_db, get_db, get_session_factory, read_only_async_sessionmaker, read_only_sessionmaker
 from app.main import app
+from app.ratelimit import login_throttle
+from app.replica import replica_router
+from app.revocation import revocation_list
 
-SQLALCHEMY_DATABASE_URL = "sqlite://"
+# a file database so the sync and async (aiosqlite) engines see the same data
+TEST_DATABASE_PATH = os.path.join(tempfile.mkdtemp(), "medflow_test.db")
+SQLALCHEMY_DATABASE_URL = f"sqlite:///{TEST_DATABASE_PATH}"
+ASYNC_SQLALCHEMY_DATABASE_URL = f"sqlite+aiosqlite:///{TEST_DATABASE_PATH}"
 
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL,
     connect_args={"check_same_thread": False},
-    poolclass=StaticPool,
 )
 TestingSessionLocal = sessionmaker(
     autocommit=False, autoflush=False, bind=engine)
 
+# NullPool: each TestClient runs its own event loop, pooled aiosqlite connections must not outlive it
+async_engine = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL, poolclass=NullPool)
+TestingAsyncSessionLocal = async_sessionmaker(
+    async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
 
 Base.metadata.create_all(bind=engine)
 
@@ -29,7 +49,18 @@ def override_get_db():
         db.close()
 
 
+async def override_get_async_db():
+    async with TestingAsyncSessionLocal() as db:
+        yield db
+
+
 app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_async_db] = override_get_async_db
+app.dependency_overrides[get_session_factory] = lambda: TestingSessionLocal
+revocation_list.session_factory = TestingSessionLocal
+replica_router.session_factory = read_only_sessionmaker(engine)
+replica_router.async_session_factory = read_only_async_sessionmaker(async_engine)
+doctor_directory.session_factory = read_only_async_sessionmaker(async_engine)
 
 
 
@@ -39,8 +70,33 @@ def client():
         yield c
 
 
+@pytest.fixture
+def query_log():
+    """SQL statements executed by the app's sync and async test engines while the test runs."""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    targets = (engine, async_engine.sync_engine)
+    for target in targets:
+        event.listen(target, "before_cursor_execute", record)
+    yield statements
+    for target in targets:
+        event.remove(target, "before_cursor_execute", record)
+
+
 @pytest.fixture(scope="module")
 def setup_database():
     Base.metadata.create_all(bind=engine)
     yield
     Base.metadata.drop_all(bind=engine)
+    # ids and emails are reused by the next module, so cached users must not outlive the tables
+    principal_cache.clear()
+    token_version_cache.clear()
+    token_cache.clear()
+    login_throttle.reset()
+    revocation_list.reset()
+    replica_router.reset()
+    doctor_directory.reset()
+    shared_cache.reset()
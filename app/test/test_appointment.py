@@ -1,6 +1,16 @@
-from datetime import datetime
+import json
+import random
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, time
 import pytest
+from fastapi import HTTPException
+from sqlalchemy import func
+
+from app import models, oauth2, schema
+from app.crud import appointment as apt_crud
 from app.schema import AppointmentStatus
+from app.serializers import appointment_list
+from app.test.conftest import TestingSessionLocal
 
 
 @pytest.fixture
@@ -195,6 +205,23 @@ def test_get_appointments(client, setup_database):
     assert all("appointment_date" in appointment for appointment in data)
 
 
+def test_ownership_checks_compare_roles(client, setup_database):
+    # patient 1 and doctor 1 are different users that happen to share an id
+    def login(username):
+        response = client.post("/login", data={"username": username,  "password": "Password1234$"})
+        return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    doctor, patient = login("doctor@email.com"), login("patient@email.com")
+
+    assert client.delete("/patients/1", headers=doctor).status_code == 401
+    assert client.post("/appointments/1/cancel_appointment", headers=doctor).status_code == 401
+    assert client.post("/doctors/1/change_availability", headers=patient).status_code == 401
+    assert client.delete("/doctors/1", headers=patient).status_code == 401
+    response = client.put("/admin/apppointment_status", params={"patient_id": 1, "appointment_id": 1},
+                          json={"status": "in_progress"}, headers=patient)
+    assert response.status_code == 403
+
+
 @pytest.mark.parametrize("email, password, appointment_id, wrong_id", [
     ("patient@email.com", "Password1234$", 1, 99)
 ])
@@ -289,3 +316,215 @@ def test_cancel_appointment(client, setup_database, appointment_id, wrong_id):
         f"/appointments/{appointment_id}/cancel_appointment", headers={"Authorization": f"Bearer {token}"})
 
     assert response.status_code == 202
+
+
+def test_appointment_listings_query_count(client, setup_database, doctor_payload, query_log):
+    # a second doctor and a few more appointments, so lazy loading would show up as extra queries
+    response = client.post(
+        "/signup/doctor", json={**doctor_payload, "email": "doctor2@email.com", "hospital_id": "MEDFLOW/MED/SG/002"})
+    assert response.status_code == 201
+
+    db = TestingSessionLocal()
+    for patient_id, doctor_id in [(1, 1), (1, 2), (2, 2)]:
+        db.add(models.Appointment(diagnosis="Checkup", severity="Mild", patient_id=patient_id,
+                                  doctor_id=doctor_id, status=AppointmentStatus.COMPLETED))
+    db.commit()
+    db.close()
+
+    response = client.post(
+        "/login", data={"username": "patient@email.com",  "password": "Password1234$"})
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    client.get("/appointments/1", headers=headers)
+
+    query_log.clear()
+    response = client.get("/appointments")
+    assert len(response.json()) == 4
+    # one query: appointments joined to their patient and doctor
+    assert len(query_log) == 1
+
+    query_log.clear()
+    response = client.get("/appointments/1", headers=headers)
+    assert len(response.json()) == 3
+    # the patient, then the appointments joined to their patient and doctor
+    assert len(query_log) == 2
+
+
+def test_appointment_list_serializer_matches_response_model(setup_database):
+    db = TestingSessionLocal()
+    # loaded as the route loads them, so the test also runs under ORM_LAZY_LOADING=raise
+    appointments = db.query(models.Appointment).options(*apt_crud.RESPONSE_LOADERS).all()
+
+    expected = [schema.AppointmentResponse.model_validate(appointment, from_attributes=True).model_dump(mode="json")
+                for appointment in appointments]
+    assert json.loads(appointment_list.dump_json(appointments)) == expected
+    db.close()
+
+
+def as_patient(patient_id):
+    return schema.Principal(id=patient_id, email=f"patient{patient_id}@email.com", role=schema.UserRole.PATIENT)
+
+
+def add_load_test_users(doctors, patients, tag="LT"):
+    db = TestingSessionLocal()
+    doctor_ids = []
+    for i in range(doctors):
+        doctor = models.Doctor(
+            title="Dr.", first_name="Load", last_name="Test", phone_number="0800000000", date_of_birth=date(1980, 1, 1),
+            gender="Female", hospital_id=f"MEDFLOW/MED/{tag}/{i:03d}", email=f"{tag.lower()}.doctor{i}@email.com",
+            specialization="Surgeon", address_line1="1, load street", city="Ikeja", state="Lagos", zip_code="23401",
+            country="Nigeria", password="x")
+        db.add(doctor)
+        db.flush()
+        doctor_ids.append(doctor.id)
+    patient_ids = []
+    for i in range(patients):
+        patient = models.Patient(
+            title="Mr", first_name="Load", last_name="Test", phone_number="0900000000", date_of_birth=date(1990, 1, 1),
+            gender="Male", address_line1="1, load street", city="Ikeja", state="Lagos", zip_code="23401",
+            country="Nigeria", hospital_card_id=f"MEDFLOW/PAT/{tag}/{i:03d}", email=f"{tag.lower()}.patient{i}@email.com", password="x")
+        db.add(patient)
+        db.flush()
+        patient_ids.append(patient.id)
+    db.commit()
+    db.close()
+    return doctor_ids, patient_ids
+
+
+def test_concurrent_bookings_never_double_book(setup_database):
+    doctors, patients, threads = 5, 60, 16
+    doctor_ids, patient_ids = add_load_test_users(doctors, patients)
+
+    def book(patient_id):
+        # every patient tries every doctor in a random order until one booking goes through
+        for doctor_id in random.sample(doctor_ids, len(doctor_ids)):
+            payload = schema.AppointmentCreate(doctor_id=doctor_id, diagnosis="Checkup", severity="Mild",
+                                               appointment_date=datetime(2024, 10, 25))
+            session = TestingSessionLocal()
+            try:
+                return apt_crud.book_appointment(payload, patient_id, as_patient(patient_id), session).doctor_id
+            except HTTPException as error:
+                assert error.status_code == 403
+            finally:
+                session.close()
+        return None
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        booked = [doctor_id for doctor_id in pool.map(book, patient_ids) if doctor_id is not None]
+
+    # each doctor went to exactly one patient, everyone else was turned away
+    assert sorted(booked) == sorted(doctor_ids)
+
+    db = TestingSessionLocal()
+    counts = dict(db.query(models.Appointment.doctor_id, func.count()).filter(
+        models.Appointment.doctor_id.in_(doctor_ids)).group_by(models.Appointment.doctor_id).all())
+    assert counts == {doctor_id: 1 for doctor_id in doctor_ids}
+    assert db.query(models.Doctor).filter(models.Doctor.id.in_(doctor_ids), models.Doctor.is_available).count() == 0
+    db.close()
+
+
+
+def test_concurrent_bookings_by_one_patient(setup_database):
+    doctor_ids, (patient_id,) = add_load_test_users(4, 1, tag="PP")
+
+    def book(doctor_id):
+        payload = schema.AppointmentCreate(doctor_id=doctor_id, diagnosis="Checkup", severity="Mild",
+                                           appointment_date=datetime(2024, 10, 25))
+        session = TestingSessionLocal()
+        try:
+            return apt_crud.book_appointment(payload, patient_id, as_patient(patient_id), session).id
+        except HTTPException as error:
+            return error.status_code
+        finally:
+            session.close()
+
+    with ThreadPoolExecutor(max_workers=len(doctor_ids)) as pool:
+        results = list(pool.map(book, doctor_ids))
+
+    # one pending appointment; the losing bookings released the doctors they had claimed
+    assert results.count(403) == len(doctor_ids) - 1
+    db = TestingSessionLocal()
+    assert db.query(models.Appointment).filter(models.Appointment.patient_id == patient_id).count() == 1
+    assert db.query(models.Doctor).filter(models.Doctor.id.in_(doctor_ids), models.Doctor.is_available).count() == len(doctor_ids) - 1
+    db.close()
+
+
+def test_concurrent_slot_bookings_respect_capacity(client, setup_database):
+    # 2024-10-28 is a Monday: one 09:00-09:30 slot with three places
+    patients, threads, capacity = 30, 16, 3
+    (doctor_id,), patient_ids = add_load_test_users(1, patients, tag="ST")
+    db = TestingSessionLocal()
+    db.add(models.DoctorSchedule(doctor_id=doctor_id, weekday=0, start_time=time(9), end_time=time(9, 30),
+                                 slot_minutes=30, capacity=capacity))
+    db.commit()
+    db.close()
+
+    def book(patient_id, at=datetime(2024, 10, 28, 9)):
+        payload = schema.AppointmentCreate(doctor_id=doctor_id, diagnosis="Checkup", severity="Mild", appointment_date=at)
+        session = TestingSessionLocal()
+        try:
+            return apt_crud.book_appointment(payload, patient_id, as_patient(patient_id), session).id
+        except HTTPException as error:
+            return error.status_code
+        finally:
+            session.close()
+
+    def set_available(available):
+        session = TestingSessionLocal()
+        session.get(models.Doctor, doctor_id).is_available = available
+        session.commit()
+        session.close()
+
+    # a time that is not a slot start is rejected
+    assert book(patient_ids[0], datetime(2024, 10, 28, 9, 10)) == 400
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        results = list(pool.map(book, patient_ids))
+
+    assert results.count(409) == patients - capacity
+    db = TestingSessionLocal()
+    booked = db.query(models.Appointment).filter(models.Appointment.doctor_id == doctor_id).all()
+    assert sorted(appointment.seat for appointment in booked) == list(range(capacity))
+    # slot bookings leave the doctor's own availability flag alone
+    assert db.get(models.Doctor, doctor_id).is_available is True
+    db.close()
+
+    response = client.get(f"/doctors/{doctor_id}/schedule", params={"from": "2024-10-28T00:00:00", "to": "2024-10-29T00:00:00"})
+    assert response.json() == [
+        {"start": "2024-10-28T09:00:00Z", "end": "2024-10-28T09:30:00Z", "capacity": 3, "booked": 3, "available": 0}]
+
+    # a doctor who marked themselves unavailable takes no bookings, and a cancellation does not reopen them
+    set_available(False)
+    db = TestingSessionLocal()
+    apt_crud.cancel_appointment(booked[0].id, db)
+    assert db.get(models.Doctor, doctor_id).is_available is False
+    db.close()
+    assert book(patient_ids[-1]) == 403
+
+    set_available(True)
+    assert book(patient_ids[-1]) not in (403, 409)
+
+
+def test_update_slot_booking_keeps_its_slot(client, setup_database):
+    (doctor_id,), (patient_id,) = add_load_test_users(1, 1, tag="SU")
+    db = TestingSessionLocal()
+    db.add(models.DoctorSchedule(doctor_id=doctor_id, weekday=0, start_time=time(9), end_time=time(10),
+                                 slot_minutes=30, capacity=1))
+    db.commit()
+    payload = schema.AppointmentCreate(doctor_id=doctor_id, diagnosis="Checkup", severity="Mild",
+                                       appointment_date=datetime(2024, 10, 28, 9))
+    appointment_id = apt_crud.book_appointment(payload, patient_id, as_patient(patient_id), db).id
+    db.close()
+    principal = schema.Principal(id=patient_id, email="su.patient0@email.com", role=schema.UserRole.PATIENT)
+    headers = {"Authorization": f"Bearer {oauth2.issue_tokens(principal)['access_token']}"}
+
+    update = {"diagnosis": "Fever", "severity": "Severe", "appointment_date": "2024-10-28T09:00:00", "status": "pending"}
+    response = client.put(f"/appointments/{appointment_id}", json=update, headers=headers)
+    assert response.status_code == 202
+    assert response.json()["diagnosis"] == "Fever"
+
+    # moving the date alone would leave ends_at and the seat behind
+    response = client.put(f"/appointments/{appointment_id}", json={**update, "appointment_date": "2024-12-25T03:17:00"}, headers=headers)
+    assert response.status_code == 400
+
+    response = client.get(f"/doctors/{doctor_id}/schedule", params={"from": "2024-10-28T00:00:00", "to": "2024-10-29T00:00:00"})
+    assert [slot["booked"] for slot in response.json()] == [1, 0]
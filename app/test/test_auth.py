@@ -1,5 +1,13 @@
 import pytest
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+from jose import jwt
+
+from app import models, oauth2
+from app.hashing import BCRYPT_ROUNDS, build_context
+from app.cache import InMemoryCacheBackend, RedisCacheBackend
+from app.revocation import RevocationList, revocation_list
+from app.ratelimit import InMemoryRateLimitBackend, RateLimitBackend, RedisRateLimitBackend, login_throttle, rate_limit_backend
+from app.test.conftest import TestingSessionLocal
 
 
 @pytest.fixture
@@ -128,15 +136,44 @@ def test_login(client, setup_database, email, password, wrong_email, wrong_passw
     assert data == {"detail": "Incorrect username or password"}
 
 
+@pytest.mark.parametrize("credential, wrong_credential", [
+    ("MEDFLOW/PAT/24/001", "MEDFLOW/PAT/24/999"),
+    ("MEDFLOW/MED/SG/001", "MEDFLOW/MED/SG/999"),
+])
+def test_login_with_hospital_id(client, setup_database, credential, wrong_credential):
+    response = client.post(
+        "/login", data={"username": credential,  "password": "Password1234$"})
+
+    assert response.status_code == 200
+    assert "access_token" in response.json()
+
+    response = client.post(
+        "/login", data={"username": wrong_credential,  "password": "Password1234$"})
+
+    assert response.status_code == 401
+
+
 def test_password_reset(client, setup_database, password_reset_payload):
     response = client.post(
         "/auth/password_reset", json=password_reset_payload)
     
     assert response.status_code == 401
     
-    # Login to authenticate
+    # the doctor shares the patient's id but is a different user
     response = client.post(
         "/login", data={"username": "doctor@email.com",  "password": "Password1234$"})
+    token = response.json()["access_token"]
+
+    response = client.post(
+        "/auth/password_reset", json=password_reset_payload,
+        headers={"Authorization": f"Bearer {token}"})
+
+    assert response.status_code == 400
+    assert response.json() == {"detail": "You are not allowed to perform this action!"}
+
+    # Login to authenticate
+    response = client.post(
+        "/login", data={"username": "patient@email.com",  "password": "Password1234$"})
 
     assert response.status_code == 200
     token = response.json()["access_token"]
@@ -149,3 +186,247 @@ def test_password_reset(client, setup_database, password_reset_payload):
     data = response.json()
     assert data == {"details": "Password has been changed successfully!"}
 
+
+
+def test_stateless_token_revoked_by_password_reset(client, setup_database, monkeypatch):
+    monkeypatch.setattr(oauth2, "STATELESS_TOKENS", True)
+
+    response = client.post(
+        "/login", data={"username": "patient@email.com",  "password": "NewPassword1234$"})
+
+    assert response.status_code == 200
+    token = response.json()["access_token"]
+
+    claims = jwt.get_unverified_claims(token)
+    assert claims["sub"] == "patient@email.com"
+    assert claims["uid"] == 1
+    assert claims["role"] == "patient"
+    assert claims["ver"] == 1
+
+    response = client.get(
+        "/appointments/1", headers={"Authorization": f"Bearer {token}"})
+
+    assert response.status_code == 200
+
+    response = client.post(
+        "/auth/password_reset", json={
+            "email": "patient@email.com",
+            "new_password": "OtherPassword1234$",
+            "confirm_password": "OtherPassword1234$"
+        },
+        headers={"Authorization": f"Bearer {token}"})
+
+    assert response.status_code == 202
+
+    # the reset bumped the patient's token version, so the old token is rejected
+    response = client.get(
+        "/appointments/1", headers={"Authorization": f"Bearer {token}"})
+
+    assert response.status_code == 401
+
+
+def test_password_hasher_metrics(client, setup_database):
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    data = response.json()["password_hasher"]
+    assert data["completed"] > 0
+    assert data["in_flight"] == 0
+    assert data["queue_depth"] == 0
+
+
+def test_outdated_hash_is_upgraded_on_login(client, setup_database):
+    db = TestingSessionLocal()
+    doctor = db.query(models.Doctor).filter(models.Doctor.email == "doctor@email.com").first()
+    doctor.password = build_context(BCRYPT_ROUNDS + 1).hash("Password1234$")
+    db.commit()
+
+    response = client.post(
+        "/login", data={"username": "doctor@email.com",  "password": "Password1234$"})
+
+    assert response.status_code == 200
+
+    db.refresh(doctor)
+    assert doctor.password.startswith("$2b$%02d$" % BCRYPT_ROUNDS)
+    db.close()
+
+
+@pytest.fixture
+def tight_login_throttle(monkeypatch):
+    monkeypatch.setattr(login_throttle, "credential_burst", 2)
+    login_throttle.backend.reset()
+    yield
+    login_throttle.backend.reset()
+
+
+def test_login_throttled_per_credential(client, setup_database, tight_login_throttle):
+    for _ in range(2):
+        response = client.post(
+            "/login", data={"username": "doctor@email.com",  "password": "wrong_password"})
+        assert response.status_code == 401
+
+    # even the right password is refused once the bucket is empty
+    response = client.post(
+        "/login", data={"username": "doctor@email.com",  "password": "Password1234$"})
+
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+
+    # other accounts are unaffected
+    response = client.post(
+        "/login", data={"username": "patient@email.com",  "password": "OtherPassword1234$"})
+
+    assert response.status_code == 200
+
+
+def test_rate_limit_backend_missing_a_method_cannot_be_created():
+    class NoReset(RateLimitBackend):
+        def take(self, key, capacity, refill_per_second):
+            return 0.0
+
+    with pytest.raises(TypeError):
+        NoReset()
+
+
+def test_rate_limit_backend_follows_cache_url():
+    assert isinstance(rate_limit_backend(InMemoryCacheBackend()), InMemoryRateLimitBackend)
+
+    cache = RedisCacheBackend("redis://127.0.0.1:1/0")
+    backend = rate_limit_backend(cache)
+    assert isinstance(backend, RedisRateLimitBackend)
+
+    # an unreachable server lets logins through rather than locking everyone out
+    assert backend.take("login:ip:testclient", 1, 1) == 0
+    assert backend.failures == 1
+    cache.close()
+
+
+def test_verified_token_cache(client, setup_database, monkeypatch):
+    response = client.post(
+        "/login", data={"username": "patient@email.com",  "password": "OtherPassword1234$"})
+
+    assert response.status_code == 200
+    token = response.json()["access_token"]
+
+    for _ in range(3):
+        response = client.get(
+            "/appointments/1", headers={"Authorization": f"Bearer {token}"})
+        assert response.status_code == 200
+
+    data = client.get("/metrics").json()["token_cache"]
+    assert data["hits"] >= 2
+    assert data["hit_ratio"] > 0
+
+    # revocation hooks still apply to tokens served from the cache
+    monkeypatch.setattr(oauth2, "revocation_hooks", [lambda claims: claims["sub"] == "patient@email.com"])
+
+    response = client.get(
+        "/appointments/1", headers={"Authorization": f"Bearer {token}"})
+
+    assert response.status_code == 401
+
+
+def test_refresh_and_logout(client, setup_database):
+    response = client.post(
+        "/login", data={"username": "patient@email.com",  "password": "OtherPassword1234$"})
+
+    assert response.status_code == 200
+    data = response.json()
+    access_token, refresh_token = data["access_token"], data["refresh_token"]
+
+    # a refresh token is not accepted as a bearer token
+    response = client.get(
+        "/appointments/1", headers={"Authorization": f"Bearer {refresh_token}"})
+    assert response.status_code == 401
+
+    response = client.post("/token/refresh", json={"refresh_token": refresh_token})
+
+    assert response.status_code == 200
+    data = response.json()
+    new_access_token, new_refresh_token = data["access_token"], data["refresh_token"]
+
+    response = client.get(
+        "/appointments/1", headers={"Authorization": f"Bearer {new_access_token}"})
+    assert response.status_code == 200
+
+    # refresh tokens are rotated, the old one cannot be reused
+    response = client.post("/token/refresh", json={"refresh_token": refresh_token})
+    assert response.status_code == 401
+
+    response = client.post(
+        "/logout", json={"refresh_token": new_refresh_token},
+        headers={"Authorization": f"Bearer {new_access_token}"})
+    assert response.status_code == 200
+
+    response = client.get(
+        "/appointments/1", headers={"Authorization": f"Bearer {new_access_token}"})
+    assert response.status_code == 401
+
+    response = client.post("/token/refresh", json={"refresh_token": new_refresh_token})
+    assert response.status_code == 401
+
+    # tokens that were never revoked still pass the filter
+    response = client.get(
+        "/appointments/1", headers={"Authorization": f"Bearer {access_token}"})
+    assert response.status_code == 200
+
+
+def test_access_tokens_are_short_lived():
+    token = oauth2.create_access_token({"sub": "patient@email.com"}, expires_delta=timedelta(days=30))
+    claims = jwt.decode(token, oauth2.SECRET_KEY, algorithms=[oauth2.ALGORITHM])
+
+    assert claims["exp"] - datetime.now(timezone.utc).timestamp() <= oauth2.ACCESS_TOKEN_MAX_MINUTES * 60
+
+
+def test_refresh_token_claimed_once(client, setup_database, monkeypatch):
+    response = client.post(
+        "/login", data={"username": "patient@email.com",  "password": "OtherPassword1234$"})
+    refresh_token = response.json()["refresh_token"]
+
+    # two concurrent refreshes both pass the revocation check before either revokes
+    monkeypatch.setattr(oauth2.revocation_list, "is_revoked", lambda jti: False)
+    responses = [client.post("/token/refresh", json={"refresh_token": refresh_token}) for _ in range(2)]
+
+    assert [response.status_code for response in responses] == [200, 401]
+
+
+def test_purge_expired_revocations(setup_database):
+    now = datetime.now(timezone.utc)
+    db = TestingSessionLocal()
+    db.add_all([
+        models.RevokedToken(jti="expired-jti", expires_at=now - timedelta(minutes=1)),
+        models.RevokedToken(jti="live-jti", expires_at=now + timedelta(minutes=1)),
+    ])
+    db.commit()
+
+    assert revocation_list.purge_expired() >= 1
+    jtis = {jti for (jti,) in db.query(models.RevokedToken.jti)}
+    assert "expired-jti" not in jtis and "live-jti" in jtis
+    db.close()
+
+
+def test_revocation_refresh_merges_into_filter(setup_database):
+    revocations = RevocationList(session_factory=TestingSessionLocal, capacity=2)
+    db = TestingSessionLocal()
+    db.add(models.RevokedToken(jti="other-worker-jti", expires_at=datetime.now(timezone.utc) + timedelta(minutes=1)))
+    db.commit()
+    db.close()
+
+    # checks never reload the table, the background refresh merges new rows in
+    assert not revocations.is_revoked("other-worker-jti")
+    revocations.refresh()
+    assert revocations.is_revoked("other-worker-jti")
+
+    # past its capacity the filter is rebuilt, keeping what was revoked while the table was read
+    for i in range(3):
+        revocations.add(f"expired-jti-{i}")
+
+    def session_factory():
+        revocations.add("concurrent-jti")
+        return TestingSessionLocal()
+
+    revocations.session_factory = session_factory
+    revocations.refresh()
+    assert revocations.rebuilds == 1
+    assert "concurrent-jti" in revocations._filter and "other-worker-jti" in revocations._filter
+    assert "expired-jti-0" not in revocations._filter
@@ -1,6 +1,15 @@
+import asyncio
+import threading
 from datetime import datetime
 import pytest
 
+from sqlalchemy import update
+
+from app import models, schema
+from app.cache import CacheBackend, InMemoryCacheBackend, SharedCache, off_loop, principal_cache, shared_cache, token_version_cache
+from app.crud.doctors import doctor_directory
+from app.test.conftest import TestingSessionLocal
+
 
 @pytest.fixture
 def doctor_payload():
@@ -146,6 +155,266 @@ def test_get_doctor_by_specialization(client, setup_database):
     
 
 
+@pytest.mark.parametrize("path, expected", [
+    ("/doctors", [{"id": 1, "specialization": "Surgeon"}, {"id": 2, "specialization": "Gynecologist"}]),
+    ("/doctors/specialization?specialization=Surgeon", [{"id": 1, "specialization": "Surgeon"}]),
+    ("/doctors/1", {"id": 1, "specialization": "Surgeon"}),
+])
+def test_doctors_sparse_fieldsets(client, setup_database, query_log, path, expected):
+    response = client.get(path, params={"fields": "specialization"})
+
+    assert response.status_code == 200
+    assert response.json() == expected
+    assert all("email" not in statement for statement in query_log)
+
+    response = client.get(path, params={"fields": "specialization,password"})
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("path", ["/doctors", "/doctors/specialization?specialization=Surgeon", "/doctors/1"])
+def test_doctors_conditional_get(client, setup_database, path):
+    response = client.get(path)
+
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+
+    response = client.get(path, headers={"If-None-Match": etag})
+
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert response.content == b""
+
+    response = client.get(path, headers={"If-None-Match": f'"stale", W/{etag}'})
+    assert response.status_code == 304
+
+    # a different representation of the same rows gets its own validator
+    response = client.get(path, params={"fields": "email"}, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+def test_doctor_update_changes_etags(client, setup_database):
+    etags = {path: client.get(path).headers["ETag"] for path in ["/doctors", "/doctors/1", "/doctors/2"]}
+
+    db = TestingSessionLocal()
+    doctor = db.get(models.Doctor, 2)
+    doctor.phone_number = "0807654321"
+    db.commit()
+    assert doctor.version == 2
+    db.close()
+
+    statuses = {path: client.get(path, headers={"If-None-Match": etag}).status_code for path, etag in etags.items()}
+    assert statuses == {"/doctors": 200, "/doctors/1": 304, "/doctors/2": 200}
+
+
+def test_doctor_directory_served_from_memory(client, setup_database, query_log):
+    client.get("/doctors")
+
+    query_log.clear()
+    for path in ["/doctors", "/doctors/specialization?specialization=Surgeon", "/doctors/1"]:
+        assert client.get(path).status_code == 200
+    response = client.get("/doctors", params={"limit": 1})
+    assert [doctor["id"] for doctor in response.json()] == [1]
+    response = client.get("/doctors", params={"limit": 1, "cursor": response.headers["X-Next-Cursor"]})
+    assert [doctor["id"] for doctor in response.json()] == [2]
+    assert query_log == []
+
+    # a committed doctor write drops the snapshot, the next read sees it
+    response = client.post(
+        "/login", data={"username": "doctor@email.com",  "password": "Password1234$"})
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    for expected in (False, True):
+        response = client.post("/doctors/1/change_availability", headers=headers)
+        assert response.status_code == 200
+        assert client.get("/doctors/1").json()["is_available"] is expected
+
+    data = client.get("/metrics").json()["doctor_directory"]
+    assert data["doctors"] == 2
+    assert data["hits"] >= 5
+    assert data["invalidations"] >= 2
+
+
+def test_doctor_directory_patches_changed_rows(client, setup_database, query_log):
+    client.get("/doctors")
+    loads = doctor_directory.loads
+
+    db = TestingSessionLocal()
+    doctor = db.get(models.Doctor, 2)
+    doctor.city = "Lekki"
+    db.commit()
+    db.close()
+
+    query_log.clear()
+    response = client.get("/doctors")
+
+    # only the written row is reloaded, not the table
+    assert [doctor["city"] for doctor in response.json()] == ["Victoria Island", "Lekki"]
+    assert doctor_directory.loads == loads
+    assert len(query_log) == 1 and "WHERE doctors.id IN" in query_log[0]
+
+    # a bulk statement without changed_ids still drops the whole snapshot
+    db = TestingSessionLocal()
+    db.execute(update(models.Doctor).where(models.Doctor.id == 2).values(city="Victoria Island"))
+    db.commit()
+    db.close()
+    assert client.get("/doctors/2").json()["city"] == "Victoria Island"
+    assert doctor_directory.loads == loads + 1
+
+
+@pytest.fixture
+def other_worker(client):
+    # a second worker's cache client on the same backend; the module's client shutdown unsubscribes it
+    worker = SharedCache(shared_cache.backend)
+    worker.received_messages = []
+    for namespace in ("doctors", "principals"):
+        worker.subscribe(namespace, lambda keys, namespace=namespace: worker.received_messages.append((namespace, keys)))
+    worker.start()
+    return worker
+
+
+def test_doctor_writes_broadcast_to_other_workers(client, setup_database, other_worker):
+    key = shared_cache.versioned_key("doctors", "directory")
+
+    response = client.post(
+        "/login", data={"username": "doctor@email.com",  "password": "Password1234$"})
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    for _ in range(2):
+        assert client.post("/doctors/1/change_availability", headers=headers).status_code == 200
+
+    assert other_worker.received_messages.count(("doctors", [1])) == 2
+    # values cached under the old version are retired
+    assert shared_cache.versioned_key("doctors", "directory") != key
+
+    # and the other worker's writes reach this one
+    client.get("/doctors")
+    invalidations = doctor_directory.invalidations
+    other_worker.invalidate("doctors", 2)
+    assert doctor_directory.invalidations == invalidations + 1
+
+    token_version_cache.set((schema.UserRole.DOCTOR, 2), 0)
+    other_worker.broadcast("token_versions", [(schema.UserRole.DOCTOR, 2)])
+    assert token_version_cache.get((schema.UserRole.DOCTOR, 2)) is None
+
+    principal_cache.invalidate("doctor2@email.com")
+    assert other_worker.received_messages[-1] == ("principals", ["doctor2@email.com"])
+
+
+def test_cache_backend_missing_a_method_cannot_be_created():
+    class GetOnly(CacheBackend):
+        def get(self, key):
+            return None
+
+    with pytest.raises(TypeError):
+        GetOnly()
+
+
+def test_blocking_cache_backend_stays_off_the_event_loop():
+    class SlowBackend(InMemoryCacheBackend):
+        blocking = True
+
+        def __init__(self):
+            super().__init__()
+            self.release = threading.Event()
+            self.threads = set()
+
+        def incr(self, key):
+            self.threads.add(threading.get_ident())
+            self.release.wait(5)
+            return super().incr(key)
+
+    backend = SlowBackend()
+    cache = SharedCache(backend, prefix="slow:")
+    dropped = []
+    cache.subscribe("doctors", dropped.append)
+
+    cache.invalidate("doctors", 1)
+    # local handlers do not wait for the server, and nothing is shared until the bump lands
+    assert dropped == [[1]]
+    assert cache.versioned_key("doctors", "directory") is None
+
+    backend.release.set()
+    cache.close()
+    assert backend.threads and threading.get_ident() not in backend.threads
+    assert cache.published == 1
+    assert cache.versioned_key("doctors", "directory") == "slow:doctors:1:directory"
+    assert asyncio.run(off_loop(backend, threading.get_ident)) != threading.get_ident()
+
+
+def test_doctor_directory_shared_between_workers(client, setup_database, query_log):
+    # full loads store the directory in the shared cache (patched snapshots stay local)
+    doctor_directory.invalidate()
+    client.get("/doctors")
+
+    # another worker (an empty local snapshot) takes the directory from the shared cache
+    doctor_directory.invalidate()
+    query_log.clear()
+    response = client.get("/doctors")
+
+    assert [doctor["id"] for doctor in response.json()] == [1, 2]
+    assert query_log == []
+    assert client.get("/metrics").json()["shared_cache"]["hits"] >= 1
+
+
+def test_concurrent_doctor_updates_both_apply(setup_database):
+    first, second = TestingSessionLocal(), TestingSessionLocal()
+    doctor, same_doctor = first.get(models.Doctor, 2), second.get(models.Doctor, 2)
+    version = doctor.version
+
+    doctor.is_available = not doctor.is_available
+    first.commit()
+    # loaded before the first commit; still no conflict, the version is bumped again
+    same_doctor.city = "Ikeja"
+    second.commit()
+
+    assert same_doctor.version == version + 2
+    first.close()
+    second.close()
+
+
+@pytest.fixture
+def schedule_payload():
+    # Mondays, two 30 minute slots with two places each
+    return [{"weekday": 0, "start_time": "09:00:00", "end_time": "10:00:00", "slot_minutes": 30, "capacity": 2}]
+
+
+def test_doctor_schedule(client, setup_database, schedule_payload):
+    response = client.post(
+        "/login/", data={"username": "doctor@email.com",  "password": "Password1234$"})
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    response = client.put("/doctors/1/schedule", json=schedule_payload)
+    assert response.status_code == 401
+    response = client.put("/doctors/2/schedule", json=schedule_payload, headers=headers)
+    assert response.status_code == 401
+    assert response.json() == {"detail": "Not authorized to make changes"}
+
+    overlapping = schedule_payload + [{"weekday": 0, "start_time": "09:30:00", "end_time": "11:00:00"}]
+    response = client.put("/doctors/1/schedule", json=overlapping, headers=headers)
+    assert response.status_code == 400
+
+    response = client.put("/doctors/1/schedule", json=schedule_payload, headers=headers)
+    assert response.status_code == 200
+    assert [{key: item[key] for key in schedule_payload[0]} for item in response.json()] == schedule_payload
+
+    # 2024-10-28 is a Monday, the Tuesday after it has no working hours
+    response = client.get("/doctors/1/schedule", params={"from": "2024-10-28T00:00:00", "to": "2024-10-30T00:00:00"})
+    assert response.status_code == 200
+    assert response.json() == [
+        {"start": "2024-10-28T09:00:00Z", "end": "2024-10-28T09:30:00Z", "capacity": 2, "booked": 0, "available": 2},
+        {"start": "2024-10-28T09:30:00Z", "end": "2024-10-28T10:00:00Z", "capacity": 2, "booked": 0, "available": 2},
+    ]
+
+    response = client.get("/doctors/99/schedule", params={"from": "2024-10-28T00:00:00", "to": "2024-10-29T00:00:00"})
+    assert response.status_code == 404
+    response = client.get("/doctors/1/schedule", params={"from": "2024-10-28T00:00:00", "to": "2025-10-28T00:00:00"})
+    assert response.status_code == 400
+
+    # an empty schedule puts the doctor back on the availability flag
+    response = client.put("/doctors/1/schedule", json=[], headers=headers)
+    assert response.status_code == 200
+    assert response.json() == []
+
+
 @pytest.mark.parametrize("email, password, doctor_id, wrong_id, another_doctor_id", [
     ("doctor@email.com", "Password1234$", 1, 99, 2)
 ])
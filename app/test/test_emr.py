@@ -1,6 +1,9 @@
 from datetime import datetime
 import pytest
 
+from sqlalchemy.dialects import postgresql
+
+from app.crud.emr import emr_json_statement
 from app.schema import AppointmentStatus
 
 
@@ -167,6 +170,42 @@ def test_get_emr(client, setup_database, patient_id, wrong_id, appointment_paylo
     
 
 
+def test_get_emr_query_count(client, setup_database, emr_payload, query_log):
+    response = client.post(
+        "/login", data={"username": "doctor@email.com",  "password": "Password1234$"})
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    # a second record, the query count must not grow with the number of records
+    response = client.post("/emr/1", json=emr_payload, headers=headers)
+    assert response.status_code == 201
+
+    query_log.clear()
+    response = client.get("/emr/patient_records/1", headers=headers)
+
+    assert response.status_code == 200
+    assert len(response.json()) == 2
+    # patient, doctor validation, records, then all of their appointments at once
+    assert len(query_log) == 4
+
+
+def test_emr_requires_doctor_role(client, setup_database, emr_payload):
+    # patient 1 shares its id with doctor 1, who has an appointment with patient 1
+    response = client.post(
+        "/login", data={"username": "patient@email.com",  "password": "Password1234$"})
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    assert client.post("/emr/1", json=emr_payload, headers=headers).status_code == 401
+    assert client.get("/emr/patient_records/1", headers=headers).status_code == 401
+    assert client.delete("/emr/1/?patient_id=1", headers=headers).status_code == 403
+
+
+def test_emr_json_statement():
+    sql = str(emr_json_statement(1).compile(dialect=postgresql.dialect()))
+
+    assert sql.count("json_agg") == 2
+    assert "json_build_object('id'" in sql
+
+
 @pytest.mark.parametrize("emr_id, wrong_id", [(1, 99)])
 def test_delete_emr(client, setup_database, emr_id, wrong_id):
     # Login doctor to authenticate
@@ -0,0 +1,128 @@
+import csv
+import io
+import json
+from datetime import date, datetime, timedelta
+
+import pytest
+
+
+@pytest.fixture
+def doctor_payload():
+    return {
+        "title": "Dr.",
+        "first_name": "Henry",
+        "last_name": "Ojeh",
+        "email": "doctor@email.com",
+        "phone_number": "0801234567",
+        "date_of_birth": datetime(1987, 4, 25).date().isoformat(),
+        "gender": "Male",
+        "age": 33,
+        "specialization": "Surgeon",
+        "address_line1": "15, doctor house",
+        "address_line2": "20, doctor avenue",
+        "city": "Victoria Island",
+        "state": "Lagos",
+        "zip_code": "23401",
+        "country": "Nigeria",
+        "hospital_id": "MEDFLOW/MED/SG/001",
+        "password": "Password1234$"
+    }
+
+
+@pytest.fixture
+def patient_payload():
+    return {
+        "title": "Mr",
+        "first_name":  "John",
+        "last_name": "Doe",
+        "email": "patient@email.com",
+        "phone_number": "0901111111",
+        "date_of_birth": datetime(1990, 4, 25).date().isoformat(),
+        "gender": "Male",
+        "age": 49,
+        "address_line1": "60, ikeja street 1",
+        "address_line2": "60, ikeja street",
+        "city": "Ikeja",
+        "state":  "Lagos",
+        "zip_code": "23401",
+        "country": "Nigeria",
+        "hospital_card_id": "MEDFLOW/PAT/24/001",
+        "password": "Password1234$"
+    }
+
+
+@pytest.fixture
+def appointment_payload():
+    return {
+        "doctor_id": 1,
+        "diagnosis": "Malaria",
+        "severity": "Mild",
+        "appointment_date": datetime(2024, 10, 25).date().isoformat()
+    }
+
+
+def login(client, username):
+    response = client.post("/login", data={"username": username,  "password": "Password1234$"})
+    assert response.status_code == 200
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def test_export_requires_doctor(client, setup_database, doctor_payload, patient_payload, appointment_payload):
+    assert client.post("/signup/doctor", json=doctor_payload).status_code == 201
+    assert client.post("/signup/patient", json=patient_payload).status_code == 201
+    assert client.post("/signup/patient", json={
+        **patient_payload, "email": "patient2@email.com", "hospital_card_id": "MEDFLOW/PAT/24/002"}).status_code == 201
+
+    headers = login(client, "patient@email.com")
+    response = client.post("/appointments/1", json=appointment_payload, headers=headers)
+    assert response.status_code == 201
+
+    response = client.get("/exports/patients")
+    assert response.status_code == 401
+
+    response = client.get("/exports/patients", headers=headers)
+    assert response.status_code == 403
+
+
+def test_export_patients(client, setup_database):
+    headers = login(client, "doctor@email.com")
+
+    response = client.get("/exports/patients", headers=headers)
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row["email"] for row in rows] == ["patient@email.com", "patient2@email.com"]
+    assert "password" not in rows[0]
+
+    response = client.get("/exports/patients", params={"format": "csv"}, headers=headers)
+
+    assert response.status_code == 200
+    assert response.headers["content-disposition"] == 'attachment; filename="patients.csv"'
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert [row["hospital_card_id"] for row in rows] == ["MEDFLOW/PAT/24/001", "MEDFLOW/PAT/24/002"]
+
+    # registration date range
+    yesterday = (date.today() - timedelta(days=1)).isoformat()
+    response = client.get("/exports/patients", params={"end": yesterday}, headers=headers)
+    assert response.text == ""
+
+
+@pytest.mark.parametrize("start, end, expected", [
+    ("2024-10-01", "2024-10-31", 1),
+    ("2024-10-25", "2024-10-25", 1),
+    ("2024-10-26", None, 0),
+    (None, "2024-10-24", 0),
+])
+def test_export_appointments_by_date_range(client, setup_database, start, end, expected):
+    headers = login(client, "doctor@email.com")
+    params = {key: value for key, value in {"start": start, "end": end, "format": "csv"}.items() if value}
+
+    response = client.get("/exports/appointments", params=params, headers=headers)
+
+    assert response.status_code == 200
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert len(rows) == expected
+    if rows:
+        assert rows[0]["status"] == "pending"
+        assert rows[0]["diagnosis"] == "Malaria"
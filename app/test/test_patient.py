@@ -1,5 +1,11 @@
 from datetime import datetime
 import pytest
+from pydantic import ValidationError
+
+from app import oauth2, schema
+from app.cache import principal_cache
+from app.routers import metrics as metrics_router
+from app.test.conftest import TestingSessionLocal
 
 
 @pytest.fixture
@@ -106,6 +112,61 @@ def test_get_patients(client, setup_database, patient_payload, patient_payload2)
     assert all("phone_number" in patient for patient in data)
 
 
+@pytest.mark.parametrize("search, expected", [
+    ("MEDFLOW/PAT/24", ["patient@email.com", "patient2@email.com"]),
+    ("medflow/pat/24/002", ["patient2@email.com"]),
+    ("MEDFLOW/PAT/23", []),
+    ("jane", ["patient2@email.com"]),
+    ("oe", []),
+    ("Do", ["patient@email.com", "patient2@email.com"]),
+    ("PAT/24/00", ["patient@email.com", "patient2@email.com"]),
+])
+def test_search_patients(client, setup_database, search, expected):
+    response = client.get("/patients", params={"search": search})
+
+    assert response.status_code == 200
+    assert [patient["email"] for patient in response.json()] == expected
+
+
+@pytest.mark.parametrize("search", ["", "MEDFLOW/PAT/24", "doe"])
+def test_patients_cursor_pagination(client, setup_database, search):
+    response = client.get("/patients", params={"search": search, "limit": 1})
+
+    assert response.status_code == 200
+    assert [patient["email"] for patient in response.json()] == ["patient@email.com"]
+    cursor = response.headers["X-Next-Cursor"]
+
+    response = client.get("/patients", params={"search": search, "limit": 1, "cursor": cursor})
+
+    assert [patient["email"] for patient in response.json()] == ["patient2@email.com"]
+    assert "X-Next-Cursor" not in response.headers
+
+    response = client.get("/patients", params={"search": search, "cursor": "not-a-cursor"})
+    assert response.status_code == 400
+
+
+def test_patients_sparse_fieldsets(client, setup_database, query_log):
+    response = client.get("/patients", params={"fields": "first_name,email"})
+
+    assert response.status_code == 200
+    assert response.json() == [
+        {"id": 1, "first_name": "John", "email": "patient@email.com"},
+        {"id": 2, "first_name": "Jane", "email": "patient2@email.com"},
+    ]
+    # the projection reaches the SELECT, unrequested columns are never read
+    assert all("phone_number" not in statement for statement in query_log)
+
+    response = client.get("/patients/2", params={"fields": "last_name"})
+
+    assert response.status_code == 200
+    assert response.json() == {"id": 2, "last_name": "Doe"}
+
+    response = client.get("/patients", params={"fields": "first_name,password"})
+
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Unknown field(s): password"}
+
+
 @pytest.mark.parametrize("patient_id, wrong_id", [(1, 99)])
 def test_get_patient_by_id(client, setup_database, patient_id, wrong_id):
     # Assert for invalid id
@@ -122,6 +183,19 @@ def test_get_patient_by_id(client, setup_database, patient_id, wrong_id):
     assert data["last_name"] == "Doe"
 
 
+def test_patient_conditional_get(client, setup_database):
+    response = client.get("/patients/1")
+
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+
+    response = client.get("/patients/1", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+    response = client.get("/patients/2", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+
+
 @pytest.mark.parametrize("email, password, patient_id, wrong_id, another_patient_id", [
     ("patient@email.com", "Password1234$", 1, 99, 2)
 ])
@@ -154,6 +228,16 @@ def test_update_patient(client, setup_database, email, password, patient_id, wro
     assert data["first_name"] == patient_update_payload["first_name"]
     assert data["last_name"] == patient_update_payload["last_name"]
 
+    # the update bumped the row version, so the ETag served before it no longer matches
+    response = client.get(f"/patients/{patient_id}")
+    etag = response.headers["ETag"]
+    response = client.put(f"/patients/{patient_id}", json={**patient_update_payload, "first_name": "Jo"},
+                          headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 202
+    response = client.get(f"/patients/{patient_id}", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json()["first_name"] == "Jo"
+
     # Test to see if an authenticated user can edit another_user (should throw a 401 because not authorized to do so)
     response = client.put(f"/patients/{another_patient_id}", json=patient_update_payload,
                           headers={"Authorization": f"Bearer {token}"})
@@ -200,3 +284,40 @@ def test_delete_patient(client, setup_database, email, password, patient_id, wro
     assert response.status_code == 202
     data = response.json()
     assert data == {"message": "Account deleted successfully!"}
+
+    # The deleted account's token must stop resolving once the cached user is invalidated
+    response = client.delete(
+        f"/patients/{patient_id}", headers={"Authorization": f"Bearer {token}"})
+
+    assert response.status_code == 401
+    data = response.json()
+    assert data == {"detail": "Could not validate credentials"}
+
+
+def test_principal_cache_metrics(client, setup_database):
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    data = response.json()["principal_cache"]
+    assert data["hits"] > 0
+    assert data["misses"] > 0
+
+
+def test_metrics_disabled_by_default(client, setup_database, monkeypatch):
+    monkeypatch.setattr(metrics_router, "METRICS_ENABLED", False)
+    response = client.get("/metrics")
+
+    assert response.status_code == 404
+
+
+def test_principal_cache_holds_frozen_snapshot(setup_database):
+    principal_cache.clear()
+    db = TestingSessionLocal()
+    principal = oauth2.load_user(db, "patient2@email.com")
+    db.close()
+
+    # shared by every request: a plain immutable value rather than a detached ORM row
+    assert isinstance(principal, schema.Principal)
+    assert principal_cache.get("patient2@email.com") is principal
+    with pytest.raises(ValidationError):
+        principal.id = 99
@@ -1,14 +1,12 @@
 import re
+from sqlalchemy import String, literal, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from app.crud.doctors import doctor_crud_service
 from app.crud.patients import patient_crud_service
-from app import schema
-
-from passlib.context import CryptContext
-
-# # Define the password hashing context
-
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+from app import models, schema
+from app.cache import principal_cache, token_version_cache
+from app.hashing import password_hasher
 
 # def hash_password(password: str):
 #     return pwd_context.hash(password)
@@ -18,11 +16,60 @@ pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 #     return pwd_context.verify(password, hashed_password)
 
 
+def is_email_credential(credential: str) -> bool:
+    # emails always carry an '@', hospital card IDs (MEDFLOW/PAT/24/001) and staff IDs never do
+    return "@" in credential
+
+
+# The credential is joined against both tables at once and only the columns
+# matching its format are probed, so a lookup is always a single round trip.
+def resolve_user_statement(credential: str):
+    if is_email_credential(credential):
+        patient_column, doctor_column = models.Patient.email, models.Doctor.email
+    else:
+        patient_column, doctor_column = models.Patient.hospital_card_id, models.Doctor.hospital_id
+
+    lookup = select(literal(credential, String).label("credential")).subquery()
+    return (
+        select(models.Patient, models.Doctor)
+        .select_from(lookup)
+        .outerjoin(models.Patient, patient_column == lookup.c.credential)
+        .outerjoin(models.Doctor, doctor_column == lookup.c.credential)
+        .limit(1)
+    )
+
+
+def _user_with_role(row):
+    patient, doctor = row if row else (None, None)
+    if patient:
+        return patient, schema.UserRole.PATIENT
+    if doctor:
+        return doctor, schema.UserRole.DOCTOR
+    return None, None
+
+
+# Resolve a credential to (user, role)
+def resolve_user(db: Session, credential: str):
+    return _user_with_role(db.execute(resolve_user_statement(credential)).first())
+
+
+async def resolve_user_async(db: AsyncSession, credential: str):
+    result = await db.execute(resolve_user_statement(credential))
+    return _user_with_role(result.first())
+
+
+def user_role(user) -> schema.UserRole:
+    return schema.UserRole.DOCTOR if isinstance(user, models.Doctor) else schema.UserRole.PATIENT
+
+
 # For authentication to know whether the user exists as a patient or doctor in database
 def get_user(db: Session, credential: str):
-    user = patient_crud_service.get_patient(db, credential)
-    if not user:
-        user = doctor_crud_service.get_doctor(db, credential)
+    user, _ = resolve_user(db, credential)
+    return user
+
+
+async def get_user_async(db: AsyncSession, credential: str):
+    user, _ = await resolve_user_async(db, credential)
     return user
 
 
@@ -71,9 +118,13 @@ def update_password(payload: schema.PasswordReset, db: Session):
     if payload.new_password != payload.confirm_password:
         return False
     
-    hashed_password = pwd_context.hash(payload.new_password)
+    hashed_password = password_hasher.hash_sync(payload.new_password)
     user.password = hashed_password
+    # revokes every stateless token issued before the reset
+    user.token_version = (user.token_version or 0) + 1
 
     db.commit()
     db.refresh(user)
+    principal_cache.invalidate(user.email)
+    token_version_cache.invalidate((user_role(user), user.id))
     return user
\ No newline at end of file
@@ -0,0 +1,48 @@
+"""Measure bcrypt throughput per cost setting to size login capacity.
+
+    python -m benchmarks.bench_hashing --rounds 10 11 12 13 --seconds 3
+
+For each cost factor it reports hashes per second on one core and across every
+worker of a pool, plus the per-core figure that peak-hour sizing should use.
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.hashing import build_context
+
+
+def _throughput(context, workers: int, seconds: float) -> float:
+    deadline = time.perf_counter() + seconds
+
+    def run() -> int:
+        done = 0
+        while time.perf_counter() < deadline:
+            context.hash("Benchmark1234$")
+            done += 1
+        return done
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        total = sum(pool.map(lambda _: run(), range(workers)))
+    return total / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rounds", type=int, nargs="+", default=[10, 11, 12, 13])
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--seconds", type=float, default=3.0)
+    args = parser.parse_args()
+
+    print(f"{'rounds':>6} {'ms/hash':>9} {'1 core/s':>10} {f'{args.workers} cores/s':>12} {'per core/s':>11}")
+    for rounds in args.rounds:
+        context = build_context(rounds)
+        single = _throughput(context, 1, args.seconds)
+        pooled = _throughput(context, args.workers, args.seconds)
+        print(f"{rounds:>6} {1000 / single:>9.1f} {single:>10.2f} {pooled:>12.2f} {pooled / args.workers:>11.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Compare list response serialisation: FastAPI's default path vs the TypeAdapter path.
+
+    python -m benchmarks.bench_serialization --rows 1000 --repeat 20
+
+"before" is what FastAPI does with a response_model: validate the ORM rows, serialise
+them to Python dicts, jsonable_encoder and json.dumps (JSONResponse). "after" is
+app.serializers.json_list_response. Times are milliseconds per call (best of --repeat).
+"""
+import argparse
+import asyncio
+import time
+from datetime import date, datetime, timezone
+from typing import List
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_model_field
+
+from app import models, schema
+from app.serializers import appointment_list, doctor_list, json_list_response, patient_list
+
+
+def _patient(i: int) -> models.Patient:
+    return models.Patient(
+        id=i, title="Mr", first_name="John", last_name="Doe%d" % i, phone_number="0901111111",
+        date_of_birth=date(1990, 4, 25), age=34, gender="Male", address_line1="60, ikeja street 1",
+        address_line2="60, ikeja street", city="Ikeja", state="Lagos", zip_code="23401", country="Nigeria",
+        hospital_card_id="MEDFLOW/PAT/24/%06d" % i, email="patient%d@email.com" % i, password="x", is_active=True)
+
+
+def _doctor(i: int) -> models.Doctor:
+    return models.Doctor(
+        id=i, title="Dr.", first_name="Henry", last_name="Ojeh%d" % i, phone_number="0801234567",
+        date_of_birth=date(1987, 4, 25), age=37, gender="Male", hospital_id="MEDFLOW/MED/SG/%06d" % i,
+        email="doctor%d@email.com" % i, specialization="Surgeon", address_line1="15, doctor house",
+        address_line2="20, doctor avenue", city="Victoria Island", state="Lagos", zip_code="23401",
+        country="Nigeria", is_available=True, password="x")
+
+
+def _appointment(i: int) -> models.Appointment:
+    return models.Appointment(
+        id=i, diagnosis="Malaria", severity="Mild", patient_id=i, doctor_id=i, patient=_patient(i),
+        doctor=_doctor(i), appointment_date=datetime(2024, 10, 25, tzinfo=timezone.utc),
+        status=schema.AppointmentStatus.PENDING)
+
+
+def _best(function, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    return min(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    cases = [
+        ("patients", List[schema.Patient], patient_list, _patient),
+        ("doctors", List[schema.Doctor], doctor_list, _doctor),
+        ("appointments", List[schema.AppointmentResponse], appointment_list, _appointment),
+    ]
+    print(f"{'endpoint':>12} {'before ms':>10} {'after ms':>9} {'speedup':>8}  ({args.rows} rows)")
+    for name, annotation, adapter, build in cases:
+        rows = [build(i) for i in range(1, args.rows + 1)]
+        field = create_model_field(name="Response_" + name, type_=annotation, mode="serialization")
+
+        def before():
+            content = asyncio.run(serialize_response(field=field, response_content=rows))
+            return JSONResponse(content).body
+
+        def after():
+            return json_list_response(adapter, rows).body
+
+        assert len(before()) > 0 and len(after()) > 0
+        slow, fast = _best(before, args.repeat), _best(after, args.repeat)
+        print(f"{name:>12} {slow:>10.2f} {fast:>9.2f} {slow / fast:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()